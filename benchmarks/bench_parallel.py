@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# Times the analysis of one large file split across worker processes (partials.parallel_partial())
+# against a single process reading it from start to end. The synthetic file has a quoted note
+# column, some of whose values span lines.
+#
+#   python benchmarks/bench_parallel.py [file size in MiB] [largest number of workers]
+
+import csv
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benford import partials
+
+
+def write_csv(path, size):
+    rng = random.Random(0)
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['id', 'amount', 'quantity', 'note'])
+        block = [[i, f'{rng.lognormvariate(5, 2):.2f}', rng.randint(1, 10 ** 4),
+                  'multi\nline "note"' if i % 50 == 0 else f'note {i}'] for i in range(10000)]
+        while f.tell() < size:
+            writer.writerows(block)
+
+
+def main():
+    size = int(sys.argv[1]) << 20 if len(sys.argv) > 1 else 64 << 20
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count() or 1
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / 'large.csv'
+        write_csv(path, size)
+        print(f'{path.stat().st_size / (1 << 20):.0f} MiB, {os.cpu_count()} CPU(s)')
+
+        start = time.perf_counter()
+        expected = partials.compute_partial(path, 0, path.stat().st_size)
+        serial = time.perf_counter() - start
+        print(f'   1 process : {serial:7.2f}s')
+
+        workers = 2
+        while workers <= max_workers:
+            start = time.perf_counter()
+            merged = partials.parallel_partial(path, workers)
+            seconds = time.perf_counter() - start
+            assert merged['columns'] == expected['columns']
+            print(f'{workers:>4} workers: {seconds:7.2f}s  {serial / seconds:5.2f}x')
+            workers *= 2
+
+
+if __name__ == '__main__':
+    main()
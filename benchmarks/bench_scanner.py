@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# Compares util.scan() against the exception-driven parse_numeric()/get_first_digit() path
+# on a mix of numeric, formatted, blank and text cells.
+#
+#   python benchmarks/bench_scanner.py [number of cells]
+
+import random
+import sys
+import timeit
+
+from benford import util
+
+
+def sample_cells(n):
+    random.seed(0)
+    makers = [
+        lambda: str(random.randint(1, 10 ** 6)),
+        lambda: f'{random.lognormvariate(5, 3):.2f}',
+        lambda: f'${random.randint(1, 10 ** 6):,}',
+        lambda: f'-{random.random():.4f}',
+        lambda: '',
+        lambda: random.choice(['Nunavut', 'Storage & Organization', 'N/A', 'Muhammed MacIntyre']),
+    ]
+    return [random.choice(makers)() for _ in range(n)]
+
+
+def legacy(cells):
+    digits = []
+    for cell in cells:
+        if not cell:
+            continue
+        try:
+            util.parse_numeric(cell)
+        except ValueError:
+            continue
+        try:
+            digits.append(int(util.get_first_digit(cell)))
+        except ValueError:
+            pass
+    return digits
+
+
+def scanner(cells):
+    digits = []
+    for cell in cells:
+        digit = util.scan(cell)[1]
+        if digit is not None:
+            digits.append(digit)
+    return digits
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    cells = sample_cells(n)
+    assert legacy(cells) == scanner(cells)
+    for name, func in [('parse_numeric/get_first_digit', legacy), ('scan', scanner)]:
+        seconds = min(timeit.repeat(lambda: func(cells), number=1, repeat=5))
+        print(f'{name:>32}: {seconds:.3f}s ({n / seconds / 1e6:.2f}M cells/s)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# Compares request throughput of the Flask development server with the pre-forking server
+# (benford.serve). Each server gets a fresh database with one uploaded CSV file, is warmed up
+# with one request per URL, and is then sent GETs of the file list, preview and analysis from a
+# number of concurrent clients.
+#
+#   python benchmarks/bench_serving.py [requests per server] [concurrent clients] [workers]
+
+import concurrent.futures
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+from uuid import uuid4
+
+DEV_SERVER = '''
+import sys
+from benford.app import create_app
+create_app(sys.argv[1]).run(host='127.0.0.1', port=int(sys.argv[2]), threaded=True)
+'''
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def synthetic_csv(rows=5000):
+    rng = random.Random(0)
+    lines = ['id,amount,quantity'] + [
+        f'{i},{rng.lognormvariate(5, 2):.2f},{rng.randint(1, 10 ** 4)}' for i in range(rows)
+    ]
+    return '\n'.join(lines).encode()
+
+
+def upload(base_url, data):
+    boundary = uuid4().hex
+    body = b''.join([
+        f'--{boundary}\r\nContent-Disposition: form-data; name="csv"; filename="bench.csv"\r\n'.encode(),
+        b'Content-Type: text/csv\r\n\r\n', data, f'\r\n--{boundary}--\r\n'.encode(),
+    ])
+    request = urllib.request.Request(f'{base_url}/upload', data=body,
+                                     headers={'Content-Type': f'multipart/form-data; boundary={boundary}'})
+    with urllib.request.urlopen(request) as response:
+        response.read()
+
+
+def wait_for(base_url, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            sys.exit('The server exited during startup')
+        try:
+            with urllib.request.urlopen(f'{base_url}/csv'):
+                return
+        except OSError:
+            time.sleep(0.1)
+    sys.exit('The server did not start in time')
+
+
+def get(url):
+    with urllib.request.urlopen(url) as response:
+        response.read()
+
+
+def measure(command, port, data, num_requests, clients):
+    base_url = f'http://127.0.0.1:{port}'
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for(base_url, process)
+        upload(base_url, data)
+        urls = [f'{base_url}/csv', f'{base_url}/csv/1/preview', f'{base_url}/csv/1/analysis']
+        for url in urls:
+            get(url)
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=clients) as executor:
+            list(executor.map(get, [urls[i % len(urls)] for i in range(num_requests)]))
+        return num_requests / (time.perf_counter() - start)
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    num_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    clients = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else (os.cpu_count() or 1) * 2 + 1
+    data = synthetic_csv()
+    print(f'{num_requests} requests from {clients} clients, {os.cpu_count()} CPU(s)')
+    with tempfile.TemporaryDirectory() as directory:
+        servers = [
+            ('flask run (threaded)', lambda db_path, port: [sys.executable, '-c', DEV_SERVER, db_path, str(port)]),
+            (f'benford.serve, {workers} workers', lambda db_path, port: [
+                sys.executable, '-m', 'benford.serve', '--bind', f'127.0.0.1:{port}',
+                '--workers', str(workers), '--db-path', db_path,
+            ]),
+        ]
+        for i, (name, command) in enumerate(servers):
+            db_path = str(Path(directory) / f'benford-{i}.db')
+            port = free_port()
+            rate = measure(command(db_path, port), port, data, num_requests, clients)
+            print(f'{name:>32}: {rate:8.1f} requests/s')
+
+
+if __name__ == '__main__':
+    main()
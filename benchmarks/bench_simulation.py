@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+# Times util.simulated_p_value() for a range of sample sizes and thread counts.
+#
+#   python benchmarks/bench_simulation.py [number of replicates]
+
+import os
+import sys
+import timeit
+
+from benford import util
+
+
+def main():
+    simulations = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    observed = util.observed_distribution([1] * 30 + [2] * 18 + [3] * 12 + [4] * 10 + [5] * 8
+                                          + [6] * 7 + [7] * 6 + [8] * 5 + [9] * 4)
+    for n in [100, 10 ** 4, 10 ** 6]:
+        scaled = {digit: count * n // 100 for digit, count in observed.items()}
+        for workers in sorted({1, os.cpu_count() or 1}):
+            seconds = min(timeit.repeat(
+                lambda: util.simulated_p_value(scaled, simulations, workers=workers), number=1, repeat=5
+            ))
+            print(f'n={n:>9} workers={workers:>3}: {seconds:.3f}s for {simulations} replicates')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# Times a cold start of a worker process (interpreter start, importing benford.app and
+# create_app() on an existing database) and fails if the median exceeds the budget.
+#
+#   python benchmarks/bench_startup.py [number of runs] [budget in seconds]
+
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BUDGET = 0.75
+HEAVY_MODULES = ['flask_rest_jsonapi', 'marshmallow_jsonapi', 'marshmallow', 'chardet', 'pyarrow', 'numpy']
+
+STARTUP_SCRIPT = '''
+import sys, time
+start = time.perf_counter()
+from benford.app import create_app
+create_app(sys.argv[1])
+print(time.perf_counter() - start)
+print(','.join(name for name in sys.argv[2:] if name in sys.modules))
+'''
+
+
+def start_worker(db_path):
+    start = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, '-c', STARTUP_SCRIPT, db_path, *HEAVY_MODULES],
+        check=True, capture_output=True, text=True,
+    ).stdout.splitlines()
+    return time.perf_counter() - start, float(output[0]), output[1]
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    budget = float(sys.argv[2]) if len(sys.argv) > 2 else BUDGET
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = str(Path(directory) / 'benford.db')
+        subprocess.run([sys.executable, '-c', f'from benford.app import create_app; create_app({db_path!r})'],
+                       check=True)
+        results = [start_worker(db_path) for _ in range(runs)]
+
+    process = statistics.median(result[0] for result in results)
+    app = statistics.median(result[1] for result in results)
+    print(f'process start: {process:.3f}s median, {min(result[0] for result in results):.3f}s best')
+    print(f'  create_app(): {app:.3f}s median')
+    print(f'heavy modules loaded at startup: {results[0][2] or "none"}')
+    if process > budget:
+        sys.exit(f'Startup exceeded the budget of {budget:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# Compares the memory and speed of tables.Table, which stores each column as one string plus an
+# array of offsets, with the list of row lists that viable_rows() returns, on a synthetic file
+# with an amount, a quantity and a short text column.
+#
+#   PYTHONPATH=. python benchmarks/bench_table.py [number of rows]
+
+import gc
+import random
+import sys
+import time
+import tracemalloc
+
+from benford import tables, util
+
+
+def sample_rows(n):
+    rng = random.Random(0)
+    rows = [['amount', 'quantity', 'label']]
+    rows.extend([f'{rng.lognormvariate(5, 2):.2f}', str(rng.randint(1, 10 ** 4)), f'item {i % 997}']
+                for i in range(n))
+    return rows
+
+
+def retained(build):
+    # Bytes still allocated once build() has returned, along with its result
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = build()
+        return result, tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+
+def best_time(function, repeat=5):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def tally_lists(rows, index):
+    counts = util.DigitCounts()
+    counts.update([row[index] for row in rows])
+    return counts
+
+
+def tally_table(table, index):
+    counts = util.DigitCounts()
+    table.column(index).tally(counts)
+    return counts
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    # Rows are re-read as fresh strings, as a parser would produce them, so that neither
+    # representation shares cells with the sample
+    lines = ['\x1f'.join(row) for row in sample_rows(n)]
+    rows, list_bytes = retained(lambda: [line.split('\x1f') for line in lines])
+    table, table_bytes = retained(lambda: tables.Table.from_rows(line.split('\x1f') for line in lines))
+    assert list(table.rows()) == rows
+    print(f'{n} rows x 3 columns')
+    print(f'{"lists of rows":>16}: {list_bytes / (1 << 20):8.1f} MiB')
+    print(f'{"table":>16}: {table_bytes / (1 << 20):8.1f} MiB  ({list_bytes / table_bytes:.1f}x smaller)')
+
+    expected = tally_lists(rows, 0).counts
+    assert tally_table(table, 0).counts == expected
+    list_seconds = best_time(lambda: tally_lists(rows, 0))
+    table_seconds = best_time(lambda: tally_table(table, 0))
+    slice_seconds = best_time(lambda: table.column(0)[n // 4:3 * n // 4])
+    print(f'{"tally lists":>16}: {list_seconds:8.3f}s')
+    print(f'{"tally table":>16}: {table_seconds:8.3f}s  ({list_seconds / table_seconds:.2f}x)')
+    print(f'{"slice half":>16}: {slice_seconds * 1e6:8.1f}us')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# Drives the app with concurrent clients sending a weighted mix of uploads, listings, previews
+# and analyses of synthetic CSV files, then reports throughput, latency percentiles and error
+# rates per endpoint. By default the app runs in this process on a temporary database; pass
+# --url to load test a running server instead, e.g. one started with `python -m benford.serve`.
+#
+#   PYTHONPATH=. python benchmarks/loadtest.py --requests 2000 --clients 16 \
+#       --mix upload=1,list=4,preview=3,analysis=2 [--url http://127.0.0.1:8000] [--json]
+
+import argparse
+import concurrent.futures
+import io
+import json
+import math
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+from uuid import uuid4
+
+DEFAULT_MIX = 'upload=1,list=4,preview=3,analysis=2'
+PERCENTILES = [50, 95, 99]
+
+
+def synthetic_csv(rng, rows, columns):
+    # An id column followed by columns of lognormal amounts, which roughly follow Benford's law
+    header = ['id'] + [f'amount_{i}' for i in range(columns)]
+    lines = [','.join(header)]
+    for row in range(rows):
+        lines.append(','.join([str(row)] + [f'{rng.lognormvariate(5, 2):.2f}' for _ in range(columns)]))
+    return '\n'.join(lines).encode()
+
+
+class InProcessClient:
+    # Requests go through a Flask test client, one per thread
+    def __init__(self, app):
+        self.app = app
+        self.local = threading.local()
+
+    @property
+    def client(self):
+        if not hasattr(self.local, 'client'):
+            self.local.client = self.app.test_client()
+        return self.local.client
+
+    def get(self, path):
+        response = self.client.get(path)
+        return response.status_code, response.data
+
+    def upload(self, filename, data):
+        response = self.client.post('/upload', data={'csv': (io.BytesIO(data), filename)})
+        return response.status_code, response.data
+
+
+class HttpClient:
+    def __init__(self, base_url, timeout):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def open(self, request):
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as error:
+            return error.code, error.read()
+
+    def get(self, path):
+        return self.open(self.base_url + path)
+
+    def upload(self, filename, data):
+        boundary = uuid4().hex
+        body = b''.join([
+            f'--{boundary}\r\nContent-Disposition: form-data; name="csv"; filename="{filename}"\r\n'.encode(),
+            b'Content-Type: text/csv\r\n\r\n', data, f'\r\n--{boundary}--\r\n'.encode(),
+        ])
+        return self.open(urllib.request.Request(
+            f'{self.base_url}/upload', data=body,
+            headers={'Content-Type': f'multipart/form-data; boundary={boundary}'},
+        ))
+
+
+class LoadTest:
+    def __init__(self, client, rows, columns, seed):
+        self.client = client
+        self.rows = rows
+        self.columns = columns
+        self.seed = seed
+        self.ids = []
+        self.lock = threading.Lock()
+        self.results = {}
+
+    def upload(self, rng):
+        data = synthetic_csv(rng, self.rows, self.columns)
+        status, body = self.client.upload(f'loadtest-{uuid4().hex}.csv', data)
+        if status == 201:
+            with self.lock:
+                self.ids.append(json.loads(body)['data']['id'])
+        return status
+
+    def list(self, rng):
+        return self.client.get('/csv')[0]
+
+    def preview(self, rng):
+        return self.client.get(f'/csv/{rng.choice(self.ids)}/preview')[0]
+
+    def analysis(self, rng):
+        return self.client.get(f'/csv/{rng.choice(self.ids)}/analysis')[0]
+
+    def run_one(self, operation, index):
+        rng = random.Random(self.seed * 1000003 + index)
+        start = time.perf_counter()
+        try:
+            status = getattr(self, operation)(rng)
+        except OSError as error:
+            status = type(error).__name__
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.results.setdefault(operation, []).append((elapsed, status))
+
+    def run(self, mix, num_requests, clients, initial_files):
+        # Previews and analyses need files to pick from
+        rng = random.Random(self.seed)
+        for _ in range(initial_files):
+            if self.upload(rng) != 201:
+                sys.exit('Uploading the initial files failed')
+        operations, weights = zip(*mix.items())
+        schedule = rng.choices(operations, weights, k=num_requests)
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=clients) as executor:
+            list(executor.map(self.run_one, schedule, range(num_requests)))
+        return time.perf_counter() - start
+
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(','):
+        name, _, weight = item.partition('=')
+        if name not in ('upload', 'list', 'preview', 'analysis'):
+            raise argparse.ArgumentTypeError(f'unknown operation {name!r}')
+        try:
+            mix[name] = float(weight or 1)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f'invalid weight {weight!r} for {name}')
+    if not any(weight > 0 for weight in mix.values()):
+        raise argparse.ArgumentTypeError('at least one operation needs a positive weight')
+    return mix
+
+
+def percentile(sorted_values, p):
+    # Nearest-rank percentile
+    return sorted_values[max(math.ceil(p / 100 * len(sorted_values)) - 1, 0)]
+
+
+def summarize(results, duration):
+    summary = {}
+    everything = [result for operation in sorted(results) for result in results[operation]]
+    for operation, samples in [*sorted(results.items()), ('total', everything)]:
+        latencies = sorted(elapsed for elapsed, _ in samples)
+        errors = sum(1 for _, status in samples if not isinstance(status, int) or status >= 400)
+        summary[operation] = {
+            'requests': len(samples),
+            'throughput': len(samples) / duration,
+            'errors': errors,
+            'errorRate': errors / len(samples),
+            **{f'p{p}': percentile(latencies, p) * 1000 for p in PERCENTILES},
+        }
+    return summary
+
+
+def print_summary(summary, duration):
+    print(f'{"endpoint":<10} {"requests":>8} {"req/s":>8} {"errors":>7} {"err %":>6}'
+          + ''.join(f' {f"p{p} ms":>8}' for p in PERCENTILES))
+    for operation, row in summary.items():
+        print(f'{operation:<10} {row["requests"]:>8} {row["throughput"]:>8.1f} {row["errors"]:>7}'
+              f' {row["errorRate"] * 100:>6.2f}' + ''.join(f' {row[f"p{p}"]:>8.1f}' for p in PERCENTILES))
+    print(f'{duration:.2f}s elapsed')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the Benford analysis service.')
+    parser.add_argument('--url', help='base URL of a running server (default: run the app in-process)')
+    parser.add_argument('--requests', type=int, default=1000, help='number of requests to send')
+    parser.add_argument('--clients', type=int, default=8, help='number of concurrent clients')
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help=f'relative weights of the operations (default: {DEFAULT_MIX})')
+    parser.add_argument('--rows', type=int, default=2000, help='rows per synthetic CSV file')
+    parser.add_argument('--columns', type=int, default=3, help='numeric columns per synthetic CSV file')
+    parser.add_argument('--initial-files', type=int, default=5, help='files uploaded before the test starts')
+    parser.add_argument('--timeout', type=float, default=60, help='seconds to wait for each HTTP response')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help='print the summary as JSON')
+    args = parser.parse_args()
+    if args.initial_files < 1 and {'preview', 'analysis'} & set(args.mix):
+        parser.error('previews and analyses need at least one initial file')
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.url:
+            client = HttpClient(args.url, args.timeout)
+        else:
+            from benford.app import create_app
+            client = InProcessClient(create_app(str(Path(directory) / 'benford.db')))
+        test = LoadTest(client, args.rows, args.columns, args.seed)
+        duration = test.run(args.mix, args.requests, args.clients, args.initial_files)
+
+    summary = summarize(test.results, duration)
+    if args.json:
+        print(json.dumps({'duration': duration, 'endpoints': summary}, indent=2))
+    else:
+        print_summary(summary, duration)
+
+
+if __name__ == '__main__':
+    main()
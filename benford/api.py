@@ -1,9 +1,12 @@
+from flask import current_app, has_request_context, request
 from flask_rest_jsonapi import ResourceList, ResourceDetail
-from marshmallow import post_dump
+from flask_rest_jsonapi.exceptions import BadRequest
+from marshmallow import ValidationError, post_dump
 from marshmallow_jsonapi import fields
 from marshmallow_jsonapi.flask import Schema, Relationship
 
-from .models import CSVFile, db
+from .models import ColumnSummary, CSVFile, Stream, db
+from . import util
 from .util import underscore_to_camel
 
 
@@ -30,6 +33,17 @@ class CSVSchema(Schema):
         schema='AnalysisSchema',
         type_='analysis'
     )
+    # Filtering on this finds files by their results, e.g.
+    # filter=[{"name": "columns", "op": "any", "val": {"name": "fails_0_01", "op": "eq", "val": true}}]
+    columns = Relationship(
+        related_view='csv_columns',
+        related_view_kwargs={'id': '<id>'},
+        attribute='column_summaries',
+        many=True,
+        schema='ColumnSummarySchema',
+        type_='columnSummary',
+        dump_only=True
+    )
 
 
 class CSVDetail(ResourceDetail):
@@ -99,6 +113,7 @@ class ColumnSchema(Schema):
     test_statistic = fields.Float(dump_only=True)
     critical_values = fields.List(fields.Float, dump_only=True)
     goodness_of_fit = fields.List(fields.Boolean, dump_only=True)
+    simulation = fields.Dict(dump_only=True)
 
 
 class AnalysisSchema(Schema):
@@ -120,14 +135,32 @@ class AnalysisSchema(Schema):
 
     @post_dump(pass_many=False, pass_original=True)
     def add_analysis_fields(self, data, csvfile, **kwargs):
-        analyses = []
-
-        for column_index in csvfile.viable_columns():
-            analyses.append(csvfile.analysis(column_index))
-
-        data['columns'] = analyses
+        data['columns'] = csvfile.analyses()
+        if has_request_context() and 'simulations' in request.args:
+            self.add_simulations(data['columns'])
         return data
 
+    @staticmethod
+    def add_simulations(columns):
+        # ?simulations=N adds a Monte Carlo p-value to each column, e.g. for small samples
+        try:
+            simulations = int(request.args['simulations'])
+            seed = int(request.args.get('seed', util.SIMULATION_SEED))
+        except ValueError:
+            raise BadRequest('simulations and seed must be integers', source={'parameter': 'simulations'})
+        max_simulations = current_app.config['MAX_SIMULATIONS']
+        if not 0 < simulations <= max_simulations:
+            raise BadRequest(f'simulations must be between 1 and {max_simulations}',
+                             source={'parameter': 'simulations'})
+        if not util.NUMPY_AVAILABLE:
+            raise BadRequest('Simulation-based tests require NumPy', source={'parameter': 'simulations'})
+        for column in columns:
+            column['simulation'] = {
+                'simulations': simulations,
+                'seed': seed,
+                'pValue': util.simulated_p_value(column['observedDistribution'], simulations, seed),
+            }
+
 
 class CSVAnalysis(ResourceDetail):
     schema = AnalysisSchema
@@ -135,3 +168,126 @@ class CSVAnalysis(ResourceDetail):
         'session': db.session,
         'model': CSVFile,
     }
+
+
+class ColumnSummarySchema(Schema):
+    class Meta:
+        type_ = 'columnSummary'
+        self_view_many = 'column_list'
+        inflect = underscore_to_camel
+
+    id = fields.Integer(as_string=True, dump_only=True)
+    column_index = fields.Integer(dump_only=True)
+    name = fields.String(dump_only=True)
+    n = fields.Integer(dump_only=True)
+    test_statistic = fields.Float(dump_only=True)
+    fails_0_10 = fields.Boolean(dump_only=True)
+    fails_0_05 = fields.Boolean(dump_only=True)
+    fails_0_025 = fields.Boolean(dump_only=True)
+    fails_0_01 = fields.Boolean(dump_only=True)
+    fails_0_001 = fields.Boolean(dump_only=True)
+    # flask_rest_jsonapi filters /csv/<id>/columns by this relationship's id_field
+    csv = Relationship(
+        self_view='csv_detail',
+        self_view_kwargs={'id': '<csv_file_id>'},
+        attribute='csv_file',
+        id_field='csv_file_id',
+        schema='CSVSchema',
+        type_='csv'
+    )
+
+
+class ColumnList(ResourceList):
+    # Analyzed columns of every file, filtered and sorted in SQL, e.g. the columns failing at
+    # p = 0.01 with more than 10,000 values in files uploaded since July, largest first:
+    #   filter=[{"name": "fails_0_01", "op": "eq", "val": true}, {"name": "n", "op": "gt", "val": 10000},
+    #           {"name": "csv", "op": "has", "val": {"name": "date_created", "op": "ge", "val": "2026-07-01"}}]
+    #   &sort=-n
+    schema = ColumnSummarySchema
+    methods = ['GET']
+    data_layer = {
+        'session': db.session,
+        'model': ColumnSummary,
+    }
+
+
+class CSVColumnList(ColumnList):
+    # The columns of one file, with pagination links that keep the file's id
+    methods = ['GET']
+    view_kwargs = True
+
+
+def validate_column_names(value):
+    if not isinstance(value, list) or not value or not all(isinstance(name, str) for name in value):
+        raise ValidationError('Must be a non-empty list of column names.')
+
+
+class StreamSchema(Schema):
+    class Meta:
+        type_ = 'stream'
+        self_view = 'stream_detail'
+        self_view_kwargs = {'id': '<id>'}
+        self_view_many = 'stream_list'
+        inflect = underscore_to_camel
+
+    id = fields.Integer(as_string=True, dump_only=True)
+    name = fields.String(required=True)
+    date_created = fields.DateTime(dump_only=True)
+    # A Raw field, because flask_rest_jsonapi can't create objects from schemas with List fields
+    columns = fields.Raw(required=True, validate=validate_column_names)
+    num_rows = fields.Integer(dump_only=True)
+    analysis = Relationship(
+        self_view='stream_analysis',
+        self_view_kwargs={'id': '<id>'},
+        schema='StreamAnalysisSchema',
+        type_='streamAnalysis'
+    )
+
+
+class StreamList(ResourceList):
+    schema = StreamSchema
+    data_layer = {
+        'session': db.session,
+        'model': Stream,
+    }
+
+
+class StreamDetail(ResourceDetail):
+    schema = StreamSchema
+    methods = ['GET', 'DELETE']
+    data_layer = {
+        'session': db.session,
+        'model': Stream,
+    }
+
+
+class StreamAnalysisSchema(Schema):
+    class Meta:
+        type_ = 'streamAnalysis'
+        self_view = 'stream_analysis'
+        self_view_kwargs = {'id': '<id>'}
+        inflect = underscore_to_camel
+
+    id = fields.Integer(as_string=True, dump_only=True)
+    name = fields.String(dump_only=True)
+    num_rows = fields.Integer(dump_only=True)
+    stream = Relationship(
+        self_view='stream_detail',
+        self_view_kwargs={'id': '<id>'},
+        schema='StreamSchema',
+        type_='stream'
+    )
+    # Running totals, read straight from the counters
+    columns = fields.Method('get_columns', dump_only=True)
+
+    def get_columns(self, stream):
+        return stream.analyses()
+
+
+class StreamAnalysis(ResourceDetail):
+    schema = StreamAnalysisSchema
+    methods = ['GET']
+    data_layer = {
+        'session': db.session,
+        'model': Stream,
+    }
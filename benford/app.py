@@ -1,31 +1,170 @@
+import codecs
 import csv
+import importlib
+import json
+import os
+from pathlib import Path
+import tarfile
+import zipfile
 
-from flask import Flask, current_app, render_template, request, url_for
-from flask_rest_jsonapi import Api
+from flask import Flask, Response, current_app, render_template, request, stream_with_context, url_for
 import sqlalchemy.exc
+from werkzeug.exceptions import MethodNotAllowed
 from werkzeug.utils import secure_filename
 
-from .api import CSVList, CSVDetail, CSVPreview, CSVAnalysis
-from .models import CSVFile, db
+from .cache import DEFAULT_BUDGET, datasets
+from .commands import analyze_command, export_command, gc_blobs_command, migrate_blobs_command, upgrade_db_command
+from .export import EXPORT_FORMATS, export_available, export_chunks, export_query
+from .ingest import ingest
+from .models import CSVFile, PushError, Stream, db
+from .parsers import DEFAULT_MEMORY_BUDGET
+from .partials import PartialError, finalize, is_complete, merge_partials
+from .rendering import render_array, render_document
+from .storage import READ_ERRORS, store
+from .subsets import SubsetError
+from .timeseries import WindowError
+from . import parsers, util
+
+DEFAULT_ROWS_LIMIT = 50
+MAX_ROWS_LIMIT = 1000
+# Well under SQLite's limit on bound parameters, which the ids of an export are passed as
+MAX_EXPORT_IDS = 500
+
+STREAM_FORMATS = {'ndjson': 'application/x-ndjson', 'sse': 'text/event-stream'}
+
+# JSON:API resources from benford.api: (resource, endpoint, url)
+RESOURCES = [
+    ('CSVList', 'csv_list', '/csv'),
+    ('CSVDetail', 'csv_detail', '/csv/<int:id>'),
+    ('CSVPreview', 'preview', '/csv/<int:id>/preview'),
+    ('CSVAnalysis', 'analysis', '/csv/<int:id>/analysis'),
+    ('CSVColumnList', 'csv_columns', '/csv/<int:id>/columns'),
+    ('ColumnList', 'column_list', '/columns'),
+    ('StreamList', 'stream_list', '/streams'),
+    ('StreamDetail', 'stream_detail', '/streams/<int:id>'),
+    ('StreamAnalysis', 'stream_analysis', '/streams/<int:id>/analysis'),
+]
+
+
+class LazyResource:
+    # Stands in for a flask_rest_jsonapi resource view until its first request. Importing
+    # flask_rest_jsonapi and marshmallow takes about half of the app's startup time, which
+    # processes that never serve one of these routes don't need to pay.
+    #
+    # Its route takes every method a resource can implement, since the resource's own methods
+    # aren't known until it's loaded; those the resource doesn't allow are then answered with a
+    # 405, and OPTIONS with the methods it does.
+    methods = ['GET', 'POST', 'PATCH', 'DELETE', 'OPTIONS']
+    provide_automatic_options = False
+
+    def __init__(self, name, endpoint, url):
+        self.name = name
+        self.endpoint = endpoint
+        self.url = url
+        self.view = None
+
+    def load(self):
+        if self.view is None:
+            resource = getattr(importlib.import_module('benford.api'), self.name)
+            api = importlib.import_module('flask_rest_jsonapi').Api()
+            # The route is already registered, so the stand-in takes the app's place and
+            # receives the view that Api.route() makes
+            api.app = self
+            api.route(resource, self.endpoint, self.url)
+        return self.view
+
+    def add_url_rule(self, url, view_func, **options):
+        self.view = view_func
+
+    def allowed_methods(self):
+        methods = set(self.load().methods)
+        if 'GET' in methods:
+            methods.add('HEAD')
+        return methods | {'OPTIONS'}
+
+    def __call__(self, *args, **kwargs):
+        allowed = self.allowed_methods()
+        if request.method == 'OPTIONS':
+            response = current_app.response_class()
+            response.allow.update(allowed)
+            return response
+        if request.method not in allowed:
+            raise MethodNotAllowed(sorted(allowed))
+        return self.view(*args, **kwargs)
+
+
+class FastResource(LazyResource):
+    # Plain GETs skip marshmallow and flask_rest_jsonapi and render the same JSON:API document
+    # directly; requests with query parameters (sparse fieldsets, includes, simulations) and
+    # errors still go through the resource
+    def __init__(self, name, endpoint, url, render):
+        super().__init__(name, endpoint, url)
+        self.render = render
+
+    def __call__(self, *args, **kwargs):
+        if request.method == 'GET' and not request.args:
+            csvfile = db.session.get(CSVFile, kwargs['id'])
+            if csvfile is not None:
+                return Response(self.render(csvfile), content_type='application/vnd.api+json')
+        return super().__call__(*args, **kwargs)
+
+
+def csv_relationships(csvfile):
+    return {'csv': {'links': {'self': url_for('csv_detail', id=csvfile.id)}}}
+
+
+def render_preview(csvfile):
+    attributes = {'filename': csvfile.filename, **csvfile.preview()}
+    return render_document('preview', csvfile.id, url_for('preview', id=csvfile.id),
+                           attributes, csv_relationships(csvfile))
+
+
+def render_analysis(csvfile):
+    # Column results are stored as JSON when they are first computed, so they're copied in as is
+    columns = render_array(csvfile.rendered_analyses())
+    return render_document('analysis', csvfile.id, url_for('analysis', id=csvfile.id),
+                           {'filename': csvfile.filename}, csv_relationships(csvfile), {'columns': columns})
+
+
+FAST_RENDERERS = {'preview': render_preview, 'analysis': render_analysis}
 
 
 def home():
     return render_template('index.html')
 
 
+def insert_upload(csvfile):
+    # A concurrent upload of the same content may have stored its Blob first, in which case the
+    # record is inserted again with that Blob rather than failing
+    try:
+        db.session.add(csvfile)
+        db.session.commit()
+    except sqlalchemy.exc.IntegrityError:
+        db.session.rollback()
+        if not csvfile.adopt_stored_blob():
+            raise
+        db.session.add(csvfile)
+        db.session.commit()
+
+
 def upload():
     if 'csv' not in request.files.keys():
         return {'message': 'Error: No usable form data was found'}, 422
     file = request.files['csv']
-    csvfile = CSVFile(file, secure_filename(file.filename))
     try:
-        csvfile.reader()  # Make sure we can read the file
-    except csv.Error:
+        csvfile = CSVFile(file, secure_filename(file.filename))
+    except (csv.Error, UnicodeDecodeError) + READ_ERRORS:
         return {'message': 'Error: This file could not be parsed as a .csv.'}, 422
     try:
-        db.session.add(csvfile)
-        db.session.commit()
+        csvfile.index_rows()  # Make sure we can read the file, and index it for browsing
+    except (csv.Error, UnicodeDecodeError) + READ_ERRORS:
+        csvfile.discard()
+        return {'message': 'Error: This file could not be parsed as a .csv.'}, 422
+    try:
+        insert_upload(csvfile)
     except sqlalchemy.exc.SQLAlchemyError as error:
+        db.session.rollback()
+        csvfile.discard()
         if error.args[0] == '(sqlite3.IntegrityError) UNIQUE constraint failed: csv_file.filename':
             error_msg = 'Error: An uploaded file with that name already exists.'
         else:
@@ -38,25 +177,249 @@ def upload():
         return response
 
 
-def create_app(db_path='./benford.db'):
+def rows(id):
+    csvfile = CSVFile.query.get_or_404(id)
+    try:
+        offset = max(int(request.args.get('offset', 0)), 0)
+        limit = min(int(request.args.get('limit', DEFAULT_ROWS_LIMIT)), MAX_ROWS_LIMIT)
+    except ValueError:
+        return {'message': 'Error: offset and limit must be integers.'}, 400
+    if limit < 1:
+        # An empty page would link to itself as the next one
+        return {'message': 'Error: limit must be at least 1.'}, 400
+
+    data = list(csvfile.dump(offset, offset + limit))
+    num_rows = len(csvfile)
+    links = {'self': url_for('rows', id=id, offset=offset, limit=limit)}
+    if offset + limit < num_rows:
+        links['next'] = url_for('rows', id=id, offset=offset + limit, limit=limit)
+    if offset > 0:
+        links['prev'] = url_for('rows', id=id, offset=max(offset - limit, 0), limit=limit)
+    return {
+        'data': data,
+        'links': links,
+        'meta': {'offset': offset, 'limit': limit, 'numRows': num_rows},
+    }
+
+
+def format_event(stream_format, event, data):
+    if stream_format == 'sse':
+        return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+    return json.dumps({'event': event, 'data': data}) + '\n'
+
+
+def analysis_stream(id):
+    # Sends each column's analysis as soon as it is computed, with progress events in between
+    csvfile = CSVFile.query.get_or_404(id)
+    stream_format = request.args.get('format')
+    if stream_format is None:
+        mimetype = request.accept_mimetypes.best_match(list(STREAM_FORMATS.values()), STREAM_FORMATS['ndjson'])
+        stream_format = next(key for key, value in STREAM_FORMATS.items() if value == mimetype)
+    elif stream_format not in STREAM_FORMATS:
+        return {'message': f'Error: format must be one of {", ".join(STREAM_FORMATS)}.'}, 400
+
+    def generate():
+        num_columns = 0
+        try:
+            for event, data in csvfile.analysis_events():
+                num_columns += event == 'column'
+                yield format_event(stream_format, event, data)
+        except (csv.Error, UnicodeDecodeError) + READ_ERRORS:
+            yield format_event(stream_format, 'error', {'message': 'Error: This file could not be parsed as a .csv.'})
+            return
+        yield format_event(stream_format, 'done', {'numColumns': num_columns})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype=STREAM_FORMATS[stream_format],
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+def time_series(id):
+    # Benford statistics of a column per calendar or rolling window of a date column
+    csvfile = CSVFile.query.get_or_404(id)
+    try:
+        date_column = int(request.args['dateColumn'])
+        column = int(request.args['column'])
+    except (KeyError, ValueError):
+        return {'message': 'Error: dateColumn and column must be integers.'}, 400
+    window = request.args.get('window', 'month')
+    try:
+        data, meta = csvfile.time_series(date_column, column, window, request.args.get('dateFormat'))
+    except WindowError as error:
+        return {'message': f'Error: {error}.'}, 400
+    except (csv.Error, UnicodeDecodeError) + READ_ERRORS as error:
+        return {'message': f'Error: {error}.'}, 422
+    if meta['dateFormat'] is None:
+        return {'message': 'Error: No dates were found in the date column.'}, 422
+    meta.update(dateColumn=date_column, column=column, window=window)
+    return {'data': data, 'meta': meta}
+
+
+def subset_analysis(id):
+    # Benford statistics of the rows [start, end) that satisfy the predicates in `where` (a JSON
+    # list, see benford.subsets), for the viable columns or those in `columns` (comma separated)
+    csvfile = CSVFile.query.get_or_404(id)
+    try:
+        start = int(request.args.get('start', 1))
+        end = int(request.args['end']) if 'end' in request.args else None
+        columns = [int(i) for i in request.args['columns'].split(',')] if request.args.get('columns') else None
+    except ValueError:
+        return {'message': 'Error: start, end and columns must be integers.'}, 400
+    try:
+        where = json.loads(request.args['where']) if 'where' in request.args else None
+    except ValueError:
+        return {'message': 'Error: where must be a JSON list of predicates.'}, 400
+    try:
+        data, meta = csvfile.subset_analyses(start, end, where, columns)
+    except SubsetError as error:
+        return {'message': f'Error: {error}.'}, 400
+    except (csv.Error, UnicodeDecodeError) + READ_ERRORS:
+        return {'message': 'Error: This file could not be parsed as a .csv.'}, 422
+    meta.update(start=max(start, 1), end=end, where=where)
+    return {'data': data, 'meta': meta}
+
+
+def stream_cells(row):
+    return ['' if cell is None else str(cell) for cell in row] if isinstance(row, list) else []
+
+
+def push_rows(id):
+    # Rows come either as JSON ({"rows": [[...], ...]}) or as a CSV body, which can be sent with
+    # chunked transfer encoding and is tallied as it arrives
+    stream = Stream.query.get_or_404(id)
+    if request.is_json:
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict) or not isinstance(payload.get('rows'), list):
+            return {'message': 'Error: Expected a JSON object with a list of rows.'}, 400
+        rows = (stream_cells(row) for row in payload['rows'])
+    else:
+        encoding = request.mimetype_params.get('charset', 'utf-8')
+        rows = csv.reader(codecs.iterdecode(request.stream, encoding))
+    try:
+        num_accepted, num_discarded = stream.push(rows)
+    except PushError as error:
+        # Chunks before the error were committed, so the client learns how many rows to resend
+        meta = {'numAccepted': error.num_accepted, 'numDiscarded': error.num_discarded, 'numRows': stream.num_rows}
+        return {'message': 'Error: The rows could not be parsed as .csv.', 'meta': meta}, 400
+    return {'meta': {'numAccepted': num_accepted, 'numDiscarded': num_discarded, 'numRows': stream.num_rows}}
+
+
+def merge_analysis():
+    # Combines partial results computed by external workers (see benford.partials) into an analysis
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not isinstance(payload.get('partials'), list):
+        return {'message': 'Error: Expected a JSON object with a list of partials.'}, 400
+    try:
+        merged = merge_partials(payload['partials'])
+        # Partials of parts of a file can still be merged, e.g. in a tree of intermediate steps,
+        # but there is no analysis to report until the whole file is covered
+        columns = finalize(merged) if is_complete(merged) else None
+    except PartialError as error:
+        return {'message': f'Error: {error}.'}, 422
+    return {
+        'data': {'columns': columns, 'partial': merged},
+        'meta': {'numRows': merged['numRows'], 'numDiscarded': merged['numDiscarded'], 'ranges': merged['ranges']},
+    }
+
+
+def export_analyses():
+    # Streams a report of the analyses of every stored file, or of those selected by `ids` (comma
+    # separated) and `filename` (a glob), computing any that aren't cached yet
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return {'message': f'Error: format must be one of {", ".join(EXPORT_FORMATS)}.'}, 400
+    if not export_available(export_format):
+        return {'message': f'Error: {export_format} reports are not available on this server.'}, 501
+    try:
+        ids = [int(id) for id in request.args['ids'].split(',')] if request.args.get('ids') else None
+    except ValueError:
+        return {'message': 'Error: ids must be a comma-separated list of integers.'}, 400
+    if ids is not None and len(ids) > MAX_EXPORT_IDS:
+        return {'message': f'Error: At most {MAX_EXPORT_IDS} ids can be exported at once.'}, 400
+    query = export_query(ids, request.args.get('filename'))
+    chunks = export_chunks(export_format, query, workers=current_app.config['EXPORT_WORKERS'])
+    return Response(
+        stream_with_context(chunks),
+        mimetype=EXPORT_FORMATS[export_format],
+        headers={'Content-Disposition': f'attachment; filename=benford-report.{export_format}'}
+    )
+
+
+def cache_metrics():
+    # Counters of this worker's dataset cache, for monitoring how often previews and analyses reuse
+    # a parsed dataset. Each worker process has its own cache.
+    return {'data': datasets.stats(), 'meta': {'pid': os.getpid()}}
+
+
+def bulk_upload():
+    if not request.files:
+        return {'message': 'Error: No usable form data was found'}, 422
+    try:
+        report = ingest(
+            request.files,
+            workers=current_app.config['INGEST_WORKERS'],
+            batch_size=current_app.config['INGEST_BATCH_SIZE']
+        )
+    except (tarfile.TarError, zipfile.BadZipFile):
+        return {'message': 'Error: The archive could not be read.'}, 422
+    created = sum(1 for entry in report if entry['status'] == 'created')
+    return {'data': report, 'meta': {'created': created, 'failed': len(report) - created}}
+
+
+def create_app(db_path='./benford.db', create_schema=None):
+    # The schema is created by `flask upgrade-db`, or here when starting on a new database.
+    # Pass create_schema to force either way.
+    if create_schema is None:
+        create_schema = not Path(db_path).exists()
     app = Flask(__name__)
 
     # Setup db
     app.config.update(
         SQLALCHEMY_DATABASE_URI=f'sqlite:///{db_path}',
-        SQLALCHEMY_TRACK_MODIFICATIONS=False
+        SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        BLOB_STORE_PATH=str(Path(db_path).parent / 'blobs'),
+        INGEST_WORKERS=os.cpu_count() or 1,
+        INGEST_BATCH_SIZE=500,
+        # Exports over HTTP analyze uncached files in the request's own process; `flask export`
+        # has its own --workers
+        EXPORT_WORKERS=1,
+        DATASET_CACHE_BUDGET=DEFAULT_BUDGET,
+        MEMORY_BUDGET=DEFAULT_MEMORY_BUDGET,
+        MAX_SIMULATIONS=util.MAX_SIMULATIONS,
+        PAGE_SIZE=30,
     )
     db.app = app
     db.init_app(app)
-    db.create_all(app=app)
+    if create_schema:
+        db.create_all(app=app)
+    store.init_app(app)
+    datasets.init_app(app)
+    parsers.init_app(app)
+    app.cli.add_command(migrate_blobs_command)
+    app.cli.add_command(upgrade_db_command)
+    app.cli.add_command(gc_blobs_command)
+    app.cli.add_command(analyze_command)
+    app.cli.add_command(export_command)
 
     # Add routes
-    api = Api(app)
+    for name, endpoint, url in RESOURCES:
+        if endpoint in FAST_RENDERERS:
+            view = FastResource(name, endpoint, url, FAST_RENDERERS[endpoint])
+        else:
+            view = LazyResource(name, endpoint, url)
+        app.add_url_rule(url, endpoint, view)
     app.add_url_rule('/', view_func=home)
     app.add_url_rule('/upload', view_func=upload, methods=['POST'])
-    api.route(CSVList, 'csv_list', '/csv')
-    api.route(CSVDetail, 'csv_detail', '/csv/<int:id>')
-    api.route(CSVPreview, 'preview', '/csv/<int:id>/preview')
-    api.route(CSVAnalysis, 'analysis', '/csv/<int:id>/analysis')
+    app.add_url_rule('/upload/bulk', view_func=bulk_upload, methods=['POST'])
+    app.add_url_rule('/csv/<int:id>/rows', view_func=rows)
+    app.add_url_rule('/csv/<int:id>/analysis/stream', view_func=analysis_stream)
+    app.add_url_rule('/csv/<int:id>/analysis/timeseries', view_func=time_series)
+    app.add_url_rule('/csv/<int:id>/analysis/subset', view_func=subset_analysis)
+    app.add_url_rule('/streams/<int:id>/rows', view_func=push_rows, methods=['POST'])
+    app.add_url_rule('/analysis/merge', view_func=merge_analysis, methods=['POST'])
+    app.add_url_rule('/analysis/export', view_func=export_analyses)
+    app.add_url_rule('/metrics/cache', view_func=cache_metrics)
 
     return app
@@ -0,0 +1,98 @@
+from collections import OrderedDict
+import threading
+
+DEFAULT_BUDGET = 256 << 20
+
+
+# Parsed datasets kept in memory between the requests of a worker, so that a preview followed by
+# an analysis parses the file once. Entries are evicted least recently used first once the sizes
+# they were stored with add up to more than the budget. Shared by the threads of a worker.
+class DatasetCache:
+    def __init__(self, budget=DEFAULT_BUDGET):
+        self.budget = budget
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = self.misses = self.evictions = 0
+        self.lock = threading.Lock()
+        # Held while a key is loaded, so that concurrent requests parse a dataset once
+        self.loading = {}
+
+    def init_app(self, app):
+        self.budget = app.config['DATASET_CACHE_BUDGET']
+        self.clear()
+
+    def lookup(self, key):
+        # The cached value or None, counting the hit or miss
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def get(self, key, load):
+        # The cached value, or the value that load(budget) returns as a (value, size) pair and
+        # that is cached if it fits. load() returns None for values it won't fit in the budget.
+        value = self.lookup(key)
+        if value is not None:
+            return value
+        with self.lock:
+            key_lock = self.loading.setdefault(key, threading.Lock())
+        with key_lock:
+            try:
+                with self.lock:
+                    entry = self.entries.get(key)
+                if entry is not None:
+                    # Loaded by another thread while this one waited
+                    return entry[0]
+                loaded = load(self.budget)
+                if loaded is None:
+                    return None
+                self.put(key, *loaded)
+                return loaded[0]
+            finally:
+                with self.lock:
+                    self.loading.pop(key, None)
+
+    def put(self, key, value, size):
+        with self.lock:
+            if size > self.budget:
+                return
+            self.pop(key)
+            self.entries[key] = (value, size)
+            self.size += size
+            while self.size > self.budget:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+
+    def pop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+    def discard(self, key):
+        with self.lock:
+            self.pop(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'budget': self.budget,
+            }
+
+
+datasets = DatasetCache()
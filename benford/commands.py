@@ -0,0 +1,67 @@
+import os
+import time
+
+import click
+from flask.cli import with_appcontext
+
+from .export import EXPORT_FORMATS, export_available, export_chunks, export_query
+from .migrations import migrate_blobs, reconcile_blobs, upgrade_schema
+from .models import CSVFile
+from .partials import parallel_analyses
+from .storage import store
+
+
+@click.command('migrate-blobs')
+@with_appcontext
+def migrate_blobs_command():
+    """Move uploads stored in the database into the blob store."""
+    click.echo(f'Migrated {migrate_blobs()} file(s) to {store.root}')
+
+
+@click.command('upgrade-db')
+@with_appcontext
+def upgrade_db_command():
+    """Bring an existing database up to date with the current models."""
+    for column in upgrade_schema():
+        click.echo(f'Added column {column}')
+
+
+@click.command('gc-blobs')
+@with_appcontext
+def gc_blobs_command():
+    """Recount blob references and delete blobs that are no longer used."""
+    click.echo(f'Deleted {len(reconcile_blobs())} unused blob(s)')
+
+
+@click.command('analyze')
+@click.option('--workers', type=int, default=os.cpu_count() or 1, show_default='number of CPUs',
+              help='Processes to split each file across.')
+@click.argument('ids', nargs=-1, type=int)
+@with_appcontext
+def analyze_command(workers, ids):
+    """Analyze stored files (all of them unless IDS are given) ahead of time."""
+    query = CSVFile.query.order_by(CSVFile.id)
+    if ids:
+        query = query.filter(CSVFile.id.in_(ids))
+    for csvfile in query:
+        start = time.perf_counter()
+        columns = parallel_analyses(csvfile, workers)
+        click.echo(f'{csvfile.filename}: {len(columns)} column(s) in {time.perf_counter() - start:.2f}s')
+
+
+@click.command('export')
+@click.option('--format', 'export_format', type=click.Choice(list(EXPORT_FORMATS)), default='csv', show_default=True)
+@click.option('--output', '-o', type=click.Path(dir_okay=False, allow_dash=True), default='-',
+              help='File to write the report to (default: standard output).')
+@click.option('--workers', type=int, default=os.cpu_count() or 1, show_default='number of CPUs',
+              help='Processes to analyze files that have no cached analyses with.')
+@click.option('--filename', help='Only files whose names match this glob.')
+@click.argument('ids', nargs=-1, type=int)
+@with_appcontext
+def export_command(export_format, output, workers, filename, ids):
+    """Write a report of every stored file's column analyses (or only of IDS)."""
+    if not export_available(export_format):
+        raise click.UsageError(f'{export_format} reports need pyarrow, which is not installed')
+    with click.open_file(output, 'wb') as f:
+        for chunk in export_chunks(export_format, export_query(ids, filename), workers):
+            f.write(chunk)
@@ -0,0 +1,183 @@
+import concurrent.futures
+import csv
+import io
+import os
+
+from benford import formats, partials, util
+from benford.models import ColumnAnalysis, CSVFile
+from benford.storage import READ_ERRORS, store
+
+# Reports of every stored file's column analyses, one record per analyzed column, streamed in
+# batches of files so that neither the files nor the report are ever held in memory at once
+EXPORT_FORMATS = {'csv': 'text/csv', 'parquet': 'application/vnd.apache.parquet'}
+EXPORT_BATCH_SIZE = 100
+
+P_VALUES = list(util.CRITICAL_VALUES)
+REPORT_FIELDS = [
+    'id', 'filename', 'columnIndex', 'columnName', 'n', 'testStatistic',
+    *(f'goodnessOfFit[{p}]' for p in P_VALUES), 'error',
+]
+
+# What reading a file that turns out to be unreadable can raise
+ANALYSIS_ERRORS = (csv.Error, LookupError, UnicodeDecodeError, ValueError) + READ_ERRORS
+
+
+def export_query(ids=None, filename=None):
+    # Stored files by id, optionally only those with the given ids or a filename matching a glob
+    query = CSVFile.query.order_by(CSVFile.id)
+    if ids:
+        query = query.filter(CSVFile.id.in_(ids))
+    if filename:
+        query = query.filter(CSVFile.filename.op('GLOB')(filename))
+    return query
+
+
+def batches(query, batch_size):
+    # Pages through the query by id, which unlike OFFSET doesn't rescan the pages before
+    last_id = None
+    while True:
+        page = query if last_id is None else query.filter(CSVFile.id > last_id)
+        batch = page.limit(batch_size).all()
+        if not batch:
+            return
+        yield batch
+        last_id = batch[-1].id
+
+
+def tally_file(path):
+    return partials.compute_partial(path, 0, os.path.getsize(path))
+
+
+def cached_analyses(batch):
+    # Loads every cached column of a batch of files in one query. The session keeps the loaded
+    # rows, so the analyses below find them without querying one column at a time.
+    digests = {csvfile.sha256 for csvfile in batch if csvfile.sha256 is not None}
+    return {(cached.sha256, cached.column_index): cached
+            for cached in ColumnAnalysis.query.filter(ColumnAnalysis.sha256.in_(digests))}
+
+
+def needs_analysis(csvfile, cached):
+    return any((csvfile.sha256, index) not in cached for index in csvfile.viable_columns())
+
+
+def fill_cache(batch, cached, executor):
+    # Tallies the files that are missing analyses in worker processes, a whole file each. Files
+    # the workers can't read (compressed or not CSV) are left to be analyzed in this process.
+    pending, seen = {}, set()
+    for csvfile in batch:
+        if csvfile.blob is None or csvfile.sha256 in seen:
+            continue
+        seen.add(csvfile.sha256)
+        try:
+            if needs_analysis(csvfile, cached):
+                pending[executor.submit(tally_file, store.full_path(csvfile.blob.path))] = csvfile
+        except ANALYSIS_ERRORS:
+            continue
+    for future in concurrent.futures.as_completed(pending):
+        try:
+            partials.store_partial(pending[future], future.result())
+        except ANALYSIS_ERRORS:
+            continue
+
+
+def file_records(csvfile):
+    try:
+        results = csvfile.analyses()
+    except ANALYSIS_ERRORS:
+        return [(csvfile.id, csvfile.filename, None, None, None, None, *(None for _ in P_VALUES),
+                 'This file could not be parsed as a .csv.')]
+    return [
+        (csvfile.id, csvfile.filename, result['index'], result['name'], result['n'], result['testStatistic'],
+         *(result['goodnessOfFit'][p] for p in P_VALUES), None)
+        for result in results
+    ]
+
+
+def report_batches(query, workers=1, batch_size=None):
+    # Yields the report's records a batch of files at a time
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        for batch in batches(query, batch_size or EXPORT_BATCH_SIZE):
+            cached = cached_analyses(batch)
+            if executor is not None:
+                fill_cache(batch, cached, executor)
+                # Held on to while the batch's records are read, along with what was just cached
+                cached = cached_analyses(batch)
+            yield [record for csvfile in batch for record in file_records(csvfile)]
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+def csv_chunks(record_batches):
+    text = io.StringIO()
+    writer = csv.writer(text)
+    writer.writerow(REPORT_FIELDS)
+    for records in record_batches:
+        writer.writerows(records)
+        yield text.getvalue().encode()
+        text.seek(0)
+        text.truncate()
+    yield text.getvalue().encode()
+
+
+class ChunkSink(io.RawIOBase):
+    # A write-only file that hands out what was written since it was last drained. The Parquet
+    # writer asks for its position to record where row groups start, so that keeps counting.
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def parquet_schema(pyarrow):
+    return pyarrow.schema([
+        ('id', pyarrow.int64()), ('filename', pyarrow.string()), ('columnIndex', pyarrow.int64()),
+        ('columnName', pyarrow.string()), ('n', pyarrow.int64()), ('testStatistic', pyarrow.float64()),
+        *((f'goodnessOfFit[{p}]', pyarrow.bool_()) for p in P_VALUES), ('error', pyarrow.string()),
+    ])
+
+
+def parquet_chunks(record_batches):
+    # Each batch of files becomes a row group, written out before the next batch is read
+    pyarrow = util.optional_import('pyarrow')
+    parquet = util.optional_import('pyarrow.parquet')
+    schema = parquet_schema(pyarrow)
+    sink = ChunkSink()
+    writer = parquet.ParquetWriter(sink, schema)
+    for records in record_batches:
+        if records:
+            columns = zip(*records)
+            writer.write_table(pyarrow.Table.from_arrays(
+                [pyarrow.array(column, field.type) for column, field in zip(columns, schema)], schema=schema
+            ))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def export_available(export_format):
+    return export_format == 'csv' or (export_format == 'parquet' and formats.PARQUET_AVAILABLE)
+
+
+def export_chunks(export_format, query, workers=1, batch_size=None):
+    # The report as a stream of bytes
+    record_batches = report_batches(query, workers, batch_size)
+    if export_format == 'parquet':
+        return parquet_chunks(record_batches)
+    return csv_chunks(record_batches)
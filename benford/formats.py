@@ -0,0 +1,292 @@
+from array import array
+import codecs
+import csv
+import io
+import itertools
+import json
+import mmap
+import zipfile
+
+from benford import parsers, storage, util
+
+# Readers for formats other than CSV present their records the way the CSV parsers do: lists of
+# strings, starting with the header, with blanks for missing values. Their libraries are optional.
+PARQUET_AVAILABLE = parsers.ARROW_AVAILABLE
+XLSX_AVAILABLE = util.module_available('openpyxl')
+
+PARQUET_MAGIC = b'PAR1'
+ZIP_MAGIC = b'PK\x03\x04'
+BYTE_ORDER_MARK = codecs.BOM_UTF8
+BINARY_FORMATS = {'parquet', 'xlsx'}
+# Longer first lines aren't taken for JSON Lines
+MAX_FIRST_LINE = 1 << 20
+
+
+class FormatError(csv.Error):
+    # Raised for files that can't be read in their format; a csv.Error so that everything that
+    # handles unreadable CSV files handles these too
+    pass
+
+
+def detect_format(file):
+    head = file.read(64)
+    file.seek(0)
+    if head.startswith(PARQUET_MAGIC):
+        return 'parquet'
+    # Other zip archives are left to decompression, and CSV files may start with {
+    if isinstance(file, mmap.mmap):
+        file = MappedFile(file)
+    if head.startswith(ZIP_MAGIC) and storage.is_workbook(file):
+        return 'xlsx'
+    text = head[len(BYTE_ORDER_MARK):] if head.startswith(BYTE_ORDER_MARK) else head
+    if text.lstrip().startswith(b'{') and starts_with_object(file):
+        return 'jsonl'
+    return 'csv'
+
+
+def starts_with_object(file):
+    # Whether the first line is a JSON object, as JsonLinesParser needs
+    line = file.readline(MAX_FIRST_LINE)
+    file.seek(0)
+    try:
+        return isinstance(json.loads(line.decode('utf-8-sig')), dict)
+    except ValueError:
+        return False
+
+
+class MappedFile(io.RawIOBase):
+    # zipfile and readline(size) need the full file interface, which memory maps lack
+    def __init__(self, buffer):
+        self.buffer = buffer
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, destination):
+        data = self.buffer.read(len(destination))
+        destination[:len(data)] = data
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self.buffer.seek(offset, whence)
+        return self.buffer.tell()
+
+    def tell(self):
+        return self.buffer.tell()
+
+
+def text(value):
+    return '' if value is None else str(value)
+
+
+class RecordParser(parsers.StdlibParser):
+    # Records are addressed by number rather than by byte offset, with the header as record 0,
+    # so row indexes hold record numbers. Subclasses read them with records(start).
+    def __init__(self, file, encoding):
+        super().__init__(file, encoding, None)
+
+    def rows(self, offset=0):
+        return self.records(offset)
+
+    def num_records(self):
+        return sum(1 for _ in self.records(0))
+
+    def index_rows(self, interval=None):
+        interval = interval or parsers.ROW_INDEX_INTERVAL
+        num_rows = self.num_records()
+        return parsers.RowIndex(interval, num_rows, array('Q', range(0, num_rows, interval)))
+
+    def range_rows(self, start, end):
+        raise FormatError('Only CSV files can be read by byte range')
+
+    def sample(self):
+        # Without cheap random access, types are inferred from the first records
+        return self.viable_rows(itertools.islice(self.rows(), parsers.SAMPLE_STRATA * parsers.SAMPLE_ROWS))
+
+
+class ParquetParser(RecordParser):
+    name = 'parquet'
+
+    def __init__(self, file, encoding):
+        super().__init__(file, encoding)
+        self.pyarrow = util.optional_import('pyarrow')
+        self.parquet = util.optional_import('pyarrow.parquet')
+        if self.parquet is None:
+            raise FormatError('Reading Parquet files requires pyarrow')
+        source = self.pyarrow.BufferReader(self.pyarrow.py_buffer(file)) if isinstance(file, mmap.mmap) else file
+        try:
+            self.parquet_file = self.parquet.ParquetFile(source)
+        except self.pyarrow.ArrowException as error:
+            raise FormatError(str(error))
+        self.names = self.parquet_file.schema_arrow.names
+
+    def close(self):
+        # The Parquet reader holds a view of the map, which has to be released first
+        self.parquet_file.close()
+        self.parquet_file = None
+        super().close()
+
+    def num_records(self):
+        return self.parquet_file.metadata.num_rows + 1
+
+    def batches(self, **options):
+        try:
+            yield from self.parquet_file.iter_batches(batch_size=parsers.PROGRESS_ROWS, **options)
+        except self.pyarrow.ArrowException as error:
+            raise FormatError(str(error))
+
+    def records(self, start):
+        if start == 0:
+            yield list(self.names)
+        # Whole row groups before the start are skipped without being read
+        skip, row_groups = max(start - 1, 0), []
+        for index in range(self.parquet_file.num_row_groups):
+            num_rows = self.parquet_file.metadata.row_group(index).num_rows
+            if not row_groups and skip >= num_rows:
+                skip -= num_rows
+            else:
+                row_groups.append(index)
+        if not row_groups:
+            return
+        rows = (
+            list(row) for batch in self.batches(row_groups=row_groups)
+            for row in zip(*([text(value) for value in column.to_pylist()] for column in batch.columns))
+        )
+        yield from itertools.islice(rows, skip, None)
+
+    def column_chunks(self, index, chunk_rows=None):
+        # Only the column's own pages are read. Progress in bytes is estimated from the rows read.
+        size, num_rows = self.size(), self.parquet_file.metadata.num_rows
+        cells, rows_read = [self.names[index]], 0
+        for batch in self.batches(columns=[self.names[index]]):
+            rows_read += batch.num_rows
+            cells.extend(text(value) for value in batch.column(0).to_pylist())
+            yield cells, size * rows_read // max(num_rows, 1)
+            cells = []
+        if rows_read == 0:
+            yield cells, size
+
+
+class XlsxParser(RecordParser):
+    # Reads the first worksheet of a workbook in openpyxl's streaming read-only mode
+    name = 'xlsx'
+
+    def __init__(self, file, encoding):
+        super().__init__(file, encoding)
+        openpyxl = util.optional_import('openpyxl')
+        if openpyxl is None:
+            raise FormatError('Reading Excel workbooks requires openpyxl')
+        try:
+            source = MappedFile(file) if isinstance(file, mmap.mmap) else file
+            self.workbook = openpyxl.load_workbook(source, read_only=True, data_only=True)
+            self.sheet = self.workbook.worksheets[0]
+            header = next(self.sheet.iter_rows(max_row=1, values_only=True), ())
+        except (IndexError, KeyError, ValueError, zipfile.BadZipFile) as error:
+            raise FormatError(f'Not a readable workbook: {error}')
+        self.width = len(header)
+
+    def close(self):
+        self.workbook.close()
+        super().close()
+
+    def records(self, start):
+        for values in self.sheet.iter_rows(min_row=start + 1, values_only=True):
+            if all(value is None for value in values):
+                # Like blank lines in a CSV file
+                yield []
+                continue
+            # Read-only sheets may leave out trailing blank cells
+            yield [text(value) for value in values] + [''] * (self.width - len(values))
+
+    def column_chunks(self, index, chunk_rows=None):
+        columns = self.sheet.iter_rows(min_col=index + 1, max_col=index + 1, values_only=True)
+        cells = (text(values[0] if values else None) for values in columns)
+        while True:
+            chunk = list(itertools.islice(cells, chunk_rows or parsers.PROGRESS_ROWS))
+            if not chunk:
+                return
+            # The uncompressed position within a workbook isn't known
+            yield chunk, None
+
+
+class JsonLinesParser(RecordParser):
+    # One JSON object per line; the keys of the first object are the columns. Lines that aren't
+    # objects are read as empty records, which aren't viable, like blank lines in a CSV file.
+    # Unlike the other formats the row index holds byte offsets, since lines can be found directly.
+    name = 'jsonl'
+
+    def __init__(self, file, encoding):
+        super().__init__(file, encoding)
+        first = next((obj for obj, _ in self.objects(0)), None)
+        if not isinstance(first, dict):
+            raise FormatError('The first line is not a JSON object')
+        self.names = list(first)
+
+    @staticmethod
+    def text(value):
+        if value is None or isinstance(value, str):
+            return text(value)
+        return json.dumps(value)
+
+    def objects(self, offset):
+        # Yields each line's JSON value (None if it isn't valid JSON) and where the next line starts
+        self.file.seek(offset)
+        lines = parsers.TrackedLines(self.file)
+        for line in codecs.iterdecode(lines, self.encoding):
+            try:
+                obj = json.loads(line.lstrip('\ufeff')) if line.strip() else None
+            except ValueError:
+                obj = None
+            yield obj, lines.position
+
+    def record(self, obj):
+        return [self.text(obj.get(name)) for name in self.names] if isinstance(obj, dict) else []
+
+    def records(self, start):
+        if start == 0:
+            yield list(self.names)
+        for obj, _ in self.objects(start):
+            yield self.record(obj)
+
+    def index_rows(self, interval=None):
+        # Record k > 0 is line k - 1 and starts where the line before it ended
+        interval = interval or parsers.ROW_INDEX_INTERVAL
+        offsets, num_rows = array('Q', [0]), 1
+        line_start = 0
+        for obj, line_end in self.objects(0):
+            if num_rows % interval == 0:
+                offsets.append(line_start)
+            num_rows += 1
+            line_start = line_end
+        return parsers.RowIndex(interval, num_rows, offsets)
+
+    def column_chunks(self, index, chunk_rows=None):
+        name, chunk_rows = self.names[index], chunk_rows or parsers.PROGRESS_ROWS
+        chunk, position = [name], 0
+        for obj, position in self.objects(0):
+            if isinstance(obj, dict):
+                chunk.append(self.text(obj.get(name)))
+                if len(chunk) >= chunk_rows:
+                    yield chunk, position
+                    chunk = []
+        if chunk or position == 0:
+            yield chunk, position
+
+
+RECORD_PARSERS = {'parquet': ParquetParser, 'xlsx': XlsxParser, 'jsonl': JsonLinesParser}
+
+
+def open_parser(file, encoding):
+    # A parser for the file's format, with CSV files getting the fastest available backend.
+    # Closing the parser closes the file, as does failing to make one.
+    try:
+        parser_class = RECORD_PARSERS.get(detect_format(file))
+        if parser_class is not None:
+            return parser_class(file, encoding)
+        return parsers.get_parser(file, encoding, parsers.sniff(file, encoding))
+    except Exception:
+        parsers.close_file(file)
+        raise
@@ -0,0 +1,132 @@
+import concurrent.futures
+import csv
+import os
+import tarfile
+import zipfile
+
+import sqlalchemy.exc
+from werkzeug.utils import secure_filename
+
+from benford import formats, util
+from benford.models import Blob, CSVFile, db
+from benford.storage import BlobStore, READ_ERRORS, store
+
+PARSE_ERROR = 'Error: This file could not be parsed as a .csv.'
+DUPLICATE_ERROR = 'Error: An uploaded file with that name already exists.'
+
+
+def archive_members(archive):
+    # Yields (name, binary stream) for each regular file in a zip or tar archive
+    if zipfile.is_zipfile(archive):
+        archive.seek(0)
+        with zipfile.ZipFile(archive) as zip_file:
+            for info in zip_file.infolist():
+                if not info.is_dir():
+                    with zip_file.open(info) as member:
+                        yield info.filename, member
+    else:
+        archive.seek(0)
+        with tarfile.open(fileobj=archive, mode='r:*') as tar_file:
+            for info in tar_file:
+                if info.isfile():
+                    yield info.name, tar_file.extractfile(info)
+
+
+def uploaded_files(files):
+    for file in files.getlist('csv'):
+        yield file.filename, file
+    for archive in files.getlist('archive'):
+        yield from archive_members(archive)
+
+
+def profile(store_root, path):
+    # Runs in a worker process and only touches the blob file, never the database
+    try:
+        with BlobStore(store_root).open_stream(path) as file:
+            encoding = CSVFile.get_encoding(file)
+            with formats.open_parser(file, encoding) as parser:
+                column_types = util.infer_column_types(parser.sample())
+                row_index = parser.index_rows()
+    except (csv.Error, LookupError, TypeError, ValueError) + READ_ERRORS:
+        return None
+    return {'encoding': encoding, 'column_types': column_types, 'row_index': row_index.to_bytes()}
+
+
+def profile_all(paths, workers):
+    if workers <= 1 or len(paths) <= 1:
+        return [profile(store.root, path) for path in paths]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        chunksize = max(1, len(paths) // (workers * 4))
+        return list(executor.map(profile, [store.root] * len(paths), paths, chunksize=chunksize))
+
+
+def insert_batch(batch, report):
+    try:
+        db.session.add_all(csvfile for _, csvfile in batch)
+        db.session.commit()
+    except sqlalchemy.exc.IntegrityError:
+        db.session.rollback()
+        if len(batch) == 1:
+            if batch[0][1].adopt_stored_blob():
+                insert_batch(batch, report)
+            else:
+                report[batch[0][0]].update(status='failed', message=DUPLICATE_ERROR)
+            return
+        # Fall back to one transaction per record to find out which ones conflict
+        for item in batch:
+            insert_batch([item], report)
+        return
+    for index, csvfile in batch:
+        report[index].update(status='created', id=csvfile.id)
+
+
+def ingest(files, workers=1, batch_size=500):
+    # Stores every uploaded file, profiles the new content in parallel worker processes and
+    # inserts the records in batched transactions, returning a status entry per file
+    report, pending, blobs = [], [], {}
+    try:
+        for name, stream in uploaded_files(files):
+            filename = secure_filename(os.path.basename(name))
+            report.append({'filename': filename})
+            if not filename:
+                report[-1].update(status='failed', message=PARSE_ERROR)
+                continue
+            sha256, size, created = store.put(stream)
+            if sha256 not in blobs:
+                blobs[sha256] = Blob.get_or_create(sha256, size, created)
+            pending.append((len(report) - 1, filename, blobs[sha256]))
+
+        existing_names = set()
+        names = [filename for _, filename, _ in pending]
+        for batch_start in range(0, len(names), batch_size):
+            query = db.session.query(CSVFile.filename).filter(
+                CSVFile.filename.in_(names[batch_start:batch_start + batch_size])
+            )
+            existing_names.update(name for name, in query)
+
+        paths = sorted({blob.path for blob in blobs.values()})
+        profiles = dict(zip(paths, profile_all(paths, workers)))
+
+        records = []
+        for index, filename, blob in pending:
+            result = profiles[blob.path]
+            if result is None:
+                report[index].update(status='failed', message=PARSE_ERROR)
+            elif filename in existing_names:
+                report[index].update(status='failed', message=DUPLICATE_ERROR)
+            else:
+                existing_names.add(filename)
+                if blob.column_types is None:
+                    blob.column_types = result['column_types']
+                if blob.row_index is None:
+                    blob.row_index = result['row_index']
+                records.append((index, CSVFile(filename=filename, blob=blob, encoding=result['encoding'])))
+
+        for batch_start in range(0, len(records), batch_size):
+            insert_batch(records[batch_start:batch_start + batch_size], report)
+    finally:
+        # Content that didn't end up referenced by any record
+        for blob in blobs.values():
+            blob.discard()
+
+    return report
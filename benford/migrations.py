@@ -0,0 +1,116 @@
+import io
+
+import sqlalchemy
+
+from .models import Blob, ColumnAnalysis, ColumnSummary, CSVFile, db
+from .storage import store
+
+
+def rebuild_legacy_table():
+    # Tables created before the blob store have a NOT NULL `file` column and no
+    # hash/path columns, so recreate the table from the current model and copy rows over
+    inspector = sqlalchemy.inspect(db.engine)
+    if not inspector.has_table('csv_file'):
+        return False
+    if 'sha256' in [column['name'] for column in inspector.get_columns('csv_file')]:
+        return False
+    with db.engine.begin() as connection:
+        connection.execute(sqlalchemy.text('ALTER TABLE csv_file RENAME TO _csv_file_legacy'))
+        CSVFile.__table__.create(connection)
+        connection.execute(sqlalchemy.text(
+            'INSERT INTO csv_file (id, date_created, filename, encoding, file) '
+            'SELECT id, date_created, filename, encoding, file FROM _csv_file_legacy'
+        ))
+        connection.execute(sqlalchemy.text('DROP TABLE _csv_file_legacy'))
+    return True
+
+
+def add_missing_columns():
+    # New nullable columns can be added in place; SQLite has no other cheap ALTER TABLE
+    inspector = sqlalchemy.inspect(db.engine)
+    added = []
+    for table in db.Model.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                with db.engine.begin() as connection:
+                    connection.execute(sqlalchemy.text(
+                        f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'
+                    ))
+                added.append(f'{table.name}.{column.name}')
+    return added
+
+
+def add_missing_indexes():
+    # create_all() only creates the indexes of new tables
+    for table in db.Model.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+
+def backfill_summaries():
+    # Summarizes files whose analyses were all cached before summaries were stored
+    summarized = db.session.query(ColumnSummary.csv_file_id)
+    query = CSVFile.query.filter(CSVFile.blob.has(Blob.column_types.isnot(None)), CSVFile.id.notin_(summarized))
+    for csvfile in query.all():
+        cached = {column.column_index: column for column in ColumnAnalysis.query.filter_by(sha256=csvfile.sha256)}
+        columns = csvfile.viable_columns()
+        if all(index in cached and not cached[index].num_other for index in columns):
+            csvfile.summarize([cached[index].result for index in columns])
+
+
+def upgrade_schema():
+    rebuild_legacy_table()
+    added = add_missing_columns()
+    db.create_all()
+    add_missing_indexes()
+    reconcile_blobs()
+    backfill_summaries()
+    return added
+
+
+def reconcile_blobs():
+    # Recount references from scratch, e.g. after bulk deletes that bypass the mapper events,
+    # and remove blobs that no record refers to any more
+    counts = dict(
+        db.session.query(CSVFile.sha256, sqlalchemy.func.count())
+        .filter(CSVFile.sha256.isnot(None))
+        .group_by(CSVFile.sha256)
+    )
+    for sha256 in counts.keys() - {sha256 for sha256, in db.session.query(Blob.sha256)}:
+        path = store.relative_path(sha256)
+        db.session.add(Blob(sha256=sha256, path=path, size=store.full_path(path).stat().st_size))
+    db.session.flush()
+
+    released = []
+    for blob in Blob.query:
+        blob.refcount = counts.get(blob.sha256, 0)
+        if not blob.refcount:
+            ColumnAnalysis.query.filter_by(sha256=blob.sha256).delete()
+            db.session.delete(blob)
+            released.append(blob.path)
+    # Summaries of records removed by bulk deletes
+    ColumnSummary.query.filter(ColumnSummary.csv_file_id.notin_(db.session.query(CSVFile.id))).delete(
+        synchronize_session=False
+    )
+    db.session.commit()
+
+    for path in released:
+        store.delete(path)
+    return released
+
+
+def migrate_blobs():
+    upgrade_schema()
+    migrated = 0
+    for csvfile in CSVFile.query.filter(CSVFile.legacy_file.isnot(None)).yield_per(100):
+        csvfile.blob = Blob.put(io.BytesIO(csvfile.legacy_file))
+        csvfile.legacy_file = None
+        db.session.flush()
+        migrated += 1
+    db.session.commit()
+    reconcile_blobs()
+    return migrated
@@ -1,108 +1,619 @@
-import codecs
 import csv
 import io
 import itertools
 
-import chardet
 from flask_sqlalchemy import SQLAlchemy
+import sqlalchemy
+import sqlalchemy.orm
 
-from benford import util
+from benford import formats, parsers, rendering, subsets, tables, timeseries, util
+from benford.cache import datasets
+from benford.storage import READ_ERRORS, store
 
 db = SQLAlchemy()
 
+# Number of viable rows shown in a preview
+PREVIEW_ROWS = 6
+# A parsed table takes up to about this many times the bytes of its text (its offsets, and
+# characters outside Latin-1 take 2 or 4 bytes each), which decides whether a dataset is worth
+# parsing into the dataset cache
+DATASET_EXPANSION = 4
+
+
+class Blob(db.Model):
+    # Uploaded content, shared by every CSVFile with the same SHA-256 digest
+    sha256 = db.Column(db.String(64), primary_key=True)
+    path = db.Column(db.String(255), nullable=False)
+    size = db.Column(db.BigInteger)
+    # Number of CSVFile records referencing this blob, maintained by the mapper events below
+    refcount = db.Column(db.Integer, nullable=False, default=0)
+    # Inferred from a sample at upload. Columns that have been scanned in full are typed by their
+    # ColumnAnalysis instead.
+    column_types = db.Column(db.JSON)
+    # Serialized parsers.RowIndex, built at upload
+    row_index = db.Column(db.LargeBinary)
+
+    @classmethod
+    def put(cls, data):
+        sha256, size, created = store.put(data)
+        return cls.get_or_create(sha256, size, created)
+
+    @classmethod
+    def get_or_create(cls, sha256, size, created):
+        blob = db.session.get(cls, sha256)
+        if blob is None:
+            blob = cls(sha256=sha256, path=store.relative_path(sha256), size=size)
+            # Only the upload that wrote the file may remove it again
+            blob.created_file = created
+        return blob
+
+    def open(self):
+        return store.open_stream(self.path)
+
+    def discard(self):
+        # Remove the file of content that never made it into the database. Concurrent uploads of
+        # the same content share the file, so it is kept unless this upload wrote it and no upload
+        # has stored a Blob for it since.
+        if sqlalchemy.inspect(self).persistent or not getattr(self, 'created_file', False):
+            return
+        with db.session.no_autoflush:
+            stored = db.session.query(Blob.sha256).filter_by(sha256=self.sha256).first()
+        if stored is None:
+            store.delete(self.path)
+
+
+class ColumnAnalysis(db.Model):
+    # Analysis results are cached per blob, so duplicate uploads are only analyzed once
+    sha256 = db.Column(db.String(64), db.ForeignKey('blob.sha256', ondelete='CASCADE'), primary_key=True)
+    column_index = db.Column(db.Integer, primary_key=True)
+    result = db.Column(db.JSON, nullable=False)
+    # Cells that were neither numeric nor blank, excluding a possible header
+    num_other = db.Column(db.Integer, nullable=False, default=0)
+    # The result as JSON, so that responses can include it without serializing it again
+    rendered = db.Column(db.LargeBinary)
+
+
+def tally_chunks(column_index, chunks, size=None):
+    # Yields ('progress', ...) events as the chunks of a column are tallied, then returns the
+    # counts and the column's first cell
+    counts, name = util.DigitCounts(), None
+    for cells, bytes_read in chunks:
+        if name is None:
+            name = cells[0]
+            # The first row may be a header, so it doesn't count against the column
+            if util.scan(name)[0] == util.OTHER:
+                counts.num_other -= 1
+        if isinstance(cells, tables.Column):
+            cells.tally(counts)
+        else:
+            counts.update(cells)
+        yield 'progress', {'index': column_index, 'rows': counts.num_cells, 'bytes': bytes_read, 'size': size}
+    return counts, name
+
 
 class CSVFile(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    date_created = db.Column(db.DateTime, default=db.func.now())
+    date_created = db.Column(db.DateTime, default=db.func.now(), index=True)
     filename = db.Column(db.String(120), unique=True, nullable=False)
-    file = db.Column(db.LargeBinary, nullable=False)
+    sha256 = db.Column(db.String(64), db.ForeignKey('blob.sha256'), index=True)
+    blob = db.relationship(Blob, lazy='joined')
     encoding = db.Column(db.String(32), nullable=False)
+    # Uploads used to be stored in-row; `flask migrate-blobs` moves them into the blob store
+    legacy_file = db.Column('file', db.LargeBinary)
 
     @classmethod
     def get_encoding(cls, data):
-        # Detect encoding from sample
+        # Detect encoding from sample. chardet is imported here because it is slow to import and
+        # only needed once per upload. Binary formats keep their text in UTF-8.
+        if formats.detect_format(data) in formats.BINARY_FORMATS:
+            return 'utf-8'
+        import chardet
+
         sample = data.read(10000)
         data.seek(0)
         return chardet.detect(sample)['encoding']
 
-    def __init__(self, data, filename):
-        file = data.read()
-        data.seek(0)
-        super().__init__(
-            filename=filename,
-            file=file,
-            encoding=self.get_encoding(data)
-        )
+    def __init__(self, data=None, filename=None, **kwargs):
+        # Records for content that is already stored can pass `blob` and `encoding` instead of data
+        if data is not None:
+            blob = Blob.put(data)
+            try:
+                with blob.open() as file:
+                    encoding = self.get_encoding(file)
+            except READ_ERRORS:
+                blob.discard()
+                raise
+            kwargs.update(blob=blob, encoding=encoding)
+        super().__init__(filename=filename, **kwargs)
+        if data is not None and self.blob.column_types is None:
+            try:
+                with self.parser() as parser:
+                    self.blob.column_types = util.infer_column_types(parser.sample())
+            except (csv.Error, UnicodeDecodeError) + READ_ERRORS:
+                self.blob.discard()
+                raise
+
+    def adopt_stored_blob(self):
+        # After an insert failed on a conflict: whether the conflict was a concurrent upload storing
+        # the same content first, in which case this record now references that upload's Blob and
+        # can be inserted again
+        if self.blob is None or sqlalchemy.inspect(self.blob).persistent:
+            return False
+        stored = db.session.get(Blob, self.blob.sha256)
+        if stored is None:
+            return False
+        self.blob = stored
+        return True
+
+    def open(self):
+        if self.blob is None:
+            return io.BytesIO(self.legacy_file)
+        return self.blob.open()
+
+    @property
+    def file(self):
+        with self.open() as file:
+            return file.read()
+
+    def discard(self):
+        # Clean up after a record that was never stored, keeping content that other records share
+        if self.blob is not None:
+            self.blob.discard()
+
+    def parser(self):
+        return formats.open_parser(self.open(), self.encoding)
+
+    def read_rows(self, offset=0, skip=0, stop=None):
+        # Rows from a byte offset, closing the file once they have been read or abandoned
+        with self.parser() as parser:
+            yield from itertools.islice(parser.rows(offset), skip, stop)
 
     def reader(self):
-        # Get dialect first
-        file = io.BytesIO(self.file)
-        sample = file.read(1024).decode(self.encoding)
-        file.seek(0)
-        dialect = csv.Sniffer().sniff(sample)
+        return self.read_rows()
 
-        data_iterator = codecs.iterdecode(file, self.encoding)
-        return csv.reader(data_iterator, dialect)
+    def index_rows(self):
+        if self.blob is None:
+            return None
+        if self.blob.row_index is None:
+            with self.parser() as parser:
+                self.blob.row_index = parser.index_rows().to_bytes()
+            self.save()
+        return parsers.RowIndex.from_bytes(self.blob.row_index)
 
     def dump(self, start=0, end=None):
-        return itertools.islice(self.reader(), start, end)
+        row_index = self.index_rows()
+        if row_index is None or not row_index.offsets:
+            return self.read_rows(0, start, end)
+        # Seek to the nearest checkpoint rather than parsing every row before `start`
+        offset, skip = row_index.locate(start)
+        stop = None if end is None else skip + max(end - start, 0)
+        return self.read_rows(offset, skip, stop)
+
+    def dataset(self, load=True):
+        # The viable rows as a tables.Table, header first, from the worker's dataset cache. Unless `load`
+        # is False, datasets that aren't cached yet are parsed into it if they fit; None otherwise.
+        if self.id is None or self.sha256 is None:
+            return None
+        key = (self.id, self.sha256)
+        return datasets.get(key, self.load_dataset) if load else datasets.lookup(key)
+
+    def load_dataset(self, budget):
+        with self.parser() as parser:
+            size = parser.size()
+            # Decompressed sizes aren't known up front
+            if size is None or size * DATASET_EXPANSION > budget:
+                return None
+            table = tables.Table.from_rows(parser.viable_rows())
+        return table, table.nbytes
 
     def viable_rows(self):
-        data = list(self.dump())
-        return [row for row in data if len(row) == len(data[0])]
+        table = self.dataset()
+        if table is None:
+            with self.parser() as parser:
+                return list(parser.viable_rows())
+        return list(table.rows())
 
     def __len__(self):
-        return len(list(self.dump()))
+        row_index = self.index_rows()
+        if row_index is None:
+            return sum(1 for _ in self.dump())
+        return row_index.num_rows
 
-    def viable_columns(self):
-        def is_numeric_or_blank(x):
-            # We can skip blanks later, for now we just want to see if the parser breaks for other reasons
-            if not x:
-                return True
-            try:
-                util.parse_numeric(x)
-            except ValueError:
-                return False
-            return True
+    def save(self):
+        # Persist lazily computed fields of records that are already stored
+        if sqlalchemy.inspect(self).persistent:
+            db.session.commit()
 
-        data = self.viable_rows()
-        num_columns = len(data[0])
-        viable_columns = []
+    def infer_column_types(self):
+        # Records from before types were stored at upload are sampled on every use, since reads
+        # don't write to the database
+        if self.blob is None or self.blob.column_types is None:
+            with self.parser() as parser:
+                return util.infer_column_types(parser.sample())
+        return self.blob.column_types
 
-        for i in range(num_columns):
-            column = [row[i] for row in data]
-            # Start at col[1:] because we don't want to count possible headers
-            if all(is_numeric_or_blank(x) for x in column[1:]):
-                viable_columns.append(i)
+    def scanned_columns(self):
+        # {column index: non-numeric cells} of the columns whose analyses are cached
+        if self.sha256 is None:
+            return {}
+        query = db.session.query(ColumnAnalysis.column_index, ColumnAnalysis.num_other)
+        return dict(query.filter_by(sha256=self.sha256))
 
-        return viable_columns
+    def viable_columns(self):
+        # The full scan of a column overrides its sampled type either way: sampling can let through
+        # non-numeric columns, and misses numeric ones when it starts within a quoted field
+        scanned = self.scanned_columns()
+        return [i for i, kind in enumerate(self.infer_column_types())
+                if (scanned[i] == 0 if i in scanned else kind == util.NUMERIC)]
 
     def preview(self):
-        viable_rows = self.viable_rows()
+        table = self.dataset()
+        if table is not None:
+            preview_rows = list(table.rows(0, PREVIEW_ROWS))
+            num_viable_rows = len(table)
+        else:
+            # Rows are counted as they are read rather than collected, which large files can't afford
+            with self.parser() as parser:
+                viable_rows = parser.viable_rows()
+                preview_rows = list(itertools.islice(viable_rows, PREVIEW_ROWS))
+                num_viable_rows = len(preview_rows) + sum(1 for _ in viable_rows)
         num_rows = len(self)
-        num_preview_rows = min(len(viable_rows), 6)
 
         return {
             'numRows': num_rows,
-            'numDiscarded': num_rows - len(viable_rows),
-            'previewData': viable_rows[:num_preview_rows],
+            'numDiscarded': num_rows - num_viable_rows,
+            'previewData': preview_rows,
             'viableColumnIndices': self.viable_columns()
         }
 
+    def scan_column(self, column_index):
+        # Yields ('progress', ...) events while the column is read, then returns (result, num_other)
+        if self.blob is not None:
+            cached = db.session.get(ColumnAnalysis, (self.sha256, column_index))
+            if cached is not None:
+                return cached.result, cached.num_other
+
+        table = self.dataset(load=False)
+        if table is None:
+            with self.parser() as parser:
+                counts, name = yield from tally_chunks(column_index, parser.column_chunks(column_index),
+                                                       parser.size())
+        else:
+            counts, name = yield from tally_chunks(column_index, table.column(column_index).chunks())
+
+        result = {'name': name, 'index': column_index, **counts.statistics()}
+
+        if self.blob is not None and sqlalchemy.inspect(self.blob).persistent:
+            db.session.add(ColumnAnalysis(
+                sha256=self.sha256,
+                column_index=column_index,
+                result=result,
+                num_other=counts.num_other,
+                rendered=rendering.render_column(result)
+            ))
+            try:
+                db.session.commit()
+            except sqlalchemy.exc.IntegrityError:
+                # Another request analyzed the same column first and cached the same result
+                db.session.rollback()
+        return result, counts.num_other
+
+    def cached_analysis(self, column_index):
+        return util.drain(self.scan_column(column_index))
+
     def analysis(self, column_index):
-        viable_rows = self.viable_rows()
-        column = [row[column_index] for row in viable_rows]
-        data = util.clean_data(column)
-        expected = util.expected_distribution(len(data))
-        observed = util.observed_distribution(data)
+        return self.cached_analysis(column_index)[0]
+
+    def analysis_events(self):
+        # Yields (event, data) pairs as the viable columns are read, so that each column's result
+        # can be sent as soon as it is ready instead of after the whole file has been analyzed
+        results = []
+        for column_index in self.viable_columns():
+            result, num_other = yield from self.scan_column(column_index)
+            # Sampling can let through columns that the full scan rejects
+            if num_other:
+                yield 'rejected', {'index': column_index}
+            else:
+                results.append(result)
+                yield 'column', result
+        self.summarize(results)
+
+    def summarized(self):
+        return db.session.query(ColumnSummary.id).filter_by(csv_file_id=self.id).first() is not None
+
+    def summarize(self, results):
+        # Stores the searchable fields of a complete analysis, once. They're written on a connection
+        # of their own, so that committing them doesn't expire the objects of the session.
+        if self.id is None or not results or self.summarized():
+            return
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(ColumnSummary.__table__.insert(),
+                                   [ColumnSummary.values(self.id, result) for result in results])
+        except sqlalchemy.exc.IntegrityError:
+            # Another request summarized the same file first
+            pass
+
+    def analyses(self):
+        return [data for event, data in self.analysis_events() if event == 'column']
+
+    def cached_renderings(self):
+        # Skips loading the JSON results, which only the rendered bytes are needed in place of
+        query = ColumnAnalysis.query.options(sqlalchemy.orm.defer(ColumnAnalysis.result))
+        return {cached.column_index: cached for cached in query.filter_by(sha256=self.sha256)}
+
+    def rendered_analyses(self):
+        # The JSON of each result in analyses(), rendered once when the result is cached
+        if self.blob is None or not sqlalchemy.inspect(self.blob).persistent:
+            return [rendering.render_column(result) for result in self.analyses()]
+
+        cached = self.cached_renderings()
+        if any(i not in cached for i in self.viable_columns()):
+            # Analyze the missing columns, rejecting any that turn out not to be numeric
+            self.analyses()
+            cached = self.cached_renderings()
+
+        rendered, missing = [], False
+        for column_index in self.viable_columns():
+            if cached[column_index].rendered is None:
+                # Cached before rendered results were stored
+                cached[column_index].rendered = rendering.render_column(cached[column_index].result)
+                missing = True
+            rendered.append(cached[column_index].rendered)
+        if missing:
+            self.save()
+        if not self.summarized():
+            # Files whose content was analyzed through another record never ran analyses() themselves
+            self.summarize([cached[column_index].result for column_index in self.viable_columns()])
+        return rendered
+
+    def subset_analyses(self, start=1, end=None, where=None, columns=None):
+        # Analyses of the viable rows [start, end) that satisfy every predicate in `where` (see
+        # benford.subsets), in a single pass over just those rows. Rows are numbered as in dump(), so
+        # the header is row 0 and never part of a subset. Subset results are neither cached nor used
+        # to reject columns.
+        with self.parser() as parser:
+            header = next(parser.viable_rows(), None)
+        if header is None:
+            return [], {'numRows': 0}
+        start = max(start, 1)
+        if end is not None and end <= start:
+            raise subsets.SubsetError('end must be after start')
+        predicates = subsets.parse_predicates(where, header)
+        columns = self.viable_columns() if columns is None else [subsets.column_index(i, header) for i in columns]
 
+        table = self.dataset(load=False)
+        if table is not None and not predicates and len(table) == len(self):
+            # Without ragged rows, rows of the cached table are numbered as in the file
+            counts, num_rows = subsets.tally_table(table, start, end, columns)
+        else:
+            # dump() seeks to the row index checkpoint before `start` and stops reading at `end`
+            rows = subsets.select(self.dump(start, end), len(header), predicates)
+            counts, num_rows = subsets.tally(rows, columns)
+        results = [subsets.column_result(header, index, counts[index]) for index in columns]
+        return results, {'numRows': num_rows}
+
+    def time_series(self, date_column, column_index, window, date_format=None):
+        table = self.dataset(load=False)
+        if table is not None:
+            return timeseries.time_series(table.rows(), date_column, column_index, window, date_format)
+        with self.parser() as parser:
+            return timeseries.time_series(parser.viable_rows(), date_column, column_index, window, date_format)
+
+
+def fails_column(p):
+    # The ColumnSummary flag for a significance level, e.g. fails_0_01
+    return f'fails_{p.replace(".", "_")}'
+
+
+class ColumnSummary(db.Model):
+    # The searchable fields of each analyzed column of a file, so that files can be filtered and
+    # sorted by their results in SQL rather than by analyzing them again
+    id = db.Column(db.Integer, primary_key=True)
+    csv_file_id = db.Column(db.Integer, db.ForeignKey('csv_file.id', ondelete='CASCADE'), nullable=False)
+    column_index = db.Column(db.Integer, nullable=False)
+    name = db.Column(db.String(255), index=True)
+    n = db.Column(db.Integer, nullable=False, index=True)
+    test_statistic = db.Column(db.Float, nullable=False, index=True)
+    # Whether the test statistic exceeds the critical value at each significance level
+    fails_0_10 = db.Column(db.Boolean, nullable=False)
+    fails_0_05 = db.Column(db.Boolean, nullable=False)
+    fails_0_025 = db.Column(db.Boolean, nullable=False)
+    fails_0_01 = db.Column(db.Boolean, nullable=False)
+    fails_0_001 = db.Column(db.Boolean, nullable=False)
+    # Summaries are deleted along with their file by delete_summaries() below
+    csv_file = db.relationship(CSVFile, backref=db.backref('column_summaries', passive_deletes='all'))
+
+    __table_args__ = (
+        db.UniqueConstraint('csv_file_id', 'column_index'),
+        # Failing columns are usually wanted above some sample size
+        *(db.Index(f'ix_column_summary_{fails_column(p)}_n', fails_column(p), 'n') for p in util.CRITICAL_VALUES),
+    )
+
+    @staticmethod
+    def values(csv_file_id, result):
+        return {
+            'csv_file_id': csv_file_id, 'column_index': result['index'], 'name': result['name'],
+            'n': result['n'], 'test_statistic': result['testStatistic'],
+            **{fails_column(p): fails for p, fails in result['goodnessOfFit'].items()},
+        }
+
+
+# Pushed rows are tallied in chunks of this many rows, each committed as it is done
+STREAM_FLUSH_ROWS = 10000
+
+
+class PushError(ValueError):
+    # Raised when pushed rows stop parsing, after the chunks before were committed
+    def __init__(self, num_accepted, num_discarded):
+        super().__init__(f'The rows could not be parsed after {num_accepted + num_discarded} rows')
+        self.num_accepted = num_accepted
+        self.num_discarded = num_discarded
+
+
+class StreamColumn(db.Model):
+    # Running leading-digit counters for one column of a Stream, incremented in place as rows arrive
+    stream_id = db.Column(db.Integer, db.ForeignKey('stream.id', ondelete='CASCADE'), primary_key=True)
+    index = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(255), nullable=False)
+    num_cells = db.Column(db.BigInteger, nullable=False, default=0)
+    num_other = db.Column(db.BigInteger, nullable=False, default=0)
+    count_1 = db.Column(db.BigInteger, nullable=False, default=0)
+    count_2 = db.Column(db.BigInteger, nullable=False, default=0)
+    count_3 = db.Column(db.BigInteger, nullable=False, default=0)
+    count_4 = db.Column(db.BigInteger, nullable=False, default=0)
+    count_5 = db.Column(db.BigInteger, nullable=False, default=0)
+    count_6 = db.Column(db.BigInteger, nullable=False, default=0)
+    count_7 = db.Column(db.BigInteger, nullable=False, default=0)
+    count_8 = db.Column(db.BigInteger, nullable=False, default=0)
+    count_9 = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def digit_counts(self):
+        counts = util.DigitCounts()
+        counts.counts = [0] + [getattr(self, f'count_{x}') for x in range(1, 10)]
+        counts.num_other = self.num_other
+        counts.num_cells = self.num_cells
+        return counts
+
+    @staticmethod
+    def increments(counts):
+        # Column expressions that add a DigitCounts to the stored counters within the UPDATE itself
+        table = StreamColumn.__table__.c
+        values = {f'count_{x}': table[f'count_{x}'] + counts.counts[x] for x in range(1, 10)}
+        values.update(num_cells=table.num_cells + counts.num_cells, num_other=table.num_other + counts.num_other)
+        return values
+
+    def analysis(self):
+        counts = self.digit_counts()
         return {
-            'name': viable_rows[0][column_index],
-            'index': column_index,
-            'n': len(data),
-            'expectedDistribution': expected,
-            'observedDistribution': observed,
-            'testStatistic': util.sum_chi_squares(expected, observed),
-            'criticalValues': util.CRITICAL_VALUES,
-            'goodnessOfFit': util.goodness_of_fit(expected, observed)
+            'name': self.name,
+            'index': self.index,
+            **counts.statistics(),
+            'numCells': counts.num_cells,
+            'numOther': counts.num_other,
         }
+
+
+class Stream(db.Model):
+    # A continuous feed of rows; only the per-column counters are kept, never the rows themselves
+    id = db.Column(db.Integer, primary_key=True)
+    date_created = db.Column(db.DateTime, default=db.func.now())
+    name = db.Column(db.String(120), unique=True, nullable=False)
+    num_rows = db.Column(db.BigInteger, nullable=False, default=0)
+    counters = db.relationship(StreamColumn, order_by=StreamColumn.index, cascade='all, delete-orphan')
+
+    def __init__(self, columns=(), **kwargs):
+        counters = [StreamColumn(index=index, name=name) for index, name in enumerate(columns)]
+        super().__init__(counters=counters, **kwargs)
+
+    @property
+    def columns(self):
+        return [counter.name for counter in self.counters]
+
+    def push(self, rows):
+        # Tallies rows with as many fields as the stream has columns, committing every
+        # STREAM_FLUSH_ROWS rows so that long-lived uploads show up in the analysis as they go.
+        # Returns the numbers of rows accepted and discarded; a PushError reports those of the
+        # chunks committed before the rows stopped parsing.
+        num_accepted = num_discarded = 0
+        rows = iter(rows)
+        while True:
+            try:
+                chunk = list(itertools.islice(rows, STREAM_FLUSH_ROWS))
+            except (csv.Error, LookupError, UnicodeDecodeError) as error:
+                raise PushError(num_accepted, num_discarded) from error
+            if not chunk:
+                return num_accepted, num_discarded
+            viable = [row for row in chunk if len(row) == len(self.counters)]
+            self.flush(viable)
+            num_accepted += len(viable)
+            num_discarded += len(chunk) - len(viable)
+
+    def flush(self, rows):
+        if not rows:
+            return
+        # Increments happen in SQL rather than on loaded attributes, so concurrent pushes add up
+        for counter, cells in zip(self.counters, zip(*rows)):
+            counts = util.DigitCounts()
+            counts.update(cells)
+            db.session.execute(
+                StreamColumn.__table__.update()
+                .where(StreamColumn.stream_id == self.id, StreamColumn.index == counter.index)
+                .values(**counter.increments(counts))
+            )
+        db.session.execute(
+            Stream.__table__.update()
+            .where(Stream.id == self.id)
+            .values(num_rows=Stream.num_rows + len(rows))
+        )
+        db.session.commit()
+
+    def analyses(self):
+        return [counter.analysis() for counter in self.counters]
+
+
+@sqlalchemy.event.listens_for(CSVFile, 'after_insert')
+def acquire_blob(mapper, connection, csvfile):
+    if csvfile.sha256 is not None:
+        connection.execute(
+            Blob.__table__.update()
+            .where(Blob.sha256 == csvfile.sha256)
+            .values(refcount=Blob.refcount + 1)
+        )
+        copy_summaries(connection, csvfile)
+
+
+def copy_summaries(connection, csvfile):
+    # A file with the same content as one that was already analyzed shares its analyses, so it
+    # is searchable straight away
+    table = ColumnSummary.__table__
+    source = (
+        sqlalchemy.select(sqlalchemy.func.min(CSVFile.id))
+        .join(ColumnSummary, ColumnSummary.csv_file_id == CSVFile.id)
+        .where(CSVFile.sha256 == csvfile.sha256, CSVFile.id != csvfile.id)
+        .scalar_subquery()
+    )
+    columns = [column.name for column in table.columns if column.name not in ('id', 'csv_file_id')]
+    connection.execute(table.insert().from_select(
+        ['csv_file_id', *columns],
+        sqlalchemy.select(sqlalchemy.literal(csvfile.id), *(table.c[name] for name in columns))
+        .where(table.c.csv_file_id == source)
+    ))
+
+
+@sqlalchemy.event.listens_for(CSVFile, 'after_delete')
+def release_blob(mapper, connection, csvfile):
+    if csvfile.sha256 is None:
+        return
+    connection.execute(
+        Blob.__table__.update()
+        .where(Blob.sha256 == csvfile.sha256)
+        .values(refcount=Blob.refcount - 1)
+    )
+    refcount = connection.execute(
+        sqlalchemy.select(Blob.refcount).where(Blob.sha256 == csvfile.sha256)
+    ).scalar()
+    if refcount is not None and refcount <= 0:
+        connection.execute(ColumnAnalysis.__table__.delete().where(ColumnAnalysis.sha256 == csvfile.sha256))
+        connection.execute(Blob.__table__.delete().where(Blob.sha256 == csvfile.sha256))
+        # Only remove the file once the deletion has actually been committed
+        db.session.info.setdefault('released_blobs', set()).add(
+            store.relative_path(csvfile.sha256)
+        )
+
+
+@sqlalchemy.event.listens_for(CSVFile, 'after_delete')
+def delete_summaries(mapper, connection, csvfile):
+    connection.execute(ColumnSummary.__table__.delete().where(ColumnSummary.csv_file_id == csvfile.id))
+    datasets.discard((csvfile.id, csvfile.sha256))
+
+
+@sqlalchemy.event.listens_for(db.session, 'after_commit')
+def delete_released_blobs(session):
+    for path in session.info.pop('released_blobs', ()):
+        store.delete(path)
+
+
+@sqlalchemy.event.listens_for(db.session, 'after_rollback')
+def keep_released_blobs(session):
+    session.info.pop('released_blobs', None)
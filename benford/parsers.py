@@ -0,0 +1,313 @@
+from array import array
+import codecs
+import csv
+import io
+import itertools
+import mmap
+import os
+
+from benford import util
+
+# pyarrow takes longer to import than the rest of the app put together, so it is only loaded
+# once a file large enough to benefit from it comes along
+ARROW_AVAILABLE = util.module_available('pyarrow')
+
+# Below this size the fixed cost of setting up an Arrow reader outweighs its speedup
+ARROW_MIN_SIZE = 1 << 20
+# Streamed reads parse at most this many bytes per record batch
+ARROW_BLOCK_SIZE = 1 << 20
+# Smaller blocks can't hold long records
+ARROW_MIN_BLOCK_SIZE = 1 << 15
+# Arrow reads other encodings through a transcoding stream whose memory use grows with the file
+ARROW_ENCODINGS = {'ascii', 'utf-8', 'utf-8-sig'}
+
+# Column scans read the file in chunks, so the memory they use depends on the chunk size rather
+# than the file size. Each chunk may take up to CHUNK_EXPANSION times as much memory as the bytes
+# it was parsed from (cells become Python strings, and Arrow's allocator keeps some batches'
+# worth of memory around), so chunks are sized to keep that within the budget, which is the app's
+# MEMORY_BUDGET.
+DEFAULT_MEMORY_BUDGET = 64 << 20
+CHUNK_EXPANSION = 64
+memory_budget = DEFAULT_MEMORY_BUDGET
+
+# Files larger than this are typed from a stratified sample of SAMPLE_STRATA runs of SAMPLE_ROWS records
+SAMPLE_MIN_SIZE = 1 << 20
+SAMPLE_STRATA = 20
+SAMPLE_ROWS = 50
+
+# Streamed analyses report progress after every PROGRESS_ROWS records
+PROGRESS_ROWS = 10000
+
+# The row index keeps the byte offset of every ROW_INDEX_INTERVAL-th record
+ROW_INDEX_INTERVAL = 1000
+
+
+def init_app(app):
+    global memory_budget
+    budget = app.config['MEMORY_BUDGET']
+    if budget < CHUNK_EXPANSION:
+        raise ValueError(f'The memory budget must be at least {CHUNK_EXPANSION} bytes')
+    memory_budget = budget
+
+
+def chunk_bytes():
+    return memory_budget // CHUNK_EXPANSION
+
+
+class RowIndex:
+    def __init__(self, interval, num_rows, offsets):
+        self.interval = interval
+        self.num_rows = num_rows
+        self.offsets = offsets
+
+    @classmethod
+    def from_bytes(cls, data):
+        values = array('Q')
+        values.frombytes(data)
+        return cls(values[0], values[1], values[2:])
+
+    def to_bytes(self):
+        return (array('Q', [self.interval, self.num_rows]) + self.offsets).tobytes()
+
+    def locate(self, row):
+        # Offset of the nearest checkpoint at or before a row, and how many records to skip from it
+        checkpoint = min(row // self.interval, len(self.offsets) - 1)
+        return self.offsets[checkpoint], row - checkpoint * self.interval
+
+
+class TrackedLines:
+    # The lines of a binary file from its current position, noting the offset reached so far.
+    # csv.reader only pulls the lines of one record at a time, so between records this is
+    # where the next record starts.
+    def __init__(self, file):
+        self.file = file
+        self.position = file.tell()
+
+    def __iter__(self):
+        for line in iter(self.file.readline, b''):
+            self.position += len(line)
+            yield line
+
+
+def close_file(file):
+    try:
+        file.close()
+    except BufferError:
+        # Arrow still holds a view of the map, through a reader that was left partway through or an
+        # error's traceback, and the map is unmapped once that is released instead
+        pass
+
+
+class StdlibParser:
+    name = 'stdlib'
+
+    def __init__(self, file, encoding, dialect):
+        self.file = file
+        self.encoding = encoding
+        self.dialect = dialect
+
+    def close(self):
+        close_file(self.file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def size(self):
+        # Decompressing streams can't report their size without reading everything
+        if not isinstance(self.file, (mmap.mmap, io.BytesIO)):
+            return None
+        self.file.seek(0, os.SEEK_END)
+        size = self.file.tell()
+        self.file.seek(0)
+        return size
+
+    def rows(self, offset=0):
+        self.file.seek(offset)
+        data_iterator = codecs.iterdecode(iter(self.file.readline, b''), self.encoding)
+        return csv.reader(data_iterator, self.dialect)
+
+    def index_rows(self, interval=None):
+        # A single pass that notes where records start, so quoted newlines are accounted for
+        interval = interval or ROW_INDEX_INTERVAL
+        self.file.seek(0)
+        lines = TrackedLines(self.file)
+        reader = csv.reader(codecs.iterdecode(lines, self.encoding), self.dialect)
+        offsets, start, num_rows = array('Q'), 0, 0
+        for num_rows, _ in enumerate(reader, 1):
+            if (num_rows - 1) % interval == 0:
+                offsets.append(start)
+            start = lines.position
+        return RowIndex(interval, num_rows, offsets)
+
+    def range_rows(self, start, end):
+        # Records that start within bytes [start, end), so that adjacent ranges cover every record
+        # exactly once, then returns where the next record starts. A range starting mid-line begins
+        # at the next line; this assumes that records don't contain quoted newlines at the range
+        # boundaries.
+        if start:
+            # Reading from the byte before `start` keeps a line that begins exactly at `start`
+            self.file.seek(start - 1)
+            self.file.readline()
+        else:
+            self.file.seek(0)
+        lines = TrackedLines(self.file)
+        record_start = lines.position
+        for row in csv.reader(codecs.iterdecode(lines, self.encoding), self.dialect):
+            if record_start >= end:
+                return record_start
+            yield row
+            record_start = lines.position
+        return record_start
+
+    def sample_rows(self):
+        # The first SAMPLE_ROWS records, then runs of records starting at evenly spaced byte offsets.
+        # The record after each seek may have been cut mid-field, so it is dropped.
+        size = self.size()
+        yield from itertools.islice(self.rows(), SAMPLE_ROWS)
+        for stratum in range(1, SAMPLE_STRATA):
+            self.file.seek(size * stratum // SAMPLE_STRATA)
+            self.file.readline()
+            yield from itertools.islice(self.rows(self.file.tell()), 1, SAMPLE_ROWS + 1)
+
+    def viable_rows(self, rows=None):
+        rows = self.rows() if rows is None else rows
+        first_row = next(rows, None)
+        if first_row is None:
+            return
+        yield first_row
+        for row in rows:
+            if len(row) == len(first_row):
+                yield row
+
+    def sample(self):
+        # Viable rows to infer column types from, which is all of them for small files
+        size = self.size()
+        if size is None:
+            # Without random access, settle for the head of the stream
+            return self.viable_rows(itertools.islice(self.rows(), SAMPLE_STRATA * SAMPLE_ROWS))
+        if size < SAMPLE_MIN_SIZE:
+            return self.viable_rows()
+        return self.viable_rows(self.sample_rows())
+
+    def columns(self):
+        # Columns of the rows with as many fields as the first row, header included, filled a row
+        # at a time rather than by transposing a list of every row
+        columns = None
+        for row in self.viable_rows():
+            if columns is None:
+                columns = [[] for _ in row]
+            for column, cell in zip(columns, row):
+                column.append(cell)
+        return columns or []
+
+    def column(self, index):
+        return [row[index] for row in self.viable_rows()]
+
+    def column_chunks(self, index, chunk_rows=None):
+        # Yields the column in runs of up to chunk_rows cells parsed from up to chunk_bytes() bytes,
+        # each with the number of bytes read so far
+        rows, chunk_rows, max_bytes = self.viable_rows(), chunk_rows or PROGRESS_ROWS, chunk_bytes()
+        while True:
+            chunk, start = [], self.file.tell()
+            for row in rows:
+                chunk.append(row[index])
+                if len(chunk) >= chunk_rows or self.file.tell() - start >= max_bytes:
+                    break
+            if not chunk:
+                return
+            yield chunk, self.file.tell()
+
+
+class ArrowParser(StdlibParser):
+    # Row-oriented access (dump, preview) stays on the stdlib reader so that ragged rows and blank
+    # lines are reported exactly as before; column-oriented access is parsed by Arrow in C++
+    name = 'arrow'
+
+    def __init__(self, file, encoding, dialect):
+        super().__init__(file, encoding, dialect)
+        self.pyarrow = util.optional_import('pyarrow')
+        self.arrow_csv = util.optional_import('pyarrow.csv')
+
+    def num_fields(self):
+        return len(next(super().rows(), []))
+
+    def source(self):
+        self.file.seek(0)
+        if isinstance(self.file, mmap.mmap):
+            return self.pyarrow.BufferReader(self.pyarrow.py_buffer(self.file))
+        return self.file
+
+    def csv_options(self, include_columns=None, **read_options):
+        names = [f'f{i}' for i in range(self.num_fields())]
+        dialect = self.dialect
+        # ASCII is a subset of UTF-8, which Arrow parses without transcoding (skipping any BOM)
+        encoding = 'utf8' if arrow_encoding(self.encoding) else self.encoding
+        return dict(
+            read_options=self.arrow_csv.ReadOptions(column_names=names, encoding=encoding, **read_options),
+            parse_options=self.arrow_csv.ParseOptions(
+                delimiter=dialect.delimiter,
+                quote_char=dialect.quotechar or False,
+                double_quote=dialect.doublequote,
+                escape_char=dialect.escapechar or False,
+                newlines_in_values=True,
+                # Rows that don't match the first row's width aren't viable, so skip them
+                invalid_row_handler=lambda row: 'skip',
+            ),
+            convert_options=self.arrow_csv.ConvertOptions(
+                column_types={name: self.pyarrow.string() for name in names},
+                include_columns=include_columns,
+                strings_can_be_null=False,
+                quoted_strings_can_be_null=False,
+            ),
+        )
+
+    def batches(self, include_columns=None):
+        # Record batches parsed from blocks sized to the memory budget, so that only one block's
+        # worth of Arrow memory is alive at a time. Returns the batches and the source they read.
+        block_size = min(ARROW_BLOCK_SIZE, max(chunk_bytes(), ARROW_MIN_BLOCK_SIZE))
+        # The options read the header, so the source is rewound after them
+        options = self.csv_options(include_columns, block_size=block_size)
+        source = self.source()
+        reader = self.arrow_csv.open_csv(source, **options)
+        return (batch for batch in reader if batch.num_rows), source
+
+    def columns(self):
+        columns = [[] for _ in range(self.num_fields())]
+        for batch in self.batches()[0]:
+            for column, array in zip(columns, batch.columns):
+                column.extend(array.to_pylist())
+        return columns
+
+    def column(self, index):
+        return [cell for cells, _ in self.column_chunks(index) for cell in cells]
+
+    def column_chunks(self, index, chunk_rows=None):
+        # Arrow decides how many records fit in a block, so chunks are sized in bytes instead
+        batches, source = self.batches([f'f{index}'])
+        for batch in batches:
+            yield batch.column(0).to_pylist(), source.tell()
+
+
+def sniff(file, encoding):
+    sample = file.read(1024).decode(encoding)
+    file.seek(0)
+    return csv.Sniffer().sniff(sample)
+
+
+def arrow_encoding(encoding):
+    return codecs.lookup(encoding).name in ARROW_ENCODINGS
+
+
+def get_parser(file, encoding, dialect):
+    # Pick the fastest available backend for a file of this size and encoding
+    parser = StdlibParser(file, encoding, dialect)
+    size = parser.size()
+    # Compressed uploads (of unknown size) are usually large enough to be worth it. Arrow has no
+    # option to skip the spaces after a delimiter, so those dialects stay on the stdlib reader.
+    if (ARROW_AVAILABLE and arrow_encoding(encoding) and not dialect.skipinitialspace
+            and (size is None or size >= ARROW_MIN_SIZE)):
+        return ArrowParser(file, encoding, dialect)
+    return parser
@@ -0,0 +1,310 @@
+import concurrent.futures
+import csv
+import itertools
+import mmap
+import os
+
+import sqlalchemy.exc
+
+from benford import formats, parsers, rendering, util
+from benford.models import ColumnAnalysis, CSVFile, db
+from benford.storage import detect_compression, store
+
+# Partial results are plain JSON so that workers on other machines can send them back over HTTP:
+#
+#   {
+#       "version": 2,
+#       "size": ...,                     # bytes in the file
+#       "ranges": [[start, end], ...],   # byte ranges covered, sorted and non-overlapping
+#       "header": [...] or null,         # first record of the file, from the range starting at 0
+#       "numRows": ..., "numDiscarded": ...,
+#       "columns": [{"firstDigits": [9 counts], "n": ..., "numOther": ..., "numCells": ...}, ...]
+#   }
+#
+# Merging two partials gives another partial, so they can be combined in any order or as a tree.
+# A partial is final once its ranges cover the whole file.
+PARTIAL_VERSION = 2
+
+# Quotes are counted in blocks of this many bytes
+QUOTE_SCAN_BLOCK = 1 << 20
+
+
+class PartialError(ValueError):
+    pass
+
+
+def split_ranges(size, parts):
+    # Evenly sized byte ranges covering a file, for handing out to workers
+    bounds = [size * part // parts for part in range(parts + 1)]
+    return [[start, end] for start, end in zip(bounds, bounds[1:]) if end > start]
+
+
+def to_partial(counts_by_column, size, start, end, header, num_rows, num_discarded):
+    return {
+        'version': PARTIAL_VERSION,
+        'size': size,
+        'ranges': [[start, end]],
+        'header': header,
+        'numRows': num_rows,
+        'numDiscarded': num_discarded,
+        'columns': [
+            {'firstDigits': counts.counts[1:], 'n': counts.n, 'numOther': counts.num_other,
+             'numCells': counts.num_cells}
+            for counts in counts_by_column
+        ],
+    }
+
+
+def column_counts(column):
+    counts = util.DigitCounts()
+    counts.counts = [0] + list(column['firstDigits'])
+    counts.num_other = column['numOther']
+    counts.num_cells = column['numCells']
+    return counts
+
+
+def open_file(path):
+    # Every worker derives the same encoding and dialect from the head of the file
+    with open(path, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            raise PartialError('The file is empty')
+        file = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        if detect_compression(file) is not None:
+            raise PartialError('Byte ranges of compressed files cannot be read independently')
+        if formats.detect_format(file) != 'csv':
+            raise PartialError('Only CSV files can be split into byte ranges')
+        encoding = CSVFile.get_encoding(file)
+        return file, encoding, parsers.sniff(file, encoding)
+    except Exception:
+        file.close()
+        raise
+
+
+def tally_range(path, start, end):
+    # Tallies the records of a CSV file that start within bytes [start, end) without the database.
+    # Returns the partial and where the record after the range starts.
+    with parsers.StdlibParser(*open_file(path)) as parser:
+        size = len(parser.file)
+        if not 0 <= start <= end <= size:
+            raise PartialError(f'Bytes {start}-{end} are not within the file')
+
+        header = next(parser.rows(), [])
+        counts_by_column = [util.DigitCounts() for _ in header]
+        num_rows = num_discarded = 0
+        next_record = []
+        rows = util.capture(parser.range_rows(start, end), next_record)
+        while True:
+            chunk = list(itertools.islice(rows, parsers.PROGRESS_ROWS))
+            if not chunk:
+                break
+            viable = [row for row in chunk if len(row) == len(header)]
+            num_rows += len(viable)
+            num_discarded += len(chunk) - len(viable)
+            for counts, cells in zip(counts_by_column, zip(*viable)):
+                counts.update(cells)
+
+    if start == 0:
+        # The first row may be a header, so it doesn't count against its columns
+        for counts, cell in zip(counts_by_column, header):
+            if util.scan(cell)[0] == util.OTHER:
+                counts.num_other -= 1
+    partial = to_partial(counts_by_column, size, start, end, header if start == 0 else None,
+                         num_rows, num_discarded)
+    return partial, next_record[0]
+
+
+def compute_partial(path, start, end):
+    return tally_range(path, start, end)[0]
+
+
+def compute_aligned_partial(path, start, end):
+    # For ranges from aligned_ranges(), which must end where a record starts. Quotes inside unquoted
+    # fields are taken literally, which counting quotes doesn't know about; this catches those.
+    partial, next_record = tally_range(path, start, end)
+    if next_record != end:
+        raise PartialError(f'A record runs past the end of bytes {start}-{end}')
+    return partial
+
+
+def is_count(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+
+def check_range(byte_range, size):
+    if not (isinstance(byte_range, list) and len(byte_range) == 2 and all(map(is_count, byte_range))
+            and byte_range[0] <= byte_range[1] <= size):
+        raise PartialError(f'Ranges must be pairs of byte offsets within the file, not {byte_range!r}')
+    return byte_range
+
+
+def check_column(column):
+    digits = column.get('firstDigits') if isinstance(column, dict) else None
+    if not (isinstance(digits, list) and len(digits) == 9 and all(map(is_count, digits))
+            and is_count(column.get('numOther')) and is_count(column.get('numCells'))):
+        raise PartialError('Columns must have nine firstDigits counts, numOther and numCells')
+    return column
+
+
+def merge_ranges(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if start == end:
+            continue
+        if merged and start < merged[-1][1]:
+            raise PartialError(f'Byte range {start}-{end} overlaps another partial')
+        if merged and start == merged[-1][1]:
+            merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def merge_partials(partials):
+    if not partials:
+        raise PartialError('There are no partials to merge')
+    for partial in partials:
+        if not isinstance(partial, dict) or partial.get('version') != PARTIAL_VERSION:
+            raise PartialError(f'Partials must be objects with version {PARTIAL_VERSION}')
+    try:
+        sizes = {partial['size'] for partial in partials}
+        if len(sizes) != 1 or not is_count(min(sizes)):
+            raise PartialError('Partials must be of the same file, with the same size')
+        size = sizes.pop()
+        widths = {len(partial['columns']) for partial in partials}
+        if len(widths) != 1:
+            raise PartialError('Partials have different numbers of columns')
+        width = widths.pop()
+        headers = [partial['header'] for partial in partials if partial['header'] is not None]
+        if len(headers) > 1:
+            raise PartialError('More than one partial covers the start of the file')
+        if headers and (not isinstance(headers[0], list) or len(headers[0]) != width):
+            raise PartialError('The header must name every column')
+
+        merged_columns = [util.DigitCounts() for _ in range(width)]
+        for partial in partials:
+            for counts, column in zip(merged_columns, partial['columns']):
+                counts.merge(column_counts(check_column(column)))
+        merged = to_partial(
+            merged_columns, size, 0, 0, headers[0] if headers else None,
+            sum(partial['numRows'] for partial in partials),
+            sum(partial['numDiscarded'] for partial in partials),
+        )
+        merged['ranges'] = merge_ranges(check_range(r, size) for partial in partials for r in partial['ranges'])
+    except (KeyError, TypeError) as error:
+        raise PartialError(f'Malformed partial: {error}')
+    return merged
+
+
+def is_complete(partial):
+    return partial['ranges'] == [[0, partial['size']]]
+
+
+def finalize(partial):
+    # The analysis of every column in which nothing but numbers (and blanks) was found
+    if partial['header'] is None:
+        raise PartialError('No partial covers the start of the file')
+    if not is_complete(partial):
+        raise PartialError('The partials leave parts of the file uncovered')
+    columns = []
+    for index, (name, column) in enumerate(zip(partial['header'], partial['columns'])):
+        if column['numOther'] == 0:
+            columns.append({'name': name, 'index': index, **column_counts(column).statistics()})
+    return columns
+
+
+def split_quote(dialect, encoding):
+    # The byte that starts and ends quoted fields, or None if fields can't contain newlines. Ranges
+    # can only be aligned by counting quotes when they can't be escaped (doubled quotes cancel out)
+    # and the encoding writes quotes and newlines as single ASCII bytes.
+    quote = None if dialect.quoting == csv.QUOTE_NONE else dialect.quotechar
+    special = (quote or '') + '\n'
+    if dialect.escapechar or special.encode(encoding) != special.encode('ascii'):
+        raise PartialError('Records of this file cannot be located without reading it from the start')
+    return quote.encode('ascii') if quote else None
+
+
+def count_quotes(path, start, end):
+    file, encoding, dialect = open_file(path)
+    with file:
+        quote = split_quote(dialect, encoding)
+        if quote is None:
+            return 0
+        return sum(file[block:min(block + QUOTE_SCAN_BLOCK, end)].count(quote)
+                   for block in range(start, end, QUOTE_SCAN_BLOCK))
+
+
+def record_boundary(file, position, quoted, quote):
+    # The first record start at or after a position, given whether the position is inside a
+    # quoted field: just past the next newline outside quotes
+    while True:
+        if quoted:
+            closing_quote = file.find(quote, position)
+            if closing_quote == -1:
+                return len(file)
+            quoted, position = False, closing_quote + 1
+            continue
+        newline = file.find(b'\n', position)
+        if newline == -1:
+            return len(file)
+        opening_quote = file.find(quote, position, newline) if quote else -1
+        if opening_quote == -1:
+            return newline + 1
+        quoted, position = True, opening_quote + 1
+
+
+def aligned_ranges(path, parts, executor=None):
+    # Splits a file into up to `parts` byte ranges that each begin at a record. Whether a split
+    # point falls inside a quoted field follows from the parity of the quotes before it, which
+    # are counted in parallel.
+    file, encoding, dialect = open_file(path)
+    with file:
+        quote = split_quote(dialect, encoding)
+        ranges = split_ranges(len(file), parts)
+        starts, ends = zip(*ranges)
+        if quote is None:
+            counts = [0] * len(ranges)
+        elif executor is None:
+            counts = list(map(count_quotes, [path] * len(ranges), starts, ends))
+        else:
+            counts = list(executor.map(count_quotes, [path] * len(ranges), starts, ends))
+        bounds = [0]
+        for start, num_quotes in zip(starts[1:], itertools.accumulate(counts)):
+            bounds.append(max(record_boundary(file, start, num_quotes % 2 == 1, quote), bounds[-1]))
+        bounds.append(len(file))
+    return [[start, end] for start, end in zip(bounds, bounds[1:]) if end > start]
+
+
+def parallel_partial(path, workers):
+    # Analyzes one file with `workers` processes, each tallying the records of one byte range
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        ranges = aligned_ranges(path, workers, executor)
+        starts, ends = zip(*ranges)
+        return merge_partials(list(executor.map(compute_aligned_partial, [path] * len(ranges), starts, ends)))
+
+
+def store_partial(csvfile, merged):
+    # Caches the analyses of every column of a stored file from a partial covering the whole file,
+    # which types them from all of their cells rather than a sample
+    for index in range(len(merged['columns'])):
+        if db.session.get(ColumnAnalysis, (csvfile.sha256, index)) is not None:
+            continue
+        column = merged['columns'][index]
+        result = {'name': merged['header'][index], 'index': index, **column_counts(column).statistics()}
+        db.session.add(ColumnAnalysis(sha256=csvfile.sha256, column_index=index, result=result,
+                                      num_other=column['numOther'], rendered=rendering.render_column(result)))
+    try:
+        db.session.commit()
+    except sqlalchemy.exc.IntegrityError:
+        db.session.rollback()
+
+
+def parallel_analyses(csvfile, workers):
+    # Fills the analysis cache of a stored, uncompressed file in parallel, then returns its analyses.
+    # Files whose records can't be split up are analyzed as usual.
+    if csvfile.blob is not None and workers > 1:
+        try:
+            store_partial(csvfile, parallel_partial(store.full_path(csvfile.blob.path), workers))
+        except PartialError:
+            pass
+    return csvfile.analyses()
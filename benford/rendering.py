@@ -0,0 +1,46 @@
+import json
+import math
+
+from benford import util
+
+JSONAPI_VERSION = {'version': '1.0'}
+
+
+def dumps(obj):
+    # Compact JSON bytes, through orjson when it is installed
+    orjson = util.optional_import('orjson')
+    if orjson is None:
+        return json.dumps(obj, separators=(',', ':')).encode()
+    return orjson.dumps(obj)
+
+
+def render_column(result):
+    # orjson writes infinite test statistics (of empty columns) as null, where the standard
+    # library writes Infinity like the JSON:API resources do
+    if not math.isfinite(result['testStatistic']):
+        return json.dumps(result, separators=(',', ':')).encode()
+    return dumps(result)
+
+
+def render_array(items):
+    return b'[' + b','.join(items) + b']'
+
+
+def render_document(type_, id, self_link, attributes, relationships, rendered_attributes=None):
+    # A JSON:API document laid out like flask_rest_jsonapi's. Values in rendered_attributes are
+    # JSON bytes and are spliced in as they are, without being parsed or serialized again.
+    rendered = dumps(attributes)
+    for name, value in (rendered_attributes or {}).items():
+        separator = b'' if rendered == b'{}' else b','
+        rendered = rendered[:-1] + separator + dumps(name) + b':' + value + b'}'
+    data = dumps({
+        'type': type_,
+        'id': str(id),
+        'relationships': relationships,
+        'links': {'self': self_link},
+    })
+    return b''.join([
+        b'{"data":', data[:-1], b',"attributes":', rendered, b'},',
+        b'"links":', dumps({'self': self_link}), b',',
+        b'"jsonapi":', dumps(JSONAPI_VERSION), b'}',
+    ])
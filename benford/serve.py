@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+import importlib
+import os
+
+import click
+from gunicorn.app.base import BaseApplication
+
+from .app import LazyResource, create_app
+from .cache import DEFAULT_BUDGET, datasets
+from .models import db
+from . import parsers
+from .parsers import DEFAULT_MEMORY_BUDGET
+from .util import optional_import
+
+# Modules that are otherwise imported on first use. The master process loads them, along with
+# the resource views and templates, before forking so that workers share them copy-on-write
+# rather than each paying for them on its first requests.
+WARM_MODULES = ['chardet']
+WARM_OPTIONAL_MODULES = ['pyarrow.csv', 'numpy']
+WARM_TEMPLATES = ['index.html']
+
+
+def warm_up(app):
+    for name in WARM_MODULES:
+        importlib.import_module(name)
+    for name in WARM_OPTIONAL_MODULES:
+        optional_import(name)
+    for view in app.view_functions.values():
+        if isinstance(view, LazyResource):
+            view.load()
+    for name in WARM_TEMPLATES:
+        app.jinja_env.get_template(name)
+
+
+def post_fork(server, worker):
+    # Connections opened by the master must not be shared with its workers
+    db.engine.dispose()
+
+
+class Server(BaseApplication):
+    # Gunicorn's pre-forking server around an app that is created once, in the master process
+    def __init__(self, app, options):
+        self.app = app
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return self.app
+
+
+@click.command()
+@click.option('--bind', default='0.0.0.0:8000', envvar='BENFORD_BIND', show_default=True)
+@click.option('--workers', type=int, default=(os.cpu_count() or 1) * 2 + 1, envvar='BENFORD_WORKERS',
+              show_default='2 x CPUs + 1', help='Worker processes.')
+@click.option('--threads', type=int, default=1, envvar='BENFORD_THREADS', show_default=True,
+              help='Threads per worker.')
+@click.option('--timeout', type=int, default=120, envvar='BENFORD_TIMEOUT', show_default=True,
+              help='Seconds before a silent worker is killed and replaced.')
+@click.option('--graceful-timeout', type=int, default=30, envvar='BENFORD_GRACEFUL_TIMEOUT', show_default=True,
+              help='Seconds workers get to finish requests on restart or shutdown.')
+@click.option('--max-requests', type=int, default=1000, envvar='BENFORD_MAX_REQUESTS', show_default=True,
+              help='Requests after which a worker is recycled; 0 to disable.')
+@click.option('--memory-budget', type=int, default=DEFAULT_MEMORY_BUDGET >> 20, envvar='BENFORD_MEMORY_BUDGET',
+              show_default=True, help='MiB of working memory each column scan may use.')
+@click.option('--cache-budget', type=int, default=DEFAULT_BUDGET >> 20, envvar='BENFORD_CACHE_BUDGET',
+              show_default=True, help='MiB of parsed datasets each worker keeps between requests; 0 to disable.')
+@click.option('--db-path', default='./benford.db', envvar='BENFORD_DB_PATH', show_default=True)
+def main(bind, workers, threads, timeout, graceful_timeout, max_requests, memory_budget, cache_budget, db_path):
+    """Serve the app with a pool of pre-forked workers.
+
+    Send SIGHUP to restart the workers gracefully and SIGTERM to shut down after in-flight
+    requests have finished.
+    """
+    app = create_app(db_path)
+    app.config['DATASET_CACHE_BUDGET'] = cache_budget << 20
+    app.config['MEMORY_BUDGET'] = memory_budget << 20
+    datasets.init_app(app)
+    parsers.init_app(app)
+    warm_up(app)
+    Server(app, {
+        'bind': bind,
+        'workers': workers,
+        'threads': threads,
+        'timeout': timeout,
+        'graceful_timeout': graceful_timeout,
+        'max_requests': max_requests,
+        'max_requests_jitter': max_requests // 10,
+        'preload_app': True,
+        'post_fork': post_fork,
+    }).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+import bz2
+import gzip
+import hashlib
+import io
+import lzma
+import mmap
+import os
+import tempfile
+import zipfile
+import zlib
+from pathlib import Path
+
+CHUNK_SIZE = 1 << 20
+
+# Compressed uploads are stored as-is and decompressed as a stream whenever they are read
+MAGIC_NUMBERS = {
+    b'\x1f\x8b': 'gzip',
+    b'BZh': 'bz2',
+    b'\xfd7zXZ\x00': 'xz',
+    b'PK\x03\x04': 'zip',
+}
+
+# What a corrupt compressed blob can raise while it is being read
+READ_ERRORS = (OSError, EOFError, zlib.error, lzma.LZMAError, zipfile.BadZipFile)
+
+
+# Excel workbooks are zip archives too, but are read as they are
+WORKBOOK_MEMBER = 'xl/workbook.xml'
+
+
+def detect_compression(file):
+    header = file.read(max(len(magic) for magic in MAGIC_NUMBERS))
+    file.seek(0)
+    for magic, compression in MAGIC_NUMBERS.items():
+        if header.startswith(magic):
+            return None if compression == 'zip' and is_workbook(file) else compression
+    return None
+
+
+def is_workbook(file):
+    try:
+        return WORKBOOK_MEMBER in zipfile.ZipFile(file).namelist()
+    except zipfile.BadZipFile:
+        return False
+    finally:
+        file.seek(0)
+
+
+def decompress(path, compression):
+    # The decompressors open the file themselves, so that closing them closes it too
+    if compression == 'gzip':
+        return gzip.GzipFile(path)
+    if compression == 'bz2':
+        return bz2.BZ2File(path)
+    if compression == 'xz':
+        return lzma.LZMAFile(path)
+    if compression == 'zip':
+        # A member keeps the archive's file open until the member is closed
+        with zipfile.ZipFile(path) as archive:
+            members = [info for info in archive.infolist() if not info.is_dir()]
+            if len(members) != 1:
+                raise zipfile.BadZipFile('Zip uploads must contain exactly one file')
+            return archive.open(members[0])
+    return open(path, 'rb')
+
+
+# Content-addressed files on local disk, keyed by SHA-256 digest
+class BlobStore:
+    def __init__(self, root=None):
+        self.root = Path(root) if root else None
+
+    def init_app(self, app):
+        self.root = Path(app.config['BLOB_STORE_PATH'])
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def relative_path(digest):
+        # Fan out into subdirectories so no single directory grows too large
+        return os.path.join(digest[:2], digest[2:])
+
+    def full_path(self, path):
+        return self.root / path
+
+    def put(self, data):
+        # Copy a binary file-like object into the store, hashing as we go. Also returns whether this
+        # call created the file, which only one of several concurrent puts of the same content does.
+        sha256, size = hashlib.sha256(), 0
+        fd, temp_path = tempfile.mkstemp(dir=self.root, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as temp:
+                for chunk in iter(lambda: data.read(CHUNK_SIZE), b''):
+                    sha256.update(chunk)
+                    temp.write(chunk)
+                    size += len(chunk)
+            digest = sha256.hexdigest()
+            path = self.full_path(self.relative_path(digest))
+            path.parent.mkdir(exist_ok=True)
+            # Unlike a rename, a link fails rather than replacing a file that another put created
+            try:
+                os.link(temp_path, path)
+                created = True
+            except FileExistsError:
+                created = False
+        finally:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+        return digest, size, created
+
+    def open(self, path):
+        # Read-only memory maps let worker processes share the OS page cache
+        with open(self.full_path(path), 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:
+                # Zero-length files cannot be mapped
+                return io.BytesIO()
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def open_stream(self, path):
+        # The blob's contents, decompressed on the fly if it was uploaded compressed.
+        # Decompressors copy everything they read anyway, so they get a plain file instead of a map.
+        file = self.open(path)
+        compression = detect_compression(file)
+        if compression is None:
+            return file
+        file.close()
+        return decompress(self.full_path(path), compression)
+
+    def exists(self, path):
+        return self.full_path(path).exists()
+
+    def delete(self, path):
+        try:
+            self.full_path(path).unlink()
+        except FileNotFoundError:
+            pass
+
+
+store = BlobStore()
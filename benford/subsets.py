@@ -0,0 +1,134 @@
+import itertools
+import operator
+
+from benford import parsers, util
+
+# Predicates select the rows of a subset by the cell of another column, e.g.
+# {"column": "state", "op": "eq", "val": "NC"} or {"column": 3, "op": "between", "val": [18, 65]}.
+# eq, ne and in compare text, or numbers when given numbers; the other operators only hold for
+# numeric cells.
+OPERATORS = ['eq', 'ne', 'in', 'lt', 'le', 'gt', 'ge', 'between']
+COMPARISONS = {'lt': operator.lt, 'le': operator.le, 'gt': operator.gt, 'ge': operator.ge}
+
+# Currency symbols, thousands separators and whitespace, which util.scan() allows around numbers
+NUMBER_NOISE = str.maketrans('', '', '$€£¥, \t\r\n')
+
+
+class SubsetError(ValueError):
+    pass
+
+
+def number(cell):
+    # The value of a cell that util.scan() counts as numeric, or None. Parenthesized numbers are
+    # negative, as in accounting.
+    if not cell or util.NUMERIC_PATTERN.fullmatch(cell) is None:
+        return None
+    string = cell.translate(NUMBER_NOISE)
+    body = string.lstrip('+-(')
+    signs = string[:len(string) - len(body)]
+    value = float(body.rstrip(')'))
+    return -value if (signs.count('-') + signs.count('(')) % 2 else value
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def matcher(op, value):
+    # A test of a cell's text for a predicate
+    if op == 'between':
+        if not (isinstance(value, list) and len(value) == 2 and all(map(is_number, value))):
+            raise SubsetError('between needs a list of two numbers')
+        low, high = value
+
+        def test(cell):
+            x = number(cell)
+            return x is not None and low <= x <= high
+        return test
+
+    if op in COMPARISONS:
+        if not is_number(value):
+            raise SubsetError(f'{op} needs a number')
+        compare = COMPARISONS[op]
+
+        def test(cell):
+            x = number(cell)
+            return x is not None and compare(x, value)
+        return test
+
+    if op == 'in':
+        if not isinstance(value, list) or not value:
+            raise SubsetError('in needs a non-empty list of values')
+        values = value
+    else:
+        values = [value]
+    if not all(is_number(v) or isinstance(v, str) for v in values):
+        raise SubsetError(f'{op} compares with strings or numbers')
+    strings = {v for v in values if isinstance(v, str)}
+    numbers = {float(v) for v in values if is_number(v)}
+
+    def test(cell):
+        return cell in strings or bool(numbers) and number(cell) in numbers
+    if op == 'ne':
+        return lambda cell: not test(cell)
+    return test
+
+
+def column_index(column, header):
+    # Columns are given by index or by the name in the header
+    if isinstance(column, str) and column in header:
+        return header.index(column)
+    if isinstance(column, int) and not isinstance(column, bool) and 0 <= column < len(header):
+        return column
+    raise SubsetError(f'{column!r} is not a column of the file')
+
+
+def parse_predicates(where, header):
+    # [(column index, test of the cell's text)] for a list of predicates
+    if where is None:
+        return []
+    if not isinstance(where, list):
+        raise SubsetError('where must be a list of predicates')
+    predicates = []
+    for predicate in where:
+        if not isinstance(predicate, dict) or predicate.get('op') not in OPERATORS or 'val' not in predicate:
+            raise SubsetError(f'predicates need a column, an op (one of {", ".join(OPERATORS)}) and a val')
+        predicates.append((column_index(predicate.get('column'), header), matcher(predicate['op'], predicate['val'])))
+    return predicates
+
+
+def select(rows, width, predicates):
+    # Viable rows that satisfy every predicate
+    for row in rows:
+        if len(row) == width and all(test(row[index]) for index, test in predicates):
+            yield row
+
+
+def tally(rows, columns):
+    # One pass over the rows that tallies every column, a chunk of rows at a time
+    counts = {index: util.DigitCounts() for index in columns}
+    rows, num_rows = iter(rows), 0
+    while True:
+        chunk = list(itertools.islice(rows, parsers.PROGRESS_ROWS))
+        if not chunk:
+            return counts, num_rows
+        num_rows += len(chunk)
+        for index, column_counts in counts.items():
+            column_counts.update([row[index] for row in chunk])
+
+
+def column_result(header, index, counts):
+    result = {'name': header[index], 'index': index, **counts.statistics()}
+    if not counts.n:
+        # An empty subset has nothing to test, which mustn't read as conforming to Benford's law
+        result.update(testStatistic=None, goodnessOfFit=None)
+    return result
+
+
+def tally_table(table, start, end, columns):
+    # Rows [start, end) of a cached tables.Table, tallied in place
+    counts = {index: util.DigitCounts() for index in columns}
+    for index, column_counts in counts.items():
+        table.column(index)[start:end].tally(column_counts)
+    end = len(table) if end is None else min(end, len(table))
+    return counts, max(end - start, 0)
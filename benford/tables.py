@@ -0,0 +1,110 @@
+from array import array
+import itertools
+import sys
+
+from benford import parsers
+
+# Offsets into a column's text fit in 32 bits unless the column holds more characters than this
+MAX_NARROW_OFFSET = 0xFFFFFFFF
+
+
+class Column:
+    # The cells of a column stored back to back in one string, cell i spanning
+    # text[offsets[i]:offsets[i + 1]]. A list of cells costs a pointer and a string object
+    # (about 50 bytes before its characters) per cell; a column costs 4 or 8 bytes of offset.
+    # Slices share the text and the offsets, so only their own views are allocated.
+    def __init__(self, text, offsets):
+        self.text = text
+        self.offsets = offsets if isinstance(offsets, memoryview) else memoryview(offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                raise ValueError('Columns can only be sliced contiguously')
+            return Column(self.text, self.offsets[start:max(stop, start) + 1])
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError('Column index out of range')
+        return self.text[self.offsets[key]:self.offsets[key + 1]]
+
+    def __iter__(self):
+        text = self.text
+        return (text[start:end] for start, end in zip(self.offsets, self.offsets[1:]))
+
+    def tally(self, counts):
+        # Adds the cells to a util.DigitCounts without slicing them out of the text
+        counts.update_buffer(self.text, self.offsets)
+
+    def chunks(self, chunk_rows=None):
+        # Views of up to chunk_rows cells, in the shape parsers' column_chunks() yield, without
+        # byte positions
+        chunk_rows = chunk_rows or parsers.PROGRESS_ROWS
+        for start in range(0, len(self), chunk_rows):
+            yield self[start:start + chunk_rows], None
+
+    @property
+    def nbytes(self):
+        # What the column keeps alive, which for a slice includes the text of the whole column
+        return sys.getsizeof(self.text) + self.offsets.obj.itemsize * len(self.offsets.obj)
+
+
+class Table:
+    # Rows with the same number of cells held as one Column each, header row first
+    def __init__(self, columns):
+        self.columns = columns
+
+    @classmethod
+    def from_rows(cls, rows):
+        rows = iter(rows)
+        first_row = next(rows, None)
+        if first_row is None:
+            return cls([])
+        return cls(build_columns(itertools.chain([first_row], rows), len(first_row)))
+
+    def __len__(self):
+        return len(self.columns[0]) if self.columns else 0
+
+    def column(self, index):
+        return self.columns[index]
+
+    def rows(self, start=0, stop=None):
+        # Rows as lists of cells, from row `start` up to (not including) row `stop`
+        stop = len(self) if stop is None else min(stop, len(self))
+        columns = [column[start:stop] for column in self.columns]
+        return (list(row) for row in zip(*columns))
+
+    @property
+    def nbytes(self):
+        return sys.getsizeof(self.columns) + sum(column.nbytes for column in self.columns)
+
+
+def build_columns(rows, num_columns):
+    # Appends each row's cells to their columns' text a chunk at a time, so that no more than a
+    # chunk of cell strings is alive at once on top of the text built so far
+    chunk_rows = parsers.PROGRESS_ROWS
+    texts = [[] for _ in range(num_columns)]
+    parts = [[] for _ in range(num_columns)]
+    offsets = [array('Q', [0]) for _ in range(num_columns)]
+    lengths = [0] * num_columns
+    for number, row in enumerate(rows, 1):
+        for index, cell in enumerate(row):
+            parts[index].append(cell)
+            lengths[index] += len(cell)
+            offsets[index].append(lengths[index])
+        if number % chunk_rows == 0:
+            for index in range(num_columns):
+                texts[index].append(''.join(parts[index]))
+                parts[index] = []
+    columns = []
+    for index in range(num_columns):
+        texts[index].append(''.join(parts[index]))
+        column_offsets = offsets[index]
+        if column_offsets[-1] <= MAX_NARROW_OFFSET:
+            column_offsets = array('I', column_offsets)
+        columns.append(Column(''.join(texts[index]), column_offsets))
+    return columns
@@ -0,0 +1,153 @@
+import datetime
+import itertools
+import re
+
+from benford import util
+
+# Tried against a sample of the date column. Ties go to the earlier format, so day-first dates
+# are only picked up once the sample contains a day past the 12th.
+DATE_FORMATS = [
+    'iso', '%m/%d/%Y', '%d/%m/%Y', '%m/%d/%y', '%d/%m/%y', '%Y/%m/%d', '%d.%m.%Y',
+    '%d-%b-%Y', '%d %b %Y', '%b %d, %Y', '%d %B %Y', '%B %d, %Y', '%Y%m%d',
+]
+DATE_SAMPLE_SIZE = 100
+
+CALENDAR_WINDOWS = ['day', 'week', 'month', 'quarter', 'year']
+# Rolling windows are given as a number of days, e.g. '30d'
+ROLLING_WINDOW_PATTERN = re.compile(r'(?P<days>[1-9]\d*)d')
+MAX_ROLLING_DAYS = 3660
+
+
+class WindowError(ValueError):
+    pass
+
+
+def parse_date(string, date_format):
+    if date_format == 'iso':
+        # Also accepts ISO timestamps, which are truncated to their date
+        return datetime.date.fromisoformat(string.strip()[:10])
+    return datetime.datetime.strptime(string.strip(), date_format).date()
+
+
+def is_date(string, date_format):
+    try:
+        parse_date(string, date_format)
+    except ValueError:
+        return False
+    return True
+
+
+def detect_date_format(cells):
+    # The format that parses the most sampled cells, as long as that is most of them
+    sample = [cell for cell in itertools.islice(cells, DATE_SAMPLE_SIZE) if cell.strip()]
+    best_format, best_count = None, len(sample) // 2
+    for date_format in DATE_FORMATS:
+        count = sum(1 for cell in sample if is_date(cell, date_format))
+        if count > best_count:
+            best_format, best_count = date_format, count
+    return best_format
+
+
+def window_start(date, window):
+    if window == 'week':
+        return date - datetime.timedelta(days=date.weekday())
+    if window == 'month':
+        return date.replace(day=1)
+    if window == 'quarter':
+        return date.replace(month=(date.month - 1) // 3 * 3 + 1, day=1)
+    if window == 'year':
+        return date.replace(month=1, day=1)
+    return date
+
+
+def window_end(start, window):
+    if window == 'week':
+        return start + datetime.timedelta(days=6)
+    if window in ('month', 'quarter', 'year'):
+        months = {'month': 1, 'quarter': 3, 'year': 12}[window]
+        month = start.month - 1 + months
+        return start.replace(year=start.year + month // 12, month=month % 12 + 1) - datetime.timedelta(days=1)
+    return start
+
+
+def parse_window(window):
+    # Returns a calendar window name or a number of days for a rolling window
+    if window in CALENDAR_WINDOWS:
+        return window
+    match = ROLLING_WINDOW_PATTERN.fullmatch(window)
+    if match is None or int(match.group('days')) > MAX_ROLLING_DAYS:
+        raise WindowError(
+            f'window must be one of {", ".join(CALENDAR_WINDOWS)} or a number of days such as 30d'
+        )
+    return int(match.group('days'))
+
+
+def bucket_rows(rows, date_column, column, window, date_format=None):
+    # A single hashed pass that tallies leading digits per calendar window (or per day, for
+    # rolling windows). Each distinct date string is only parsed once.
+    rows = iter(rows)
+    header = next(rows, None)
+    if header is None:
+        return {}, 0, None
+    if not (0 <= date_column < len(header) and 0 <= column < len(header)):
+        raise WindowError('date_column and column must be indices of columns in the file')
+    head = list(itertools.islice(rows, DATE_SAMPLE_SIZE))
+    date_format = date_format or detect_date_format(row[date_column] for row in head)
+    if date_format is None:
+        return {}, 0, None
+
+    key = 'day' if isinstance(window, int) else window
+    buckets, starts, num_skipped = {}, {}, 0
+    rows = itertools.chain(head, rows)
+    # The first row is usually a header, in which case its date won't parse and isn't counted
+    if is_date(header[date_column], date_format):
+        rows = itertools.chain([header], rows)
+    for row in rows:
+        string = row[date_column]
+        start = starts.get(string)
+        if start is None:
+            try:
+                start = window_start(parse_date(string, date_format), key)
+            except ValueError:
+                start = False
+            starts[string] = start
+        if start is False:
+            num_skipped += 1
+            continue
+        counts = buckets.get(start)
+        if counts is None:
+            counts = buckets[start] = util.DigitCounts()
+        counts.update([row[column]])
+    return buckets, num_skipped, date_format
+
+
+def calendar_series(buckets, window):
+    for start in sorted(buckets):
+        yield start, window_end(start, window), buckets[start]
+
+
+def rolling_series(buckets, days):
+    # Slides a window of `days` days over the daily tallies in date order, adding the day that
+    # enters the window and removing those that leave it, so each point costs O(1) merges
+    dates = sorted(buckets)
+    running, first = util.DigitCounts(), 0
+    for date in dates:
+        running.merge(buckets[date])
+        start = date - datetime.timedelta(days=days - 1)
+        while dates[first] < start:
+            running.merge(buckets[dates[first]], sign=-1)
+            first += 1
+        yield start, date, running
+
+
+def time_series(rows, date_column, column, window, date_format=None):
+    # Per-window Benford statistics of `column`, keyed on the dates in `date_column`
+    window = parse_window(window)
+    buckets, num_skipped, date_format = bucket_rows(rows, date_column, column, window, date_format)
+    series = rolling_series(buckets, window) if isinstance(window, int) else calendar_series(buckets, window)
+    data = [
+        {'start': start.isoformat(), 'end': end.isoformat(), **counts.statistics()}
+        for start, end, counts in series
+        if counts.n
+    ]
+    return data, {'dateFormat': date_format, 'numSkipped': num_skipped}
@@ -1,4 +1,9 @@
+import concurrent.futures
+import functools
+import importlib
+import importlib.util
 import math
+import os
 import re
 
 # Taken from https://www.itl.nist.gov/div898/handbook/eda/section3/eda3674.htm
@@ -11,6 +16,66 @@ CRITICAL_VALUES = {
     '0.001': 26.125,
 }
 
+BLANK, NUMERIC, OTHER = 'blank', 'numeric', 'other'
+
+
+def module_available(name):
+    # Whether an optional dependency is installed, without paying for importing it
+    return importlib.util.find_spec(name) is not None
+
+
+@functools.lru_cache(maxsize=None)
+def optional_import(name):
+    # Imports an optional dependency on first use, returning None if it isn't installed
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
+
+
+NUMPY_AVAILABLE = module_available('numpy')
+
+# Simulated tests draw their samples in chunks of this many replicates, each from its own
+# generator spawned from the seed, so results don't depend on how many threads run them
+SIMULATION_CHUNK = 10000
+SIMULATION_SEED = 0
+# The default limit on ?simulations= (the app's MAX_SIMULATIONS), which bounds the time and the
+# memory (a float per replicate) that one column's p-value takes within a request
+MAX_SIMULATIONS = 10 ** 5
+
+# A single compiled pattern classifies a cell and captures its significant digits, so text
+# cells are rejected without raising. Accepts thousands separators, currency symbols,
+# accounting-style parenthesized negatives and scientific notation.
+NUMERIC_PATTERN = re.compile(r"""
+    \s*
+    [-+$€£¥]*
+    (?P<open>\()?
+    [-+$€£¥]*
+    (?:
+        (?=\.?\d)
+        [0,]*                                          # insignificant leading zeroes
+        (?:
+            (?P<integer>[1-9])[\d,]*(?:\.\d*)?
+          | (?:\.0*(?P<fraction>[1-9])?\d*)?
+        )
+        (?:[eE][-+]?\d+)?
+      | nan | inf(?:inity)?
+    )
+    (?(open)\))
+    \s*
+""", re.VERBOSE | re.IGNORECASE)
+
+
+def scan(string):
+    # Returns the cell's kind and its first significant digit (None if it has none)
+    if not string:
+        return BLANK, None
+    match = NUMERIC_PATTERN.fullmatch(string)
+    if match is None:
+        return OTHER, None
+    digit = match.group('integer') or match.group('fraction')
+    return NUMERIC, ord(digit) - 48 if digit else None
+
 
 def parse_numeric(string):
     # Some minimal string formatting
@@ -48,18 +113,111 @@ def get_first_digit(string):
     raise ValueError(f'Cannot parse string: "{string}"')
 
 
-def clean_data(raw_data):
-    skipped, data = [], []
+def scan_data(raw_data):
+    # Leading digits of the numeric cells, plus a count of cells that are neither numeric nor blank
+    data, num_other = [], 0
 
     for string in raw_data:
-        try:
-            first_digit = get_first_digit(string)
-        except ValueError:
-            skipped.append(string)
-        else:
-            data.append(int(first_digit))
+        kind, first_digit = scan(string)
+        if first_digit is not None:
+            data.append(first_digit)
+        elif kind == OTHER:
+            num_other += 1
+
+    return data, num_other
+
+
+class DigitCounts:
+    # Running tally of leading digits for columns that are read a chunk at a time
+    def __init__(self):
+        self.counts = [0] * 10
+        self.num_other = 0
+        self.num_cells = 0
+
+    def update(self, cells):
+        for string in cells:
+            kind, first_digit = scan(string)
+            if first_digit is not None:
+                self.counts[first_digit] += 1
+            elif kind == OTHER:
+                self.num_other += 1
+        self.num_cells += len(cells)
+
+    def update_buffer(self, text, offsets):
+        # The same for cells stored back to back in one string (see benford.tables), matched in
+        # place rather than sliced out
+        fullmatch, num_cells = NUMERIC_PATTERN.fullmatch, len(offsets) - 1
+        for start, end in zip(offsets, offsets[1:]):
+            if start == end:
+                continue
+            match = fullmatch(text, start, end)
+            if match is None:
+                self.num_other += 1
+                continue
+            digit = match.group('integer') or match.group('fraction')
+            if digit:
+                self.counts[ord(digit) - 48] += 1
+        self.num_cells += num_cells
 
-    return data
+    def merge(self, other, sign=1):
+        # Adds (or with sign=-1, removes) the tallies of another DigitCounts
+        self.counts = [a + sign * b for a, b in zip(self.counts, other.counts)]
+        self.num_other += sign * other.num_other
+        self.num_cells += sign * other.num_cells
+
+    @property
+    def n(self):
+        return sum(self.counts)
+
+    def observed_distribution(self):
+        return {str(x): self.counts[x] for x in range(1, 10)}
+
+    def statistics(self):
+        expected = expected_distribution(self.n)
+        observed = self.observed_distribution()
+        return {
+            'n': self.n,
+            'expectedDistribution': expected,
+            'observedDistribution': observed,
+            'testStatistic': sum_chi_squares(expected, observed),
+            'criticalValues': CRITICAL_VALUES,
+            'goodnessOfFit': goodness_of_fit(expected, observed)
+        }
+
+
+def drain(generator):
+    # Runs a generator to completion and returns its return value
+    try:
+        while True:
+            next(generator)
+    except StopIteration as stop:
+        return stop.value
+
+
+def capture(generator, results):
+    # Yields what a generator yields, then appends its return value to results
+    results.append((yield from generator))
+
+
+def clean_data(raw_data):
+    return scan_data(raw_data)[0]
+
+
+def infer_column_types(rows):
+    # Classifies each column as NUMERIC or OTHER; the first row may be a header so it only sets the width
+    rows = iter(rows)
+    header = next(rows, None)
+    if header is None:
+        return []
+
+    candidates = set(range(len(header)))
+    for row in rows:
+        disqualified = [i for i in candidates if scan(row[i])[0] == OTHER]
+        candidates.difference_update(disqualified)
+        if not candidates:
+            break
+
+    return [NUMERIC if i in candidates else OTHER for i in range(len(header))]
 
 
 def benford(x):
@@ -102,6 +260,69 @@ def conforms_to_benford(raw_data):
                            observed_distribution(digits))
 
 
+def chi_squares(counts, expected):
+    # Vectorized sum_chi_squares() over the last axis of an array of digit counts
+    return ((counts - expected) ** 2 / expected).sum(axis=-1)
+
+
+def benford_probabilities():
+    numpy = optional_import('numpy')
+    probabilities = numpy.array([benford(x) for x in range(1, 10)])
+    # Guards against the rounding error numpy's multinomial sampler refuses
+    return probabilities / probabilities.sum()
+
+
+def simulate_chunk(seed, n, size):
+    numpy = optional_import('numpy')
+    probabilities = benford_probabilities()
+    counts = numpy.random.default_rng(seed).multinomial(n, probabilities, size=size)
+    return chi_squares(counts, probabilities * n)
+
+
+def count_exceeding(seed, n, statistic, size):
+    return int((simulate_chunk(seed, n, size) >= statistic).sum())
+
+
+def map_simulations(function, simulations, seed, workers, *args):
+    # function(chunk seed, *args, chunk size) for each chunk of `simulations` replicates.
+    # NumPy releases the GIL while sampling, so the chunks run in parallel on threads.
+    numpy = optional_import('numpy')
+    sizes = [SIMULATION_CHUNK] * (simulations // SIMULATION_CHUNK)
+    if simulations % SIMULATION_CHUNK:
+        sizes.append(simulations % SIMULATION_CHUNK)
+    seeds = numpy.random.SeedSequence(seed).spawn(len(sizes))
+    calls = [(chunk_seed, *args, size) for chunk_seed, size in zip(seeds, sizes)]
+    workers = min(workers or os.cpu_count() or 1, len(sizes))
+    if workers <= 1:
+        return [function(*call) for call in calls]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(lambda call: function(*call), calls))
+
+
+def simulate_chi_squares(n, simulations, seed=SIMULATION_SEED, workers=None):
+    # Test statistics of `simulations` samples of n Benford-distributed leading digits
+    numpy = optional_import('numpy')
+    return numpy.concatenate(map_simulations(simulate_chunk, simulations, seed, workers, n))
+
+
+def simulated_p_value(observed_dist, simulations, seed=SIMULATION_SEED, workers=None):
+    # Monte Carlo alternative to goodness_of_fit(), which doesn't rely on the chi-square
+    # approximation and so holds up for small n. Returns None if NumPy isn't installed.
+    numpy = optional_import('numpy')
+    if numpy is None:
+        return None
+    counts = numpy.array([observed_dist[str(x)] for x in range(1, 10)])
+    n = int(counts.sum())
+    if not n or not simulations:
+        return None
+    # Each chunk's statistics are compared as they are drawn, so memory doesn't grow with the
+    # number of simulations
+    statistic = chi_squares(counts, benford_probabilities() * n)
+    exceeding = sum(map_simulations(count_exceeding, simulations, seed, workers, n, statistic))
+    # Counting the observed sample as one of the replicates keeps the estimate above zero
+    return (exceeding + 1) / (simulations + 1)
+
+
 def underscore_to_camel(name):
     under_pat = re.compile(r'_([a-z])')
     return under_pat.sub(lambda x: x.group(1).upper(), name)
@@ -1,60 +1,92 @@
 import random
 from functools import lru_cache
+import tracemalloc
 
-from benford import analysis
-from unittest import TestCase
+from benford import util
+from unittest import TestCase, skipIf
 
 
 class TestParseNumeric(TestCase):
     def test_simple_cases(self):
-        self.assertEqual('100.0', analysis.parse_numeric('100.0'))
-        self.assertEqual('100', analysis.parse_numeric('100'))
-        self.assertEqual('.1', analysis.parse_numeric('.1'))
+        self.assertEqual('100.0', util.parse_numeric('100.0'))
+        self.assertEqual('100', util.parse_numeric('100'))
+        self.assertEqual('.1', util.parse_numeric('.1'))
 
     def test_removes_leading_sign(self):
-        self.assertEqual('100.25', analysis.parse_numeric('-100.25'))
+        self.assertEqual('100.25', util.parse_numeric('-100.25'))
 
     def test_removes_leading_dollar_symbol(self):
-        self.assertEqual('100', analysis.parse_numeric('$100'))
-        self.assertEqual('100.25', analysis.parse_numeric('$100.25'))
-        self.assertEqual('100.25', analysis.parse_numeric('$-100.25'))
-        self.assertEqual('100.25', analysis.parse_numeric('-$100.25'))
+        self.assertEqual('100', util.parse_numeric('$100'))
+        self.assertEqual('100.25', util.parse_numeric('$100.25'))
+        self.assertEqual('100.25', util.parse_numeric('$-100.25'))
+        self.assertEqual('100.25', util.parse_numeric('-$100.25'))
 
     def test_removes_commas(self):
-        self.assertEqual('1234', analysis.parse_numeric('1,234'))
-        self.assertEqual('10000', analysis.parse_numeric('$10,000'))
+        self.assertEqual('1234', util.parse_numeric('1,234'))
+        self.assertEqual('10000', util.parse_numeric('$10,000'))
 
     def test_raises_value_error_on_empty_string(self):
-        self.assertRaises(ValueError, analysis.parse_numeric, '')
+        self.assertRaises(ValueError, util.parse_numeric, '')
 
     def test_raises_value_error_on_non_numeric_string(self):
-        self.assertRaises(ValueError, analysis.parse_numeric, 'Not a number')
+        self.assertRaises(ValueError, util.parse_numeric, 'Not a number')
 
     def test_raises_value_error_on_multiple_decimal_points(self):
-        self.assertRaises(ValueError, analysis.parse_numeric, '1.31.56')
+        self.assertRaises(ValueError, util.parse_numeric, '1.31.56')
 
     def test_raises_value_error_on_unknown_symbol_in_otherwise_numeric_string(self):
-        self.assertRaises(ValueError, analysis.parse_numeric, '1/31/56')
-        self.assertRaises(ValueError, analysis.parse_numeric, '€100')
+        self.assertRaises(ValueError, util.parse_numeric, '1/31/56')
+        self.assertRaises(ValueError, util.parse_numeric, '€100')
 
 
 class TestGetFirstDigit(TestCase):
     def test_simple_cases(self):
-        self.assertEqual('2', analysis.get_first_digit('25'))
-        self.assertEqual('4', analysis.get_first_digit('4'))
-        self.assertEqual('1', analysis.get_first_digit('123'))
+        self.assertEqual('2', util.get_first_digit('25'))
+        self.assertEqual('4', util.get_first_digit('4'))
+        self.assertEqual('1', util.get_first_digit('123'))
 
     def test_strips_leading_zeroes(self):
-        self.assertEqual('2', analysis.get_first_digit('0.25'))
+        self.assertEqual('2', util.get_first_digit('0.25'))
 
     def test_strips_sign_from_negative_number(self):
-        self.assertEqual('2', analysis.get_first_digit('-0.25'))
+        self.assertEqual('2', util.get_first_digit('-0.25'))
 
     def test_raises_value_error_on_string_without_nonzero_digits(self):
-        self.assertRaises(ValueError, analysis.get_first_digit, '0.0')
+        self.assertRaises(ValueError, util.get_first_digit, '0.0')
 
     def test_raises_value_error_on_non_numeric_string(self):
-        self.assertRaises(ValueError, analysis.get_first_digit, '5c00bf')
+        self.assertRaises(ValueError, util.get_first_digit, '5c00bf')
+
+
+class TestScan(TestCase):
+    def test_blank(self):
+        self.assertEqual((util.BLANK, None), util.scan(''))
+
+    def test_text_is_other(self):
+        for string in ['Not a number', '1.31.56', '1/31/56', '5c00bf', '\n', '$', '.', '(1']:
+            self.assertEqual((util.OTHER, None), util.scan(string), string)
+
+    def test_first_significant_digit(self):
+        cases = {
+            '25': 2, '0.25': 2, '-0.25': 2, '.09': 9, '020': 2, ' 7 ': 7, '+3': 3,
+            '1,234': 1, '$10,000': 1, '-$808.8': 8, '$-100.25': 1, '€100': 1, '£9.99': 9,
+            '(1,234.00)': 1, '($0.45)': 4, '$(60)': 6,
+            '1.5e3': 1, '0.0042E-07': 4, '6E+05': 6,
+        }
+        for string, digit in cases.items():
+            self.assertEqual((util.NUMERIC, digit), util.scan(string), string)
+
+    def test_numeric_without_significant_digit(self):
+        for string in ['0', '0.0', '-0', '0e5', 'nan', 'inf', '-Infinity']:
+            self.assertEqual((util.NUMERIC, None), util.scan(string), string)
+
+    def test_agrees_with_get_first_digit(self):
+        for string in ['123', '-$0.3', '$808.8', '70.7', '0.0', 'Pi is exactly 3', '1/31/56']:
+            try:
+                expected = int(util.get_first_digit(string))
+            except ValueError:
+                expected = None
+            self.assertEqual(expected, util.scan(string)[1], string)
 
 
 class TestDistributions(TestCase):
@@ -66,7 +98,7 @@ class TestDistributions(TestCase):
         raw_data += ['-' + item for item in raw_data]
         raw_data += ['eleventy-one', '\n', '', 'Pi is exactly 3']
 
-        self.data = analysis.clean_data(raw_data)
+        self.data = util.clean_data(raw_data)
 
     def test_clean_data(self):
         self.assertEqual([1, 2, 3, 4, 5, 6, 7, 8, 9] * 2, self.data)
@@ -74,13 +106,13 @@ class TestDistributions(TestCase):
     def test_observed_distribution_is_accurate(self):
         self.assertEqual(
             {str(x): 2 for x in range(1, 10)},
-            analysis.observed_distribution(self.data)
+            util.observed_distribution(self.data)
         )
 
     def test_observed_distribution_on_empty_list(self):
         self.assertEqual(
             {str(x): 0 for x in range(1, 10)},
-            analysis.observed_distribution([])
+            util.observed_distribution([])
         )
 
     def test_observed_distribution_on_absent_digits(self):
@@ -96,7 +128,7 @@ class TestDistributions(TestCase):
                 '8': 0,
                 '9': 0,
             },
-            analysis.observed_distribution([1, 2, 2, 1])
+            util.observed_distribution([1, 2, 2, 1])
         )
 
     def test_expected_distribution_with_originally_published_table(self):
@@ -105,12 +137,12 @@ class TestDistributions(TestCase):
 
         # Benford rounded figures in his paper so we'll look for near but not exact equality
         for i, published_frequency in enumerate(expected_frequencies):
-            self.assertAlmostEqual(published_frequency, analysis.benford(i + 1),
+            self.assertAlmostEqual(published_frequency, util.benford(i + 1),
                                    places=3)
 
             # Using a distribution with n=1 because above data is represented in percentages
             self.assertAlmostEqual(published_frequency,
-                                   analysis.expected_distribution(1)[str(i + 1)],
+                                   util.expected_distribution(1)[str(i + 1)],
                                    places=3)
 
     def test_expected_distribution_with_published_atomic_weight_data(self):
@@ -122,7 +154,7 @@ class TestDistributions(TestCase):
         observed_percentages = [0.472, 0.187, 0.055, 0.044, 0.066, 0.044, 0.033, 0.044, 0.05]
         observed_sum_of_differences = 35.4
 
-        expected_distribution = analysis.expected_distribution(atomic_weights_n)
+        expected_distribution = util.expected_distribution(atomic_weights_n)
 
         differences_from_expected = [abs(value - observed_percentages[i] * atomic_weights_n)
                                      for i, value in enumerate(expected_distribution.values())]
@@ -150,10 +182,10 @@ class TestDistributions(TestCase):
         # closely approximates Benford's law (in our case, the first digits of the Fibonacci series)
 
         fibonacci_data = [str(fibonacci(x)) for x in range(1, 200)]
-        fibonacci_leading_digits = analysis.clean_data(fibonacci_data)
-        fibonacci_expected_distribution = analysis.expected_distribution(len(fibonacci_data))
-        fibonacci_observed_distribution = analysis.observed_distribution(fibonacci_leading_digits)
-        fibonacci_sum_chi_squares = analysis.sum_chi_squares(
+        fibonacci_leading_digits = util.clean_data(fibonacci_data)
+        fibonacci_expected_distribution = util.expected_distribution(len(fibonacci_data))
+        fibonacci_observed_distribution = util.observed_distribution(fibonacci_leading_digits)
+        fibonacci_sum_chi_squares = util.sum_chi_squares(
             fibonacci_expected_distribution,
             fibonacci_observed_distribution
         )
@@ -161,14 +193,14 @@ class TestDistributions(TestCase):
 
         # Lastly, let's see if the Fibonacci digits pass our goodness of fit test--
         # i.e., if the test statistic failed to exceed the critical value
-        self.assertFalse(analysis.goodness_of_fit(
+        self.assertFalse(util.goodness_of_fit(
             fibonacci_expected_distribution,
             fibonacci_observed_distribution)['0.001']
         )
 
         # The conforms_to_benford() function ties it all together in a DRY way
         # It returns a dict of critical values : test results
-        for critical_value, test_result in analysis.conforms_to_benford(fibonacci_data).items():
+        for critical_value, test_result in util.conforms_to_benford(fibonacci_data).items():
             self.assertFalse(test_result)
 
     def test_goodness_of_fit_with_randomly_generated_numbers(self):
@@ -181,10 +213,10 @@ class TestDistributions(TestCase):
         # that violates it (in our case, a list of numbers generated by random.randint())
 
         random_data = [random_with_n_digits(random.randint(2, 4)) for _ in range(1000)]
-        random_leading_digits = analysis.clean_data(random_data)
-        random_expected_distribution = analysis.expected_distribution(len(random_data))
-        random_observed_distribution = analysis.observed_distribution(random_leading_digits)
-        random_sum_chi_squares = analysis.sum_chi_squares(
+        random_leading_digits = util.clean_data(random_data)
+        random_expected_distribution = util.expected_distribution(len(random_data))
+        random_observed_distribution = util.observed_distribution(random_leading_digits)
+        random_sum_chi_squares = util.sum_chi_squares(
             random_expected_distribution,
             random_observed_distribution
         )
@@ -193,7 +225,56 @@ class TestDistributions(TestCase):
         # Our random data should be flatly distributed, so it should return True here,
         # indicating that we can reject the null hypothesis that the data is distributed
         # according to Benford's law
-        self.assertTrue(analysis.goodness_of_fit(
+        self.assertTrue(util.goodness_of_fit(
             random_expected_distribution,
             random_observed_distribution)['0.001']
-        )
\ No newline at end of file
+        )
+
+
+@skipIf(not util.NUMPY_AVAILABLE, 'NumPy is not installed')
+class TestSimulatedPValue(TestCase):
+    def setUp(self):
+        self.conforming = util.observed_distribution([1] * 30 + [2] * 18 + [3] * 12 + [4] * 10 + [5] * 8
+                                                         + [6] * 7 + [7] * 6 + [8] * 5 + [9] * 4)
+        self.skewed = util.observed_distribution([1] * 3 + [2] * 18 + [3] * 12 + [4] * 10 + [5] * 8
+                                                     + [6] * 7 + [7] * 6 + [8] * 5 + [9] * 4)
+
+    def test_is_deterministic(self):
+        self.assertEqual(
+            util.simulated_p_value(self.skewed, 25000, seed=7),
+            util.simulated_p_value(self.skewed, 25000, seed=7)
+        )
+
+    def test_does_not_depend_on_workers(self):
+        self.assertEqual(
+            util.simulated_p_value(self.skewed, 25000, workers=1),
+            util.simulated_p_value(self.skewed, 25000, workers=4)
+        )
+
+    def test_agrees_with_chi_square_test(self):
+        self.assertGreater(util.simulated_p_value(self.conforming, 10000), 0.1)
+        p_value = util.simulated_p_value(self.skewed, 10000)
+        self.assertLess(p_value, 0.01)
+        # The skewed sample is rejected at 0.01 but not at 0.001 by the chi-square test too
+        self.assertGreater(p_value, 0.0001)
+
+    def test_empty_sample(self):
+        self.assertIsNone(util.simulated_p_value(util.observed_distribution([]), 1000))
+
+    def test_memory_does_not_grow_with_simulations(self):
+        # A float per replicate would take 8 MB
+        tracemalloc.start()
+        try:
+            util.simulated_p_value(self.skewed, 10 ** 6, workers=1)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertLess(peak, 4 << 20)
+
+    def test_simulated_statistics_follow_chi_square_distribution(self):
+        statistics = util.simulate_chi_squares(1000, 100000)
+        self.assertEqual((100000,), statistics.shape)
+        # The mean of a chi-square distribution is its degrees of freedom
+        self.assertAlmostEqual(8, statistics.mean(), delta=0.1)
+        share_rejected = (statistics > util.CRITICAL_VALUES['0.05']).mean()
+        self.assertAlmostEqual(0.05, share_rejected, delta=0.005)
@@ -1,9 +1,15 @@
+import csv
 from datetime import datetime
+import io
+import json
+from unittest import mock, skipIf
+import zipfile
 
 from flask import url_for
 
-from benford.database import db
-from benford.models import CSVFile
+from benford.models import db
+from benford import partials, rendering, util
+from benford.models import Blob, ColumnAnalysis, CSVFile, Stream
 from backend.test_base import CSV_FILES, AppTestCase, DATETIME_FSTRING
 
 
@@ -176,6 +182,122 @@ class TestUploadEndpoint(APITestCase):
         self.assertEqual(2, len(CSVFile.query.all()))
 
 
+class TestBulkUploadEndpoint(APITestCase):
+    endpoint = '/upload/bulk'
+
+    def setUp(self):
+        super().setUp()
+        self.app.config['INGEST_WORKERS'] = 2
+        self.app.config['INGEST_BATCH_SIZE'] = 2
+
+    def zip_archive(self, members):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zip_file:
+            for name, path in members:
+                zip_file.write(path, name)
+        archive.seek(0)
+        return archive
+
+    def test_upload_with_no_files(self):
+        response = self.client.post(self.endpoint)
+        self.assertEqual(response.status_code, 422)
+
+    def test_upload_many_files(self):
+        response = self.client.post(self.endpoint, data={
+            'csv': [(io.BytesIO(path.read_bytes()), path.name) for path in CSV_FILES]
+        })
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual({'created': 3, 'failed': 0}, data['meta'])
+        self.assertEqual(
+            [path.name for path in CSV_FILES],
+            [csvfile.filename for csvfile in CSVFile.query.order_by(CSVFile.id)]
+        )
+        self.assertEqual(
+            [str(csvfile.id) for csvfile in CSVFile.query.order_by(CSVFile.id)],
+            [str(entry['id']) for entry in data['data']]
+        )
+
+    def test_upload_archive_reports_status_per_file(self):
+        with open(CSV_FILES[0], 'rb') as f:
+            self.client.post('/upload', data={'csv': (f, CSV_FILES[0].name)})
+
+        archive = self.zip_archive([
+            (CSV_FILES[0].name, CSV_FILES[0]),
+            ('exports/copy.csv', CSV_FILES[0]),
+            ('exports/' + CSV_FILES[1].name, CSV_FILES[1]),
+            ('bad.csv', CSV_FILES[0].parent / 'test_csv_bad_file.csv'),
+        ])
+        response = self.client.post(self.endpoint, data={'archive': (archive, 'exports.zip')})
+        data = response.get_json()
+
+        self.assertEqual(
+            [
+                (CSV_FILES[0].name, 'failed'),
+                ('copy.csv', 'created'),
+                (CSV_FILES[1].name, 'created'),
+                ('bad.csv', 'failed'),
+            ],
+            [(entry['filename'], entry['status']) for entry in data['data']]
+        )
+        self.assertEqual('Error: An uploaded file with that name already exists.', data['data'][0]['message'])
+        self.assertEqual('Error: This file could not be parsed as a .csv.', data['data'][3]['message'])
+
+        # The duplicate content shares a blob, and the unparseable file isn't kept
+        self.assertEqual(3, CSVFile.query.count())
+        self.assertEqual(2, Blob.query.count())
+        copy = CSVFile.query.filter_by(filename='copy.csv').one()
+        self.assertEqual(CSV_FILES[0].read_bytes(), copy.file)
+        self.assertEqual(
+            CSVFile.query.filter_by(filename=CSV_FILES[0].name).one().viable_columns(),
+            copy.viable_columns()
+        )
+
+    def test_upload_unreadable_archive(self):
+        response = self.client.post(self.endpoint, data={'archive': (io.BytesIO(b'not an archive'), 'x.zip')})
+        self.assertEqual(response.status_code, 422)
+
+
+class TestRowsEndpoint(APITestCase):
+    endpoint = '/csv/{id}/rows?offset={offset}&limit={limit}'
+
+    def setUp(self):
+        super().setUp()
+        with open(CSV_FILES[0], 'rb') as data:
+            self.client.post('/upload', data={'csv': (data, CSV_FILES[0].name)})
+        self.csvfile = CSVFile.query.one()
+        with open(CSV_FILES[0]) as f:
+            self.rows = list(csv.reader(f))
+
+    def test_upload_builds_row_index(self):
+        self.assertIsNotNone(self.csvfile.blob.row_index)
+
+    def test_page(self):
+        response = self.get_response(id=self.csvfile.id, offset=40, limit=25)
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual(self.rows[40:65], data['data'])
+        self.assertEqual({'offset': 40, 'limit': 25, 'numRows': len(self.rows)}, data['meta'])
+        self.assertIn('next', data['links'])
+        self.assertIn('prev', data['links'])
+
+    def test_last_page(self):
+        data = self.get_response(id=self.csvfile.id, offset=100, limit=25).get_json()
+        self.assertEqual(self.rows[100:], data['data'])
+        self.assertNotIn('next', data['links'])
+
+    def test_bad_parameters(self):
+        response = self.get_response(id=self.csvfile.id, offset='x', limit=25)
+        self.assertEqual(response.status_code, 400)
+        for limit in [0, -5]:
+            response = self.get_response(id=self.csvfile.id, offset=0, limit=limit)
+            self.assertEqual(response.status_code, 400, limit)
+
+    def test_missing_file(self):
+        response = self.get_response(id=self.csvfile.id + 1, offset=0, limit=25)
+        self.assertEqual(response.status_code, 404)
+
+
 class TestCSVDetailEndpoint(APITestCase):
     endpoint = '/csv/{id}'
 
@@ -382,4 +504,342 @@ class TestAnalysisEndpoint(APITestCase):
             )
 
 
+@skipIf(not util.NUMPY_AVAILABLE, 'NumPy is not installed')
+class TestAnalysisSimulations(APITestCase):
+    endpoint = '/csv/{id}/analysis?{query}'
+
+    def setUp(self):
+        super().setUp()
+        with open(CSV_FILES[0], 'rb') as data:
+            self.client.post('/upload', data={'csv': (data, CSV_FILES[0].name)})
+        self.csvfile = CSVFile.query.one()
+
+    def get_columns(self, query):
+        response = self.get_response(id=self.csvfile.id, query=query)
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()['data']['attributes']['columns']
+
+    def test_without_simulations(self):
+        for column in self.get_columns(''):
+            self.assertNotIn('simulation', column)
+
+    def test_simulated_p_values(self):
+        columns = self.get_columns('simulations=2000&seed=3')
+        self.assertEqual(self.csvfile.analyses()[0]['name'], columns[0]['name'])
+        for column in columns:
+            self.assertEqual(
+                {
+                    'simulations': 2000,
+                    'seed': 3,
+                    'pValue': util.simulated_p_value(column['observedDistribution'], 2000, seed=3)
+                },
+                column['simulation']
+            )
+
+    def test_bad_parameters(self):
+        for query in ['simulations=x', 'simulations=0', 'simulations=10&seed=y', 'simulations=100001']:
+            response = self.get_response(id=self.csvfile.id, query=query)
+            self.assertEqual(response.status_code, 400, query)
+
+    def test_configured_limit(self):
+        with mock.patch.dict(self.app.config, MAX_SIMULATIONS=500):
+            self.assertEqual(400, self.get_response(id=self.csvfile.id, query='simulations=501').status_code)
+            self.assertEqual(500, self.get_columns('simulations=500')[0]['simulation']['simulations'])
+
+
+class TestAnalysisStreamEndpoint(APITestCase):
+    endpoint = '/csv/{id}/analysis/stream'
+
+    def setUp(self):
+        super().setUp()
+        with open(CSV_FILES[0], 'rb') as data:
+            self.client.post('/upload', data={'csv': (data, CSV_FILES[0].name)})
+        self.csvfile = CSVFile.query.one()
+
+    def get_events(self, **headers):
+        response = self.client.get(self.endpoint.format(id=self.csvfile.id), headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual('application/x-ndjson', response.mimetype)
+        return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+    def test_columns_match_analysis(self):
+        events = self.get_events()
+        columns = [event['data'] for event in events if event['event'] == 'column']
+        self.assertEqual(self.csvfile.analyses(), columns)
+        self.assertEqual({'event': 'done', 'data': {'numColumns': len(columns)}}, events[-1])
+
+    def test_progress_precedes_each_column(self):
+        with mock.patch('benford.parsers.PROGRESS_ROWS', 25):
+            events = self.get_events()
+        for column_index in self.csvfile.viable_columns():
+            progress = [event['data'] for event in events
+                        if event['event'] == 'progress' and event['data']['index'] == column_index]
+            position = next(i for i, event in enumerate(events)
+                            if event['event'] == 'column' and event['data']['index'] == column_index)
+            self.assertGreater(len(progress), 1)
+            self.assertEqual('progress', events[position - 1]['event'])
+            self.assertEqual(sorted(progress, key=lambda data: data['rows']), progress)
+            self.assertEqual(progress[-1]['size'], progress[-1]['bytes'])
+
+    def test_cached_columns_skip_progress(self):
+        self.csvfile.analyses()
+        events = self.get_events()
+        self.assertNotIn('progress', [event['event'] for event in events])
+
+    def test_server_sent_events(self):
+        response = self.client.get(
+            self.endpoint.format(id=self.csvfile.id), headers={'Accept': 'text/event-stream'}
+        )
+        self.assertEqual('text/event-stream', response.mimetype)
+        messages = response.get_data(as_text=True).split('\n\n')
+        self.assertEqual('', messages.pop())
+        event, data = messages[-1].split('\n')
+        self.assertEqual('event: done', event)
+        self.assertTrue(data.startswith('data: '))
+
+    def test_bad_format(self):
+        response = self.client.get(self.endpoint.format(id=self.csvfile.id) + '?format=xml')
+        self.assertEqual(response.status_code, 400)
+
+    def test_missing_file(self):
+        response = self.client.get(self.endpoint.format(id=self.csvfile.id + 1))
+        self.assertEqual(response.status_code, 404)
+
+
+class TestTimeSeriesEndpoint(APITestCase):
+    endpoint = '/csv/{id}/analysis/timeseries?{query}'
+
+    def setUp(self):
+        super().setUp()
+        with open(CSV_FILES[0], 'rb') as data:
+            self.client.post('/upload', data={'csv': (data, CSV_FILES[0].name)})
+        self.csvfile = CSVFile.query.one()
+
+    def test_windows(self):
+        response = self.get_response(id=self.csvfile.id, query='dateColumn=10&column=8&window=quarter')
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual(
+            {'dateColumn': 10, 'column': 8, 'window': 'quarter', 'dateFormat': '%m/%d/%Y', 'numSkipped': 0},
+            data['meta']
+        )
+        self.assertEqual(len(self.csvfile.viable_rows()) - 1, sum(window['n'] for window in data['data']))
+        self.assertEqual(sorted(window['start'] for window in data['data']),
+                         [window['start'] for window in data['data']])
+
+    def test_bad_parameters(self):
+        for query in ['column=8', 'dateColumn=10&column=x', 'dateColumn=10&column=8&window=decade',
+                      'dateColumn=10&column=80']:
+            response = self.get_response(id=self.csvfile.id, query=query)
+            self.assertEqual(response.status_code, 400, query)
+
+    def test_column_without_dates(self):
+        response = self.get_response(id=self.csvfile.id, query='dateColumn=1&column=8')
+        self.assertEqual(response.status_code, 422)
+
+    def test_unreadable_file(self):
+        # The file is read again, which can fail partway through
+        rows = mock.Mock(side_effect=csv.Error('line contains NUL'))
+        with mock.patch.object(CSVFile, 'dataset', return_value=None), \
+                mock.patch('benford.parsers.StdlibParser.viable_rows', rows):
+            response = self.get_response(id=self.csvfile.id, query='dateColumn=10&column=8')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual({'message': 'Error: line contains NUL.'}, response.get_json())
+
+
+class TestStreamEndpoints(APITestCase):
+    endpoint = '/streams/{id}/rows'
+
+    def setUp(self):
+        super().setUp()
+        response = self.client.post('/streams', json={
+            'data': {'type': 'stream', 'attributes': {'name': 'feed', 'columns': ['id', 'amount']}}
+        }, headers={'Content-Type': 'application/vnd.api+json'})
+        self.assertEqual(response.status_code, 201)
+        self.id = response.get_json()['data']['id']
+
+    def analysis(self):
+        response = self.client.get(f'/streams/{self.id}/analysis')
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()['data']['attributes']
+
+    def test_create_requires_columns(self):
+        response = self.client.post('/streams', json={
+            'data': {'type': 'stream', 'attributes': {'name': 'other', 'columns': 'amount'}}
+        }, headers={'Content-Type': 'application/vnd.api+json'})
+        self.assertEqual(response.status_code, 422)
+
+    def test_push_json_rows(self):
+        response = self.client.post(self.endpoint.format(id=self.id),
+                                    json={'rows': [[1, '12.50'], [2, 300], [3], [4, None]]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({'numAccepted': 3, 'numDiscarded': 1, 'numRows': 3}, response.get_json()['meta'])
+        amount = self.analysis()['columns'][1]
+        self.assertEqual('amount', amount['name'])
+        self.assertEqual(2, amount['n'])
+        self.assertEqual(util.observed_distribution([1, 3]), amount['observedDistribution'])
+
+    def test_push_csv_body(self):
+        body = io.BytesIO(b''.join(f'{i},{i * 17}\n'.encode() for i in range(1, 101)))
+        response = self.client.post(self.endpoint.format(id=self.id), input_stream=body,
+                                    content_type='text/csv', content_length=len(body.getvalue()))
+        self.assertEqual(response.status_code, 200)
+        data = self.analysis()
+        self.assertEqual(100, data['numRows'])
+        self.assertEqual(
+            util.observed_distribution(util.clean_data(str(i * 17) for i in range(1, 101))),
+            data['columns'][1]['observedDistribution']
+        )
+
+    def test_parse_error_reports_committed_rows(self):
+        body = b''.join(f'{i},{i * 17}\n'.encode() for i in range(1, 6)) + b'6,\xff\n'
+        with mock.patch('benford.models.STREAM_FLUSH_ROWS', 2):
+            response = self.client.post(self.endpoint.format(id=self.id), data=body, content_type='text/csv')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual({'numAccepted': 4, 'numDiscarded': 0, 'numRows': 4}, response.get_json()['meta'])
+        self.assertEqual(4, self.analysis()['numRows'])
+
+    def test_running_totals(self):
+        for rows in [[[1, 100]], [[2, 200], [3, 300]]]:
+            self.client.post(self.endpoint.format(id=self.id), json={'rows': rows})
+        self.assertEqual(3, self.analysis()['numRows'])
+        self.assertEqual(3, self.analysis()['columns'][1]['n'])
+
+    def test_bad_payloads(self):
+        self.assertEqual(400, self.client.post(self.endpoint.format(id=self.id), json={'row': []}).status_code)
+        self.assertEqual(400, self.client.post(self.endpoint.format(id=self.id), data=b'\xff,1\n',
+                                               content_type='text/csv').status_code)
+
+    def test_missing_stream(self):
+        self.assertEqual(404, self.client.post(self.endpoint.format(id=999), json={'rows': []}).status_code)
+
+    def test_delete(self):
+        self.assertEqual(200, self.client.delete(f'/streams/{self.id}').status_code)
+        self.assertEqual([], Stream.query.all())
+
+    def test_methods_of_the_resource(self):
+        # Routes allow only the methods their resource classes define
+        for method, url in [('patch', f'/streams/{self.id}'), ('delete', f'/streams/{self.id}/analysis'),
+                            ('post', f'/csv/{self.id}/columns')]:
+            self.assertEqual(405, getattr(self.client, method)(url, json={}).status_code, url)
+        response = self.client.options(f'/streams/{self.id}')
+        self.assertEqual({'DELETE', 'GET', 'HEAD', 'OPTIONS'}, set(response.allow))
+
+
+class TestMergeEndpoint(APITestCase):
+    endpoint = '/analysis/merge'
+
+    def setUp(self):
+        super().setUp()
+        path = CSV_FILES[0]
+        self.partials = [partials.compute_partial(path, start, end)
+                         for start, end in partials.split_ranges(path.stat().st_size, 4)]
+        with open(path, 'rb') as data:
+            self.client.post('/upload', data={'csv': (data, path.name)})
+
+    def test_merge(self):
+        response = self.client.post(self.endpoint, json={'partials': self.partials})
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual(CSVFile.query.one().analyses(), data['data']['columns'])
+        self.assertEqual([[0, CSV_FILES[0].stat().st_size]], data['meta']['ranges'])
+
+    def test_merge_of_merged_partials(self):
+        halves = [
+            self.client.post(self.endpoint, json={'partials': part}).get_json()['data']['partial']
+            for part in [self.partials[:2], self.partials[2:]]
+        ]
+        response = self.client.post(self.endpoint, json={'partials': halves})
+        self.assertEqual(CSVFile.query.one().analyses(), response.get_json()['data']['columns'])
+
+    def test_bad_payloads(self):
+        self.assertEqual(400, self.client.post(self.endpoint, json={'partial': []}).status_code)
+        response = self.client.post(self.endpoint, json={'partials': self.partials + self.partials[:1]})
+        self.assertEqual(422, response.status_code)
+
+    def test_partials_without_start_of_file(self):
+        response = self.client.post(self.endpoint, json={'partials': self.partials[1:]})
+        self.assertEqual(200, response.status_code)
+        self.assertIsNone(response.get_json()['data']['columns'])
+
+    def test_partials_with_gaps(self):
+        response = self.client.post(self.endpoint, json={'partials': self.partials[:2] + self.partials[3:]})
+        self.assertEqual(200, response.status_code)
+        self.assertIsNone(response.get_json()['data']['columns'])
+        self.assertEqual(2, len(response.get_json()['meta']['ranges']))
+
+    def test_malformed_partials(self):
+        first, second = self.partials[:2]
+        for bad in [dict(second, ranges=[[1, 2, 3]]), dict(second, ranges=[['a', 'b']]),
+                    dict(second, ranges=[[0, second['size'] + 1]]), dict(second, size=second['size'] + 1),
+                    dict(second, columns=[dict(column, firstDigits=column['firstDigits'][:8])
+                                          for column in second['columns']])]:
+            response = self.client.post(self.endpoint, json={'partials': [first, bad]})
+            self.assertEqual(422, response.status_code, bad)
+
+
+class TestFastRendering(APITestCase):
+    endpoint = '/csv/{id}/{view}'
+
+    def setUp(self):
+        super().setUp()
+        for path in CSV_FILES:
+            with open(path, 'rb') as data:
+                self.client.post('/upload', data={'csv': (data, path.name)})
+        self.csvfiles = CSVFile.query.all()
+
+    def resource_response(self, **kwargs):
+        # Any query parameter sends the request through flask_rest_jsonapi instead
+        return self.client.get(self.endpoint.format(**kwargs) + '?page[size]=30')
+
+    def test_matches_resource(self):
+        for id in [csvfile.id for csvfile in self.csvfiles]:
+            for view in ['preview', 'analysis']:
+                fast = self.get_response(id=id, view=view)
+                self.assertEqual('application/vnd.api+json', fast.content_type)
+                self.assertEqual(self.resource_response(id=id, view=view).get_json(),
+                                 json.loads(fast.get_data()))
+
+    def test_stores_rendered_results(self):
+        csvfile = self.csvfiles[0]
+        self.get_response(id=csvfile.id, view='analysis')
+        cached = ColumnAnalysis.query.filter_by(sha256=csvfile.sha256).all()
+        self.assertEqual(sorted(csvfile.viable_columns()), sorted(row.column_index for row in cached))
+        for row in cached:
+            self.assertEqual(row.result, json.loads(row.rendered))
+
+    def test_repeat_requests_skip_serialization(self):
+        csvfile = self.csvfiles[0]
+        first = self.get_response(id=csvfile.id, view='analysis').get_data()
+        with mock.patch.object(rendering, 'render_column', side_effect=AssertionError), \
+                mock.patch.object(CSVFile, 'scan_column', side_effect=AssertionError):
+            self.assertEqual(first, self.get_response(id=csvfile.id, view='analysis').get_data())
+
+    def test_renders_results_cached_without_json(self):
+        csvfile = self.csvfiles[0]
+        expected = csvfile.analyses()
+        ColumnAnalysis.query.update({'rendered': None})
+        db.session.commit()
+        data = json.loads(self.get_response(id=csvfile.id, view='analysis').get_data())
+        self.assertEqual(expected, data['data']['attributes']['columns'])
+        self.assertNotIn(None, [row.rendered for row in ColumnAnalysis.query.all()])
+
+    def test_query_parameters_use_resource(self):
+        csvfile = self.csvfiles[0]
+        response = self.client.get(self.endpoint.format(id=csvfile.id, view='analysis') + '?simulations=10')
+        self.assertIn('simulation', response.get_json()['data']['attributes']['columns'][0])
+
+    def test_render_document(self):
+        document = rendering.render_document('analysis', 3, '/self', {}, {}, {'columns': b'[{"n":1}]'})
+        self.assertEqual(
+            {'data': {'type': 'analysis', 'id': '3', 'relationships': {}, 'links': {'self': '/self'},
+                      'attributes': {'columns': [{'n': 1}]}},
+             'links': {'self': '/self'}, 'jsonapi': {'version': '1.0'}},
+            json.loads(document)
+        )
+
+    def test_render_infinite_statistic(self):
+        self.assertEqual(b'{"testStatistic":Infinity}', rendering.render_column({'testStatistic': float('inf')}))
+
+
 del APITestCase
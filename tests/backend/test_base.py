@@ -1,14 +1,16 @@
+import shutil
 from pathlib import Path
 from unittest import TestCase
 
 import benford
 from benford.app import create_app
-from benford.database import db
+from benford.models import db
 from benford.models import CSVFile
 
 TEST_DIR = Path().absolute() / 'tests'
 FIXTURES_PATH = TEST_DIR / 'cypress/cypress/fixtures'
 DB_PATH = TEST_DIR / 'test.db'
+BLOB_STORE_PATH = TEST_DIR / 'blobs'
 CSV_FILES = [
     FIXTURES_PATH / 'test_csv_1.csv',
     FIXTURES_PATH / 'test_csv_2.csv',
@@ -17,9 +19,15 @@ CSV_FILES = [
 DATETIME_FSTRING = '%Y-%m-%dT%H:%M:%S'
 
 
-def clear():
-    CSVFile.query.delete()
+def clear_tables():
+    for table in reversed(db.Model.metadata.sorted_tables):
+        db.session.execute(table.delete())
     db.session.commit()
+    db.session.expunge_all()
+
+
+def clear():
+    clear_tables()
     return 'OK', 200
 
 
@@ -36,8 +44,7 @@ class AppTestCase(TestCase):
         cls.app.config['SERVER_NAME'] = 'localhost'
 
     def tearDown(self):
-        CSVFile.query.delete()
-        db.session.commit()
+        clear_tables()
 
     @classmethod
     def tearDownClass(cls):
@@ -47,6 +54,7 @@ class AppTestCase(TestCase):
             Path(str(DB_PATH) + '-journal').unlink()
         except FileNotFoundError:
             pass
+        shutil.rmtree(BLOB_STORE_PATH, ignore_errors=True)
 
 
 class DatabaseTestCase(AppTestCase):
@@ -0,0 +1,113 @@
+import threading
+import time
+from unittest import TestCase, mock
+
+from benford.cache import DatasetCache, datasets
+from benford.models import db
+from benford.models import ColumnAnalysis, CSVFile
+from backend.test_base import CSV_FILES, DatabaseTestCase
+
+
+class TestDatasetCache(TestCase):
+    def loader(self, value, size, calls=None):
+        def load(budget):
+            if calls is not None:
+                calls.append(budget)
+            return value, size
+        return load
+
+    def test_least_recently_used_are_evicted(self):
+        cache = DatasetCache(budget=30)
+        for key in 'abc':
+            cache.get(key, self.loader(key.upper(), 10))
+        self.assertEqual('A', cache.get('a', self.loader(None, 10)))
+        cache.get('d', self.loader('D', 10))
+        self.assertEqual(['c', 'a', 'd'], list(cache.entries))
+        self.assertEqual({'hits': 1, 'misses': 4, 'evictions': 1, 'entries': 3, 'bytes': 30, 'budget': 30},
+                         cache.stats())
+
+    def test_values_over_budget_are_not_kept(self):
+        cache, calls = DatasetCache(budget=10), []
+        self.assertEqual('big', cache.get('big', self.loader('big', 11, calls)))
+        self.assertEqual('big', cache.get('big', self.loader('big', 11, calls)))
+        self.assertEqual([10, 10], calls)
+        self.assertEqual(0, cache.stats()['entries'])
+
+        # Loaders that won't fit a value in the budget return None
+        self.assertIsNone(cache.get('none', lambda budget: None))
+        self.assertEqual(0, cache.stats()['bytes'])
+
+    def test_discard_and_clear(self):
+        cache = DatasetCache(budget=100)
+        cache.get('a', self.loader('A', 10))
+        cache.get('b', self.loader('B', 20))
+        cache.discard('a')
+        cache.discard('missing')
+        self.assertEqual((1, 20), (cache.stats()['entries'], cache.stats()['bytes']))
+        cache.clear()
+        self.assertEqual({'hits': 0, 'misses': 0, 'evictions': 0, 'entries': 0, 'bytes': 0, 'budget': 100},
+                         cache.stats())
+
+    def test_concurrent_requests_load_once(self):
+        cache, calls = DatasetCache(budget=100), []
+
+        def load(budget):
+            calls.append(budget)
+            time.sleep(0.05)
+            return 'value', 10
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get('key', load))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(['value'] * 8, results)
+        self.assertEqual(1, len(calls))
+        self.assertEqual(10, cache.stats()['bytes'])
+
+
+class TestCachedDatasets(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        datasets.clear()
+        with open(CSV_FILES[0], 'rb') as f:
+            csvfile = CSVFile(f, CSV_FILES[0].name)
+        db.session.add(csvfile)
+        db.session.commit()
+        self.csv_file_id = csvfile.id
+
+    def csvfile(self):
+        return db.session.get(CSVFile, self.csv_file_id)
+
+    def test_preview_then_analysis_parses_once(self):
+        with mock.patch.object(datasets, 'budget', 0):
+            expected_preview, expected_analyses = self.csvfile().preview(), self.csvfile().analyses()
+        ColumnAnalysis.query.delete()
+        db.session.commit()
+        datasets.clear()
+
+        csvfile = self.csvfile()
+        self.assertEqual(expected_preview, csvfile.preview())
+        with mock.patch.object(CSVFile, 'parser', side_effect=AssertionError('Parsed again')):
+            self.assertEqual(expected_analyses, csvfile.analyses())
+            self.assertEqual(expected_preview, csvfile.preview())
+        # Every column's analysis and the second preview hit the dataset the first preview loaded
+        self.assertEqual({'hits': len(expected_analyses) + 1, 'misses': 1, 'entries': 1},
+                         {key: datasets.stats()[key] for key in ('hits', 'misses', 'entries')})
+
+    def test_metrics(self):
+        client = self.app.test_client()
+        client.get(f'/csv/{self.csv_file_id}/preview')
+        client.get(f'/csv/{self.csv_file_id}/preview')
+        data = client.get('/metrics/cache').get_json()['data']
+        self.assertEqual(1, data['entries'])
+        self.assertEqual(1, data['hits'])
+        self.assertLessEqual(data['bytes'], data['budget'])
+
+    def test_deleted_files_are_evicted(self):
+        self.csvfile().preview()
+        self.assertEqual(1, datasets.stats()['entries'])
+        db.session.delete(self.csvfile())
+        db.session.commit()
+        self.assertEqual(0, datasets.stats()['entries'])
@@ -2,13 +2,15 @@ import csv
 import io
 import itertools
 from time import sleep
+from unittest import mock, skipIf
 
 import chardet
+import sqlalchemy
 from sqlalchemy.exc import IntegrityError
 
-from benford import analysis
-from benford.database import db
-from benford.models import CSVFile
+from benford import models, parsers, util
+from benford.models import db
+from benford.models import Blob, ColumnAnalysis, ColumnSummary, CSVFile, Stream, StreamColumn
 from backend.test_base import CSV_FILES, DatabaseTestCase
 
 
@@ -16,7 +18,7 @@ class TestDatabase(DatabaseTestCase):
     def test_sqlalchemy_registers_csvfile_model(self):
         """The create_app function creates a SQLAlchemy instance with the registered model"""
         models = [mapper.class_ for mapper in db.Model.registry.mappers]
-        self.assertEqual([CSVFile], models)
+        self.assertEqual({Blob, ColumnAnalysis, ColumnSummary, CSVFile, Stream, StreamColumn}, set(models))
 
     def test_create_and_retrieve_row(self):
         """A new row can be added to the table and queried/retrieved"""
@@ -208,7 +210,7 @@ class TestCSVFile(DatabaseTestCase):
     def test_n(self):
         for i, csvfile in enumerate(CSVFile.query.all()):
             for j, col in enumerate(csvfile.viable_columns()):
-                data = analysis.clean_data([row[col] for row in csvfile.viable_rows()])
+                data = util.clean_data([row[col] for row in csvfile.viable_rows()])
                 self.assertEqual(
                     len(data),
                     csvfile.analysis(col)['n']
@@ -217,8 +219,8 @@ class TestCSVFile(DatabaseTestCase):
     def test_expected_distribution(self):
         for i, csvfile in enumerate(CSVFile.query.all()):
             for j, col in enumerate(csvfile.viable_columns()):
-                data = analysis.clean_data([row[col] for row in csvfile.viable_rows()])
-                expected_distribution = analysis.expected_distribution(len(data))
+                data = util.clean_data([row[col] for row in csvfile.viable_rows()])
+                expected_distribution = util.expected_distribution(len(data))
 
                 self.assertEqual(
                     expected_distribution,
@@ -228,8 +230,8 @@ class TestCSVFile(DatabaseTestCase):
     def test_observed_distribution(self):
         for i, csvfile in enumerate(CSVFile.query.all()):
             for j, col in enumerate(csvfile.viable_columns()):
-                data = analysis.clean_data([row[col] for row in csvfile.viable_rows()])
-                observed_distribution = analysis.observed_distribution(data)
+                data = util.clean_data([row[col] for row in csvfile.viable_rows()])
+                observed_distribution = util.observed_distribution(data)
 
                 self.assertEqual(
                     observed_distribution,
@@ -239,10 +241,10 @@ class TestCSVFile(DatabaseTestCase):
     def test_sum_chi_square(self):
         for i, csvfile in enumerate(CSVFile.query.all()):
             for j, col in enumerate(csvfile.viable_columns()):
-                data = analysis.clean_data([row[col] for row in csvfile.viable_rows()])
-                expected_distribution = analysis.expected_distribution(len(data))
-                observed_distribution = analysis.observed_distribution(data)
-                test_statistic = analysis.sum_chi_squares(expected_distribution, observed_distribution)
+                data = util.clean_data([row[col] for row in csvfile.viable_rows()])
+                expected_distribution = util.expected_distribution(len(data))
+                observed_distribution = util.observed_distribution(data)
+                test_statistic = util.sum_chi_squares(expected_distribution, observed_distribution)
 
                 self.assertEqual(
                     test_statistic,
@@ -252,12 +254,252 @@ class TestCSVFile(DatabaseTestCase):
     def test_goodness_of_fit(self):
         for i, csvfile in enumerate(CSVFile.query.all()):
             for j, col in enumerate(csvfile.viable_columns()):
-                data = analysis.clean_data([row[col] for row in csvfile.viable_rows()])
-                expected_distribution = analysis.expected_distribution(len(data))
-                observed_distribution = analysis.observed_distribution(data)
-                goodness_of_fit = analysis.goodness_of_fit(expected_distribution, observed_distribution)
+                data = util.clean_data([row[col] for row in csvfile.viable_rows()])
+                expected_distribution = util.expected_distribution(len(data))
+                observed_distribution = util.observed_distribution(data)
+                goodness_of_fit = util.goodness_of_fit(expected_distribution, observed_distribution)
 
                 self.assertEqual(
                     goodness_of_fit,
                     csvfile.analysis(col)['goodnessOfFit']
-                )
\ No newline at end of file
+                )
+
+
+@skipIf(not parsers.ARROW_AVAILABLE, 'pyarrow is not installed')
+class TestParserBackends(DatabaseTestCase):
+    def setUp(self):
+        for path in CSV_FILES:
+            with open(path, 'rb') as f:
+                db.session.add(CSVFile(f, path.name))
+        db.session.commit()
+
+    def arrow_parser(self, csvfile):
+        parser = csvfile.parser()
+        return parsers.ArrowParser(parser.file, parser.encoding, parser.dialect)
+
+    def test_small_files_use_stdlib_parser(self):
+        for csvfile in CSVFile.query.all():
+            self.assertEqual('stdlib', csvfile.parser().name)
+
+    def test_large_files_use_arrow_parser(self):
+        with mock.patch.object(parsers, 'ARROW_MIN_SIZE', 0):
+            for csvfile in CSVFile.query.all():
+                self.assertEqual('arrow', csvfile.parser().name)
+
+    def test_columns_match_stdlib_parser(self):
+        for csvfile in CSVFile.query.all():
+            self.assertEqual(
+                csvfile.parser().columns(),
+                self.arrow_parser(csvfile).columns()
+            )
+
+    def test_column_matches_stdlib_parser(self):
+        for csvfile in CSVFile.query.all():
+            for col in csvfile.viable_columns():
+                self.assertEqual(
+                    csvfile.parser().column(col),
+                    self.arrow_parser(csvfile).column(col)
+                )
+
+    def test_column_chunks_match_stdlib_parser(self):
+        with mock.patch.object(parsers, 'ARROW_BLOCK_SIZE', 256):
+            for csvfile in CSVFile.query.all():
+                for col in csvfile.viable_columns():
+                    chunks = list(self.arrow_parser(csvfile).column_chunks(col))
+                    self.assertEqual(
+                        csvfile.parser().column(col),
+                        [cell for cells, _ in chunks for cell in cells]
+                    )
+                    positions = [bytes_read for _, bytes_read in chunks]
+                    self.assertEqual(sorted(positions), positions)
+
+    def test_rows_match_stdlib_parser(self):
+        for csvfile in CSVFile.query.all():
+            self.assertEqual(
+                list(csvfile.parser().rows()),
+                list(self.arrow_parser(csvfile).rows())
+            )
+
+    def test_analysis_matches_stdlib_parser(self):
+        for csvfile in CSVFile.query.all():
+            expected = [csvfile.analysis(col) for col in csvfile.viable_columns()]
+            with mock.patch.object(parsers, 'ARROW_MIN_SIZE', 0):
+                self.assertEqual(
+                    expected,
+                    [csvfile.analysis(col) for col in csvfile.viable_columns()]
+                )
+
+    def test_spaces_after_delimiters(self):
+        # Arrow would keep the spaces, naming the column " amount" and rejecting every quoted row
+        rows = [f'{i}, "{i * 37 % 9000 + 1:,}.{i % 100:02}"\n' for i in range(1, 80001)]
+        data = ('id, amount\n' + ''.join(rows)).encode()
+        self.assertGreater(len(data), parsers.ARROW_MIN_SIZE)
+        csvfile = CSVFile(io.BytesIO(data), 'spaced.csv')
+        db.session.add(csvfile)
+        db.session.commit()
+        parser = csvfile.parser()
+        self.assertTrue(parser.dialect.skipinitialspace)
+        self.assertEqual('stdlib', parser.name)
+        self.assertEqual(['id', 'amount'], next(parser.rows()))
+        result = csvfile.analysis(1)
+        self.assertEqual('amount', result['name'])
+        self.assertEqual(80000, result['n'])
+
+
+class TestColumnTypeInference(DatabaseTestCase):
+    def setUp(self):
+        for path in CSV_FILES:
+            with open(path, 'rb') as f:
+                db.session.add(CSVFile(f, path.name))
+        db.session.commit()
+
+    def test_column_types_are_stored(self):
+        """Column types are inferred at upload and persisted on the record"""
+        csvfile = CSVFile.query.all()[1]
+        self.assertEqual(10, len(csvfile.blob.column_types))
+        with mock.patch.object(CSVFile, 'parser') as parser:
+            self.assertEqual([0, 3, 4, 5, 6, 9], csvfile.viable_columns())
+            parser.assert_not_called()
+
+    def test_full_scans_retype_columns(self):
+        """A full scan rejects a column that sampling let through and accepts one it missed"""
+        csvfile = CSVFile.query.all()[1]
+        column_types = list(csvfile.blob.column_types)
+        column_types[0], column_types[1] = util.OTHER, util.NUMERIC
+        csvfile.blob.column_types = column_types
+        db.session.commit()
+        self.assertEqual([1, 3, 4, 5, 6, 9], csvfile.viable_columns())
+
+        response = self.app.test_client().get(f'/csv/{csvfile.id}/analysis')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([3, 4, 5, 6, 9], csvfile.viable_columns())
+        # Reads leave the stored types alone
+        db.session.expire_all()
+        self.assertEqual(column_types, CSVFile.query.all()[1].blob.column_types)
+
+        csvfile = CSVFile.query.all()[1]
+        csvfile.analysis(0)
+        self.assertEqual([0, 3, 4, 5, 6, 9], csvfile.viable_columns())
+
+    def test_sample_matches_full_scan(self):
+        for csvfile in CSVFile.query.all():
+            expected = util.infer_column_types(csvfile.parser().viable_rows())
+            with mock.patch.object(parsers, 'SAMPLE_MIN_SIZE', 0), \
+                    mock.patch.object(parsers, 'SAMPLE_ROWS', 5):
+                self.assertEqual(expected, util.infer_column_types(csvfile.parser().sample()))
+
+    def test_sample_is_stratified(self):
+        """The sample draws rows from across the whole file rather than just its head"""
+        csvfile = CSVFile.query.all()[1]
+        with mock.patch.object(parsers, 'SAMPLE_MIN_SIZE', 0), \
+                mock.patch.object(parsers, 'SAMPLE_ROWS', 2):
+            sample = list(csvfile.parser().sample())
+        all_rows = csvfile.viable_rows()
+        self.assertLess(len(sample), len(all_rows))
+        self.assertGreater(all_rows.index(sample[-1]), len(all_rows) * 0.8)
+
+    def test_inference_exits_once_every_column_is_disqualified(self):
+        def rows():
+            yield ['a', 'b']
+            yield ['x', 'y']
+            self.fail('Rows were read after every column was disqualified')
+
+        self.assertEqual([util.OTHER, util.OTHER], util.infer_column_types(rows()))
+
+    def test_full_scan_rejects_column_missed_by_sample(self):
+        csvfile = CSVFile.query.all()[1]
+        csvfile.blob.column_types = [util.NUMERIC] * len(csvfile.infer_column_types())
+        db.session.commit()
+
+        columns = [column['index'] for column in csvfile.analyses()]
+        self.assertEqual([0, 3, 4, 5, 6, 9], columns)
+        self.assertEqual(columns, csvfile.viable_columns())
+
+
+class TestRowIndex(DatabaseTestCase):
+    def setUp(self):
+        for path in CSV_FILES:
+            with open(path, 'rb') as f:
+                db.session.add(CSVFile(f, path.name))
+        # Records spanning several lines must not throw the offsets off
+        quoted = io.BytesIO(b'id,note,amount\n' + b''.join(
+            f'{i},"line one\nline two, {i}",{i * 37}\n'.encode() for i in range(1, 60)
+        ))
+        db.session.add(CSVFile(quoted, 'quoted.csv'))
+        db.session.commit()
+
+    def test_dump_matches_sequential_reader(self):
+        with mock.patch.object(parsers, 'ROW_INDEX_INTERVAL', 7):
+            for csvfile in CSVFile.query.all():
+                all_rows = list(csvfile.reader())
+                for start, end in [(0, 5), (6, 8), (7, 14), (20, None), (55, 70), (99, 103), (500, 510)]:
+                    self.assertEqual(all_rows[start:end], list(csvfile.dump(start, end)), (csvfile.filename, start))
+
+    def test_dump_seeks_to_checkpoint(self):
+        with mock.patch.object(parsers, 'ROW_INDEX_INTERVAL', 10):
+            csvfile = CSVFile.query.filter_by(filename='quoted.csv').one()
+            row_index = csvfile.index_rows()
+            self.assertEqual(6, len(row_index.offsets))
+            with mock.patch.object(parsers.StdlibParser, 'rows', autospec=True,
+                                   side_effect=parsers.StdlibParser.rows) as rows:
+                self.assertEqual([['43', 'line one\nline two, 43', str(43 * 37)]], list(csvfile.dump(43, 44)))
+                rows.assert_called_once_with(mock.ANY, row_index.offsets[4])
+
+    def test_index_is_stored(self):
+        for csvfile in CSVFile.query.all():
+            csvfile.index_rows()
+        db.session.expire_all()
+        for csvfile in CSVFile.query.all():
+            self.assertIsNotNone(csvfile.blob.row_index)
+            self.assertEqual(len(list(csvfile.reader())), len(csvfile))
+
+
+class TestStreams(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        with open(CSV_FILES[0]) as f:
+            rows = list(csv.reader(f))
+        self.header, self.rows = rows[0], rows[1:]
+        db.session.add(Stream(name='feed', columns=self.header))
+        db.session.commit()
+        self.stream = Stream.query.one()
+
+    def test_counters_match_file_analysis(self):
+        with mock.patch.object(models, 'STREAM_FLUSH_ROWS', 7):
+            # Pushed in several requests, each flushed in several chunks
+            for start in range(0, len(self.rows), 40):
+                self.stream.push(iter(self.rows[start:start + 40]))
+        db.session.expire_all()
+
+        viable_rows = [row for row in self.rows if len(row) == len(self.header)]
+        self.assertEqual(len(viable_rows), Stream.query.one().num_rows)
+        for column in Stream.query.one().analyses():
+            cells = [row[column['index']] for row in viable_rows]
+            digits, num_other = util.scan_data(cells)
+            self.assertEqual(self.header[column['index']], column['name'])
+            self.assertEqual(util.observed_distribution(digits), column['observedDistribution'])
+            self.assertEqual(num_other, column['numOther'])
+            self.assertEqual(len(cells), column['numCells'])
+
+    def test_push_reports_discarded_rows(self):
+        rows = [['1'] * len(self.header), ['1'], ['2'] * len(self.header)]
+        self.assertEqual((2, 1), self.stream.push(rows))
+
+    def test_push_commits_each_chunk(self):
+        def rows():
+            yield ['1'] * len(self.header)
+            yield ['2'] * len(self.header)
+            # Earlier chunks are visible to other sessions while the push is still going
+            with db.engine.connect() as connection:
+                num_rows = connection.execute(sqlalchemy.select(Stream.num_rows)).scalar()
+            self.assertEqual(2, num_rows)
+            yield ['3'] * len(self.header)
+
+        with mock.patch.object(models, 'STREAM_FLUSH_ROWS', 2):
+            self.assertEqual((3, 0), self.stream.push(rows()))
+        self.assertEqual(3, self.stream.num_rows)
+
+    def test_delete_removes_counters(self):
+        db.session.delete(self.stream)
+        db.session.commit()
+        self.assertEqual([], StreamColumn.query.all())
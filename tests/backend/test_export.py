@@ -0,0 +1,101 @@
+import csv
+import io
+from pathlib import Path
+import tempfile
+from unittest import mock, skipIf
+
+from benford import export, formats
+from benford.commands import export_command
+from benford.models import db
+from benford.models import CSVFile
+from backend.test_base import CSV_FILES, DatabaseTestCase
+
+
+class TestExport(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        for path in CSV_FILES:
+            with open(path, 'rb') as f:
+                db.session.add(CSVFile(f, path.name))
+        db.session.commit()
+
+    def expected_records(self, ids=None):
+        query = CSVFile.query.order_by(CSVFile.id)
+        return [
+            [str(csvfile.id), csvfile.filename, str(result['index']), result['name'], str(result['n']),
+             str(result['testStatistic']), *(str(result['goodnessOfFit'][p]) for p in export.P_VALUES), '']
+            for csvfile in (query.filter(CSVFile.id.in_(ids)) if ids else query)
+            for result in csvfile.analyses()
+        ]
+
+    def read_csv(self, data):
+        records = list(csv.reader(io.StringIO(data.decode())))
+        self.assertEqual(export.REPORT_FIELDS, records[0])
+        return records[1:]
+
+    def test_csv_report(self):
+        response = self.app.test_client().get('/analysis/export')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('text/csv', response.mimetype)
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(self.expected_records(), self.read_csv(response.data))
+
+    def test_filters(self):
+        client = self.app.test_client()
+        first, second, third = [csvfile.id for csvfile in CSVFile.query.order_by(CSVFile.id)]
+        data = client.get(f'/analysis/export?ids={first},{third}').data
+        self.assertEqual(self.expected_records([first, third]), self.read_csv(data))
+        data = client.get('/analysis/export?filename=*_2.csv').data
+        self.assertEqual(self.expected_records([second]), self.read_csv(data))
+        self.assertEqual(400, client.get('/analysis/export?ids=one').status_code)
+        ids = ','.join(map(str, range(1, 2002)))
+        self.assertEqual(400, client.get(f'/analysis/export?ids={ids}').status_code)
+        self.assertEqual(400, client.get('/analysis/export?format=xml').status_code)
+
+    def test_batches_match_one_pass(self):
+        query = export.export_query()
+        records = [record for batch in export.report_batches(query, batch_size=1) for record in batch]
+        self.assertEqual(3, len(list(export.report_batches(query, batch_size=1))))
+        self.assertEqual(records, next(export.report_batches(query, batch_size=10)))
+
+    def test_missing_analyses_are_computed_in_workers(self):
+        for csvfile in CSVFile.query:
+            csvfile.infer_column_types()
+        with mock.patch.object(CSVFile, 'parser', side_effect=AssertionError('Analyzed in this process')):
+            records = [record for batch in export.report_batches(export.export_query(), workers=2)
+                       for record in batch]
+        self.assertEqual(len(self.expected_records()), len(records))
+        self.assertEqual([str(record[4]) for record in records], [record[4] for record in self.expected_records()])
+
+    def test_unreadable_files_are_reported(self):
+        unreadable = CSVFile.query.order_by(CSVFile.id).first()
+        unreadable_id, filename, num_columns = unreadable.id, unreadable.filename, len(unreadable.analyses())
+        analyses = CSVFile.analyses
+
+        def analyze(csvfile):
+            if csvfile.id == unreadable_id:
+                raise csv.Error('unreadable')
+            return analyses(csvfile)
+
+        with mock.patch.object(CSVFile, 'analyses', autospec=True, side_effect=analyze):
+            records = self.read_csv(self.app.test_client().get('/analysis/export').data)
+        self.assertEqual([str(unreadable_id), filename], records[0][:2])
+        self.assertTrue(records[0][-1])
+        self.assertEqual(self.expected_records()[num_columns:], records[1:])
+
+    @skipIf(not formats.PARQUET_AVAILABLE, 'pyarrow is not installed')
+    def test_parquet_report(self):
+        import pyarrow.parquet
+        response = self.app.test_client().get('/analysis/export?format=parquet')
+        self.assertEqual(200, response.status_code)
+        table = pyarrow.parquet.read_table(io.BytesIO(response.data))
+        self.assertEqual(export.REPORT_FIELDS, table.schema.names)
+        records = [['' if value is None else str(value) for value in row.values()] for row in table.to_pylist()]
+        self.assertEqual(self.expected_records(), records)
+
+    def test_cli(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'report.csv'
+            result = self.app.test_cli_runner().invoke(export_command, ['--output', str(path), '--workers', '1'])
+            self.assertEqual(0, result.exit_code, result.output)
+            self.assertEqual(self.expected_records(), self.read_csv(path.read_bytes()))
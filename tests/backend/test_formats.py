@@ -0,0 +1,140 @@
+import csv
+import io
+import json
+import random
+from pathlib import Path
+import tempfile
+from unittest import mock, skipIf
+
+from benford import formats, partials
+from benford.models import db
+from benford.models import CSVFile
+from benford.storage import detect_compression
+from backend.test_base import DatabaseTestCase
+
+HEADER = ['id', 'amount', 'quantity', 'note']
+NUM_ROWS = 2500
+
+
+def synthetic_rows():
+    # Typed values whose text is the same in every format, with some blanks and words mixed in.
+    # Amounts are never whole, since spreadsheets read whole floats back as integers.
+    rng = random.Random(0)
+    return [
+        [i, (int(rng.lognormvariate(5, 2) * 100) * 10 + 5) / 1000, rng.randint(1, 10 ** 4) if i % 97 else None,
+         'n/a' if i % 11 == 0 else f'note {i}']
+        for i in range(NUM_ROWS)
+    ]
+
+
+def as_csv(rows):
+    text = io.StringIO()
+    writer = csv.writer(text, lineterminator='\n')
+    writer.writerow(HEADER)
+    writer.writerows([['' if value is None else value for value in row] for row in rows])
+    return text.getvalue().encode()
+
+
+def as_parquet(rows):
+    import pyarrow
+    import pyarrow.parquet
+    data = io.BytesIO()
+    table = pyarrow.table({name: list(column) for name, column in zip(HEADER, zip(*rows))})
+    pyarrow.parquet.write_table(table, data, row_group_size=700)
+    return data.getvalue()
+
+
+def as_xlsx(rows):
+    import openpyxl
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(HEADER)
+    for row in rows:
+        sheet.append(row)
+    data = io.BytesIO()
+    workbook.save(data)
+    return data.getvalue()
+
+
+def as_jsonl(rows):
+    return ''.join(json.dumps(dict(zip(HEADER, row))) + '\n' for row in rows).encode()
+
+
+class TestFormats(DatabaseTestCase):
+    def add(self, data, filename):
+        csvfile = CSVFile(io.BytesIO(data), filename)
+        db.session.add(csvfile)
+        db.session.commit()
+        return csvfile
+
+    def assert_matches_csv(self, data, filename, parser_name):
+        rows = synthetic_rows()
+        expected = self.add(as_csv(rows), 'expected.csv')
+        csvfile = self.add(data, filename)
+        self.assertEqual(parser_name, csvfile.parser().name)
+        self.assertEqual(len(expected), len(csvfile))
+        self.assertEqual(list(expected.dump()), list(csvfile.dump()))
+        # Past the first row index checkpoint
+        self.assertEqual(list(expected.dump(1998, 2003)), list(csvfile.dump(1998, 2003)))
+        self.assertEqual(expected.preview(), csvfile.preview())
+        self.assertEqual(expected.analyses(), csvfile.analyses())
+
+    @skipIf(not formats.PARQUET_AVAILABLE, 'pyarrow is not installed')
+    def test_parquet_matches_csv(self):
+        self.assert_matches_csv(as_parquet(synthetic_rows()), 'data.parquet', 'parquet')
+
+    @skipIf(not formats.XLSX_AVAILABLE, 'openpyxl is not installed')
+    def test_xlsx_matches_csv(self):
+        self.assert_matches_csv(as_xlsx(synthetic_rows()), 'data.xlsx', 'xlsx')
+
+    def test_jsonl_matches_csv(self):
+        self.assert_matches_csv(as_jsonl(synthetic_rows()), 'data.jsonl', 'jsonl')
+
+    @skipIf(not formats.PARQUET_AVAILABLE, 'pyarrow is not installed')
+    def test_parquet_analysis_reads_only_its_column(self):
+        import pyarrow.parquet
+        csvfile = self.add(as_parquet(synthetic_rows()), 'data.parquet')
+        csvfile.infer_column_types()
+        iter_batches = pyarrow.parquet.ParquetFile.iter_batches
+        with mock.patch.object(pyarrow.parquet.ParquetFile, 'iter_batches', autospec=True,
+                               side_effect=iter_batches) as spy:
+            csvfile.analysis(1)
+        self.assertEqual([['amount']], [call.kwargs['columns'] for call in spy.call_args_list])
+
+    def test_jsonl_skips_lines_that_are_not_objects(self):
+        csvfile = self.add(b'{"a": 1, "b": "x"}\n[1, 2]\nnot json\n\n{"b": true, "c": 3}\n', 'data.jsonl')
+        self.assertEqual([['a', 'b'], ['1', 'x'], [], [], [], ['', 'true']], list(csvfile.dump()))
+        self.assertEqual(3, csvfile.preview()['numDiscarded'])
+
+    @skipIf(not formats.XLSX_AVAILABLE, 'openpyxl is not installed')
+    def test_workbooks_are_not_decompressed(self):
+        self.assertIsNone(detect_compression(io.BytesIO(as_xlsx(synthetic_rows()[:5]))))
+
+    @skipIf(not formats.XLSX_AVAILABLE, 'openpyxl is not installed')
+    def test_upload_workbook(self):
+        client = self.app.test_client()
+        response = client.post('/upload', data={'csv': (io.BytesIO(as_xlsx(synthetic_rows())), 'data.xlsx')})
+        self.assertEqual(201, response.status_code)
+        self.assertEqual(NUM_ROWS + 1, len(CSVFile.query.one()))
+
+    def test_upload_unreadable_files(self):
+        client = self.app.test_client()
+        response = client.post('/upload', data={'csv': (io.BytesIO(b'PAR1 not really parquet'), 'broken.parquet')})
+        self.assertEqual(422, response.status_code)
+        self.assertEqual(0, CSVFile.query.count())
+
+    def test_detect_format_from_content(self):
+        self.assertEqual('jsonl', formats.detect_format(io.BytesIO(b'\xef\xbb\xbf {"a": 1}\n{"a": 2}\n')))
+        for data in [b'{a},b\n1,2\n', b'{"a": [1, \n', b'{"a": 1} trailing\n', b'PK\x03\x04 not a workbook']:
+            self.assertEqual('csv', formats.detect_format(io.BytesIO(data)), data)
+
+    def test_csv_starting_with_a_brace(self):
+        csvfile = self.add(b'{id},amount\n1,2.5\n2,31\n', 'braces.csv')
+        self.assertEqual('csv', formats.detect_format(csvfile.open()))
+        self.assertEqual([['{id}', 'amount'], ['1', '2.5'], ['2', '31']], list(csvfile.dump()))
+
+    def test_byte_ranges_are_only_for_csv(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'data.jsonl'
+            path.write_bytes(as_jsonl(synthetic_rows()[:10]))
+            self.assertRaises(partials.PartialError, partials.compute_partial, path, 0, path.stat().st_size)
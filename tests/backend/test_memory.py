@@ -0,0 +1,180 @@
+import json
+import os
+from pathlib import Path
+import random
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+from unittest import TestCase, mock, skipIf, skipUnless
+
+from benford import parsers
+from benford.cache import datasets
+from benford.models import db
+from benford.models import ColumnAnalysis, CSVFile
+from backend.test_base import DatabaseTestCase
+
+PROC_STATUS = Path('/proc/self/status')
+
+# Peak growth of anonymous (heap) memory while a file is analyzed, sampled from another thread.
+# Pages of the memory-mapped file itself are file-backed, so they are left out.
+RSS_SCRIPT = '''
+import json, sys, threading, time
+from benford import parsers
+from benford.app import create_app
+from benford.models import CSVFile, db
+
+def anonymous_memory():
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('RssAnon:'):
+                return int(line.split()[1]) * 1024
+
+app = create_app(sys.argv[1])
+app.config['MEMORY_BUDGET'] = int(sys.argv[3])
+parsers.init_app(app)
+with open(sys.argv[2], 'rb') as f:
+    csvfile = CSVFile(f, 'large.csv')
+db.session.add(csvfile)
+db.session.commit()
+# Import whatever the analysis needs before the baseline is taken
+csvfile.parser()
+csvfile.infer_column_types()
+
+peak, done = [0], threading.Event()
+def sample():
+    while not done.is_set():
+        peak[0] = max(peak[0], anonymous_memory())
+        time.sleep(0.001)
+baseline = anonymous_memory()
+sampler = threading.Thread(target=sample)
+sampler.start()
+columns = csvfile.analyses()
+done.set()
+sampler.join()
+print(json.dumps({'growth': peak[0] - baseline, 'parser': csvfile.parser().name, 'columns': len(columns)}))
+'''
+
+
+def write_large_csv(path, size):
+    # Repeats a block of lognormal amounts until the file reaches about `size` bytes
+    rng = random.Random(0)
+    block = ''.join(f'{rng.lognormvariate(5, 2):.2f},{rng.randint(1, 10 ** 4)},x\n' for _ in range(20000)).encode()
+    with open(path, 'wb') as f:
+        f.write(b'amount,quantity,label\n')
+        for _ in range(max(size // len(block), 1)):
+            f.write(block)
+
+
+class TestMemoryBudget(DatabaseTestCase):
+    BUDGET = 1 << 20
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.path = Path(cls.directory.name) / 'large.csv'
+        write_large_csv(cls.path, 2 * cls.BUDGET)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        # These measure files that are streamed, not the ones kept in the dataset cache
+        budget = mock.patch.object(datasets, 'budget', 0)
+        budget.start()
+        self.addCleanup(budget.stop)
+        with open(self.path, 'rb') as f:
+            self.csvfile = CSVFile(f, self.path.name)
+        db.session.add(self.csvfile)
+        db.session.commit()
+        self.csvfile.index_rows()
+        self.csvfile.infer_column_types()
+
+    def peak_memory(self, function):
+        tracemalloc.start()
+        try:
+            function()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def analyze(self):
+        ColumnAnalysis.query.delete()
+        db.session.commit()
+        self.assertEqual(2, len(self.csvfile.analyses()))
+
+    def test_stdlib_analysis_stays_within_budget(self):
+        with mock.patch.object(parsers, 'memory_budget', self.BUDGET), \
+                mock.patch.object(parsers, 'ARROW_AVAILABLE', False):
+            self.assertEqual('stdlib', self.csvfile.parser().name)
+            self.assertLess(self.peak_memory(self.analyze), self.BUDGET)
+
+    @skipIf(not parsers.ARROW_AVAILABLE, 'pyarrow is not installed')
+    def test_arrow_analysis_stays_within_budget(self):
+        # Memory allocated by Arrow itself isn't traced; the RSS test below covers it
+        with mock.patch.object(parsers, 'memory_budget', self.BUDGET):
+            self.assertEqual('arrow', self.csvfile.parser().name)
+            self.assertLess(self.peak_memory(self.analyze), self.BUDGET)
+
+    def test_preview_stays_within_budget(self):
+        preview = {}
+        self.assertLess(self.peak_memory(lambda: preview.update(self.csvfile.preview())), self.BUDGET)
+        self.assertEqual(len(self.csvfile), preview['numRows'])
+        self.assertEqual(0, preview['numDiscarded'])
+        self.assertEqual(6, len(preview['previewData']))
+
+    def test_budget_must_cover_a_chunk(self):
+        with mock.patch.dict(self.app.config, MEMORY_BUDGET=1):
+            self.assertRaises(ValueError, parsers.init_app, self.app)
+        self.assertEqual(parsers.DEFAULT_MEMORY_BUDGET, parsers.memory_budget)
+
+    def test_budget_is_configured_by_the_app(self):
+        self.addCleanup(parsers.init_app, self.app)
+        with mock.patch.dict(self.app.config, MEMORY_BUDGET=self.BUDGET):
+            parsers.init_app(self.app)
+        self.assertEqual(self.BUDGET // parsers.CHUNK_EXPANSION, parsers.chunk_bytes())
+
+    @skipIf(not parsers.ARROW_AVAILABLE, 'pyarrow is not installed')
+    def test_arrow_columns_are_read_a_block_at_a_time(self):
+        parser = parsers.ArrowParser(self.csvfile.open(), self.csvfile.encoding, self.csvfile.parser().dialect)
+        with mock.patch.object(parsers, 'memory_budget', self.BUDGET), \
+                mock.patch.object(parser.arrow_csv, 'read_csv', side_effect=AssertionError('Read the whole file')):
+            self.assertGreater(sum(1 for _ in parser.batches()[0]), 1)
+            columns = parser.columns()
+            self.assertEqual(columns[1], parser.column(1))
+        self.assertEqual(len(self.csvfile), len(columns[0]))
+
+
+@skipUnless(PROC_STATUS.exists(), 'Resident memory is sampled from /proc')
+class TestResidentMemory(TestCase):
+    BUDGET = 64 << 20
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def analyze(self, size):
+        directory = Path(self.directory.name) / str(size)
+        directory.mkdir()
+        path = directory / 'large.csv'
+        write_large_csv(path, size)
+        env = dict(os.environ, PYTHONPATH=str(Path().absolute()))
+        output = subprocess.run(
+            [sys.executable, '-c', RSS_SCRIPT, str(directory / 'benford.db'), str(path), str(self.BUDGET)],
+            check=True, capture_output=True, text=True, env=env,
+        ).stdout
+        return json.loads(output)
+
+    def test_peak_memory_does_not_grow_with_file_size(self):
+        small = self.analyze(4 << 20)
+        large = self.analyze(24 << 20)
+        self.assertEqual(2, large['columns'])
+        self.assertLess(large['growth'], self.BUDGET)
+        # Six times the data takes about the same memory to analyze
+        self.assertLess(large['growth'] - small['growth'], self.BUDGET // 4)
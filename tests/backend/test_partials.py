@@ -0,0 +1,154 @@
+import concurrent.futures
+import csv
+import io
+import json
+from pathlib import Path
+import tempfile
+
+from benford import parsers, partials
+from benford.models import db
+from benford.models import ColumnAnalysis, CSVFile
+from backend.test_base import CSV_FILES, DatabaseTestCase
+
+
+class TestPartials(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        for path in CSV_FILES:
+            with open(path, 'rb') as f:
+                db.session.add(CSVFile(f, path.name))
+        db.session.commit()
+
+    def compute(self, path, parts):
+        ranges = partials.split_ranges(path.stat().st_size, parts)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=3) as executor:
+            starts, ends = zip(*ranges)
+            return list(executor.map(partials.compute_partial, [path] * len(ranges), starts, ends))
+
+    def test_split_ranges(self):
+        self.assertEqual([[0, 3], [3, 6], [6, 10]], partials.split_ranges(10, 3))
+        self.assertEqual([[0, 1], [1, 2]], partials.split_ranges(2, 5))
+
+    def test_range_rows_cover_every_record_once(self):
+        for path in CSV_FILES:
+            with open(path, 'rb') as f:
+                data = f.read()
+            parser = parsers.StdlibParser(io.BytesIO(data), 'utf-8', csv.excel)
+            all_rows = list(parser.rows())
+            for parts in [1, 2, 7, 50]:
+                rows = [row for start, end in partials.split_ranges(len(data), parts)
+                        for row in parser.range_rows(start, end)]
+                self.assertEqual(all_rows, rows, (path.name, parts))
+
+    def test_worker_processes_match_analysis(self):
+        for path in CSV_FILES:
+            csvfile = CSVFile.query.filter_by(filename=path.name).one()
+            results = self.compute(path, 5)
+            # Partials survive a round trip through JSON, as they would between machines
+            merged = partials.merge_partials(json.loads(json.dumps(results)))
+            self.assertEqual([[0, path.stat().st_size]], merged['ranges'])
+            self.assertEqual(len(csvfile.viable_rows()), merged['numRows'])
+            self.assertEqual(csvfile.analyses(), partials.finalize(merged))
+
+    def test_merging_is_associative(self):
+        a, b, c = self.compute(CSV_FILES[0], 3)
+        self.assertEqual(
+            partials.merge_partials([a, b, c]),
+            partials.merge_partials([c, partials.merge_partials([b, a])])
+        )
+
+    def test_rejects_overlapping_partials(self):
+        a, b = self.compute(CSV_FILES[0], 2)
+        self.assertRaises(partials.PartialError, partials.merge_partials, [a, b, b])
+
+    def test_rejects_malformed_partials(self):
+        a, b = self.compute(CSV_FILES[0], 2)
+        for bad in [[], [a, {'version': 99}], [a, dict(b, columns=b['columns'][1:])], [a, {'version': 1}]]:
+            self.assertRaises(partials.PartialError, partials.merge_partials, bad)
+
+    def test_finalize_requires_start_of_file(self):
+        _, b = self.compute(CSV_FILES[0], 2)
+        self.assertRaises(partials.PartialError, partials.finalize, partials.merge_partials([b]))
+
+    def test_finalize_requires_whole_file(self):
+        a, _, c = self.compute(CSV_FILES[0], 3)
+        merged = partials.merge_partials([a, c])
+        self.assertFalse(partials.is_complete(merged))
+        self.assertRaises(partials.PartialError, partials.finalize, merged)
+
+
+def write_quoted_csv(path, rows):
+    # Notes with quoted newlines, commas and doubled quotes, so most lines don't start a record
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['id', 'note', 'amount'])
+        for i in range(rows):
+            note = '\n'.join(f'line {j}, "quoted" {i}' for j in range(i % 4))
+            writer.writerow([i + 1, note, f'{(i * 7919) % 10007 + 1}.{i % 100:02}'])
+
+
+class TestAlignedRanges(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = Path(self.directory.name) / 'quoted.csv'
+        write_quoted_csv(self.path, 2000)
+
+    def tearDown(self):
+        self.directory.cleanup()
+        super().tearDown()
+
+    def test_record_boundary(self):
+        data = b'a,b\n1,"x\ny"\n2,"z"\n'
+        self.assertEqual(4, partials.record_boundary(data, 0, False, b'"'))
+        # Inside the quoted field, the next newline outside quotes is after 'y"'
+        self.assertEqual(12, partials.record_boundary(data, 8, True, b'"'))
+        self.assertEqual(12, partials.record_boundary(data, 4, False, b'"'))
+        self.assertEqual(len(data), partials.record_boundary(data, 13, False, b'"'))
+
+    def test_ranges_start_at_records(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        parser = parsers.StdlibParser(io.BytesIO(data), 'utf-8', csv.excel)
+        all_rows = list(parser.rows())
+        for parts in [1, 2, 3, 8, 64]:
+            ranges = partials.aligned_ranges(self.path, parts)
+            self.assertEqual(0, ranges[0][0])
+            self.assertEqual(len(data), ranges[-1][1])
+            rows = [row for start, end in ranges for row in parser.range_rows(start, end)]
+            self.assertEqual(all_rows, rows, parts)
+
+    def test_parallel_analyses_match_serial(self):
+        for path in [*CSV_FILES, self.path]:
+            with open(path, 'rb') as f:
+                csvfile = CSVFile(f, path.name)
+            db.session.add(csvfile)
+            db.session.commit()
+            expected = csvfile.analyses()
+            ColumnAnalysis.query.delete()
+            db.session.commit()
+            self.assertEqual(expected, partials.parallel_analyses(csvfile, 3), path.name)
+            # Every column is cached, typed by all of its cells
+            self.assertEqual(len(csvfile.infer_column_types()), ColumnAnalysis.query.count())
+
+    def test_literal_quotes_fall_back_to_serial(self):
+        # A quote inside an unquoted field is data, but counting it throws the parity off
+        with open(self.path, 'rb') as f:
+            header, rest = f.read().split(b'\n', 1)
+        with open(self.path, 'wb') as f:
+            f.write(header + b'\n0,27" screen,1.5\n' + rest)
+        with open(self.path, 'rb') as f:
+            csvfile = CSVFile(f, self.path.name)
+        db.session.add(csvfile)
+        db.session.commit()
+        self.assertRaises(partials.PartialError, partials.parallel_partial, self.path, 4)
+        expected = csvfile.analyses()
+        ColumnAnalysis.query.delete()
+        db.session.commit()
+        self.assertEqual(expected, partials.parallel_analyses(csvfile, 4))
+
+    def test_escaped_quotes_cannot_be_aligned(self):
+        dialect = type('Escaped', (csv.excel,), {'escapechar': '\\'})
+        self.assertRaises(partials.PartialError, partials.split_quote, dialect, 'utf-8')
+        self.assertRaises(partials.PartialError, partials.split_quote, csv.excel, 'utf-16')
+        self.assertEqual(b'"', partials.split_quote(csv.excel, 'ascii'))
@@ -1,8 +1,8 @@
 from datetime import datetime
 
-from benford.database import db
+from benford.models import db
 from benford.models import CSVFile
-from benford.schema import CSVSchema, PreviewSchema, AnalysisSchema
+from benford.api import CSVSchema, PreviewSchema, AnalysisSchema
 from backend.test_base import CSV_FILES, DATETIME_FSTRING, AppTestCase
 
 
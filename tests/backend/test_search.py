@@ -0,0 +1,134 @@
+import json
+
+import sqlalchemy
+
+from benford.migrations import backfill_summaries, reconcile_blobs
+from benford.models import ColumnSummary, CSVFile, db
+from backend.test_base import CSV_FILES, DatabaseTestCase
+
+
+class TestColumnSummaries(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        for path in CSV_FILES:
+            with open(path, 'rb') as f:
+                db.session.add(CSVFile(f, path.name))
+        db.session.commit()
+
+    def analyze_all(self):
+        return {csvfile.id: csvfile.analyses() for csvfile in CSVFile.query.order_by(CSVFile.id)}
+
+    def summaries(self, csv_file_id):
+        query = ColumnSummary.query.filter_by(csv_file_id=csv_file_id).order_by(ColumnSummary.column_index)
+        return [(summary.column_index, summary.name, summary.n, summary.test_statistic, summary.fails_0_01)
+                for summary in query]
+
+    def expected_summaries(self, results):
+        return [(result['index'], result['name'], result['n'], result['testStatistic'],
+                 result['goodnessOfFit']['0.01']) for result in results]
+
+    def get(self, url, **params):
+        query = '&'.join(f'{key}={json.dumps(value) if key == "filter" else value}' for key, value in params.items())
+        response = self.app.test_client().get(f'{url}?{query}' if query else url)
+        return response.status_code, response.get_json()
+
+    def test_summaries_are_written_after_analysis(self):
+        self.assertEqual(0, ColumnSummary.query.count())
+        for csv_file_id, results in self.analyze_all().items():
+            self.assertEqual(self.expected_summaries(results), self.summaries(csv_file_id))
+
+    def test_uploads_of_analyzed_content_are_summarized(self):
+        analyses = self.analyze_all()
+        first_id = min(analyses)
+        with open(CSV_FILES[0], 'rb') as f:
+            copy = CSVFile(f, 'copy.csv')
+        db.session.add(copy)
+        db.session.commit()
+        self.assertEqual(self.summaries(first_id), self.summaries(copy.id))
+
+    def test_summaries_are_deleted_with_their_file(self):
+        self.analyze_all()
+        csvfile = CSVFile.query.order_by(CSVFile.id).first()
+        csv_file_id = csvfile.id
+        db.session.delete(csvfile)
+        db.session.commit()
+        self.assertEqual([], self.summaries(csv_file_id))
+
+        CSVFile.query.delete()
+        db.session.commit()
+        reconcile_blobs()
+        self.assertEqual(0, ColumnSummary.query.count())
+
+    def test_files_analyzed_through_shared_content_are_summarized(self):
+        # The copy is uploaded before its content has been analyzed, so there is nothing to copy yet
+        with open(CSV_FILES[0], 'rb') as f:
+            copy = CSVFile(f, 'copy.csv')
+        db.session.add(copy)
+        db.session.commit()
+        ids = [csvfile.id for csvfile in CSVFile.query.filter_by(sha256=copy.sha256).order_by(CSVFile.id)]
+        client = self.app.test_client()
+        for csv_file_id in ids:
+            self.assertEqual(200, client.get(f'/csv/{csv_file_id}/analysis').status_code)
+        first, second = (self.summaries(csv_file_id) for csv_file_id in ids)
+        self.assertTrue(first)
+        self.assertEqual(first, second)
+
+    def test_backfill_from_cached_analyses(self):
+        analyses = self.analyze_all()
+        ColumnSummary.query.delete()
+        db.session.commit()
+        backfill_summaries()
+        for csv_file_id, results in analyses.items():
+            self.assertEqual(self.expected_summaries(results), self.summaries(csv_file_id))
+
+    def test_filter_and_sort_columns(self):
+        analyses = self.analyze_all()
+        status, data = self.get('/columns', sort='-n,test_statistic', filter=[
+            {'name': 'fails_0_01', 'op': 'eq', 'val': True},
+            {'name': 'n', 'op': 'ge', 'val': 50},
+            {'name': 'csv', 'op': 'has', 'val': {'name': 'date_created', 'op': 'ge', 'val': '2000-01-01'}},
+        ])
+        self.assertEqual(200, status)
+        expected = sorted(
+            ((result['n'], result['testStatistic'], result['name'])
+             for results in analyses.values() for result in results
+             if result['goodnessOfFit']['0.01'] and result['n'] >= 50),
+            key=lambda column: (-column[0], column[1])
+        )
+        self.assertTrue(expected)
+        self.assertEqual(expected, [(record['attributes']['n'], record['attributes']['testStatistic'],
+                                     record['attributes']['name']) for record in data['data']])
+
+        status, data = self.get('/columns', filter=[
+            {'name': 'csv', 'op': 'has', 'val': {'name': 'date_created', 'op': 'ge', 'val': '2999-01-01'}},
+        ])
+        self.assertEqual([], data['data'])
+
+    def test_filter_files_by_their_columns(self):
+        analyses = self.analyze_all()
+        passing = [str(csv_file_id) for csv_file_id, results in analyses.items()
+                   if any(not result['goodnessOfFit']['0.10'] for result in results)]
+        self.assertTrue(passing)
+        status, data = self.get('/csv', filter=[
+            {'name': 'columns', 'op': 'any', 'val': {'name': 'fails_0_10', 'op': 'eq', 'val': False}},
+        ])
+        self.assertEqual(200, status)
+        self.assertEqual(passing, [record['id'] for record in data['data']])
+
+    def test_columns_of_one_file(self):
+        analyses = self.analyze_all()
+        csv_file_id = min(analyses)
+        status, data = self.get(f'/csv/{csv_file_id}/columns', sort='column_index')
+        self.assertEqual(200, status)
+        self.assertEqual([result['name'] for result in analyses[csv_file_id]],
+                         [record['attributes']['name'] for record in data['data']])
+
+    def test_invalid_filters_are_rejected(self):
+        status, _ = self.get('/columns', filter=[{'name': 'missing', 'op': 'eq', 'val': 1}])
+        self.assertEqual(400, status)
+
+    def test_failing_columns_query_uses_index(self):
+        query = ColumnSummary.query.filter(ColumnSummary.fails_0_01.is_(True), ColumnSummary.n > 10000)
+        statement = query.statement.compile(db.engine, compile_kwargs={'literal_binds': True})
+        plan = db.session.execute(sqlalchemy.text(f'EXPLAIN QUERY PLAN {statement}')).all()
+        self.assertIn('ix_column_summary_fails_0_01_n', ' '.join(row[-1] for row in plan))
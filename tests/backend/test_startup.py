@@ -0,0 +1,81 @@
+import json
+import os
+from pathlib import Path
+import subprocess
+import sys
+import tempfile
+from unittest import TestCase
+
+import sqlalchemy
+
+from backend.test_base import CSV_FILES
+
+# Generous enough for slow CI machines; catches heavy imports creeping back into startup
+STARTUP_BUDGET = 3.0
+HEAVY_MODULES = ['flask_rest_jsonapi', 'marshmallow_jsonapi', 'chardet', 'pyarrow', 'numpy']
+
+WORKER_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+from benford.app import create_app
+app = create_app(sys.argv[1])
+elapsed = time.perf_counter() - start
+loaded = [name for name in sys.argv[3:] if name in sys.modules]
+with open(sys.argv[2], 'rb') as f:
+    status = app.test_client().post('/upload', data={'csv': (f, 'upload.csv')}).status_code
+after_request = [name for name in sys.argv[3:] if name in sys.modules]
+print(json.dumps({'elapsed': elapsed, 'loaded': loaded, 'status': status, 'afterRequest': after_request}))
+'''
+
+
+class TestStartup(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.db_path = str(Path(self.directory.name) / 'benford.db')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def run_python(self, *args):
+        env = dict(os.environ, PYTHONPATH=str(Path().absolute()))
+        return subprocess.run([sys.executable, *args], check=True, capture_output=True, text=True, env=env).stdout
+
+    def start_worker(self):
+        output = self.run_python('-c', WORKER_SCRIPT, self.db_path, str(CSV_FILES[0]), *HEAVY_MODULES)
+        return json.loads(output)
+
+    def tables(self):
+        return set(sqlalchemy.inspect(sqlalchemy.create_engine(f'sqlite:///{self.db_path}')).get_table_names())
+
+    def test_new_database_gets_schema(self):
+        self.run_python('-c', f'from benford.app import create_app; create_app({self.db_path!r})')
+        self.assertIn('csv_file', self.tables())
+
+    def test_existing_database_is_left_alone(self):
+        sqlalchemy.create_engine(f'sqlite:///{self.db_path}').connect().close()
+        self.run_python('-c', f'from benford.app import create_app; create_app({self.db_path!r})')
+        self.assertEqual(set(), self.tables())
+
+    def test_heavy_modules_load_on_first_use(self):
+        self.run_python('-c', f'from benford.app import create_app; create_app({self.db_path!r})')
+        result = self.start_worker()
+        self.assertEqual([], result['loaded'])
+        self.assertLess(result['elapsed'], STARTUP_BUDGET)
+        # Uploading detects the encoding and renders the JSON:API response
+        self.assertEqual(201, result['status'])
+        self.assertIn('chardet', result['afterRequest'])
+        self.assertIn('flask_rest_jsonapi', result['afterRequest'])
+
+
+class TestServe(TestCase):
+    def test_warm_up_loads_views_before_forking(self):
+        from benford.app import LazyResource, create_app
+        from benford.serve import warm_up
+
+        with tempfile.TemporaryDirectory() as directory:
+            app = create_app(str(Path(directory) / 'benford.db'))
+            warm_up(app)
+        views = [view for view in app.view_functions.values() if isinstance(view, LazyResource)]
+        self.assertTrue(views)
+        self.assertTrue(all(view.view is not None for view in views))
+        self.assertIn('chardet', sys.modules)
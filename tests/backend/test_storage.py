@@ -0,0 +1,248 @@
+import bz2
+import gc
+import gzip
+import hashlib
+import io
+import lzma
+import mmap
+import warnings
+import zipfile
+from unittest import mock
+
+import sqlalchemy
+
+from benford.app import insert_upload
+from benford.migrations import migrate_blobs, reconcile_blobs
+from benford.models import Blob, ColumnAnalysis, CSVFile, db
+from benford.storage import detect_compression, store
+from backend.test_base import CSV_FILES, DatabaseTestCase
+
+
+class TestBlobStore(DatabaseTestCase):
+    def test_put_is_content_addressed(self):
+        """Identical content is stored once under its SHA-256 digest"""
+        first, size, created = store.put(io.BytesIO(b'4,5,6,7\n'))
+        second, _, created_again = store.put(io.BytesIO(b'4,5,6,7\n'))
+        self.assertEqual(first, second)
+        self.assertEqual(8, size)
+        self.assertEqual((True, False), (created, created_again))
+        self.assertTrue(store.exists(store.relative_path(first)))
+
+    def test_open_returns_memory_map(self):
+        digest, _, _ = store.put(io.BytesIO(b'1,2,3\n'))
+        buffer = store.open(store.relative_path(digest))
+        self.assertIsInstance(buffer, mmap.mmap)
+        self.assertEqual(b'1,2,3\n', buffer[:])
+
+    def test_open_empty_blob(self):
+        digest, _, _ = store.put(io.BytesIO(b''))
+        self.assertEqual(b'', store.open(store.relative_path(digest)).read())
+
+    def test_csvfile_keeps_only_hash_and_path(self):
+        with open(CSV_FILES[0], 'rb') as f:
+            csvfile = CSVFile(f, CSV_FILES[0].name)
+            f.seek(0)
+            self.assertEqual(f.read(), store.full_path(csvfile.blob.path).read_bytes())
+        self.assertIsNone(csvfile.legacy_file)
+        self.assertEqual(store.relative_path(csvfile.blob.sha256), csvfile.blob.path)
+
+
+class TestDeduplication(DatabaseTestCase):
+    def add(self, path, filename):
+        with open(path, 'rb') as f:
+            csvfile = CSVFile(f, filename)
+        db.session.add(csvfile)
+        db.session.commit()
+        return csvfile
+
+    def test_identical_uploads_share_blob(self):
+        first = self.add(CSV_FILES[0], 'first.csv')
+        second = self.add(CSV_FILES[0], 'second.csv')
+        self.add(CSV_FILES[1], 'other.csv')
+        self.assertEqual(first.sha256, second.sha256)
+        self.assertEqual(2, Blob.query.count())
+        self.assertEqual(2, db.session.get(Blob, first.sha256).refcount)
+
+    def test_failed_concurrent_upload_keeps_shared_file(self):
+        # Two uploads of the same new content, the first of which wrote the file but failed
+        data = b'amount,quantity\n17,1\n42,2\n'
+        loser = CSVFile(io.BytesIO(data), 'loser.csv')
+        winner = CSVFile(io.BytesIO(data), 'winner.csv')
+        self.assertIsNot(loser.blob, winner.blob)
+        db.session.add(winner)
+        db.session.commit()
+        loser.discard()
+        self.assertTrue(store.exists(winner.blob.path))
+
+        # Content that nothing stored is removed by the upload that wrote it, and only by that one
+        orphan = CSVFile(io.BytesIO(b'amount,quantity\n19,1\n'), 'orphan.csv')
+        CSVFile(io.BytesIO(b'amount,quantity\n19,1\n'), 'other.csv').discard()
+        self.assertTrue(store.exists(orphan.blob.path))
+        orphan.discard()
+        self.assertFalse(store.exists(orphan.blob.path))
+
+    def test_conflicting_blob_insert_adopts_stored_blob(self):
+        data = b'amount,quantity\n3,1\n5,2\n'
+        first = CSVFile(io.BytesIO(data), 'first.csv')
+        second = CSVFile(io.BytesIO(data), 'second.csv')
+        insert_upload(first)
+        insert_upload(second)
+        self.assertIs(first.blob, second.blob)
+        self.assertEqual(2, db.session.get(Blob, first.sha256).refcount)
+
+    def test_identical_uploads_share_analyses(self):
+        first = self.add(CSV_FILES[0], 'first.csv')
+        second = self.add(CSV_FILES[0], 'second.csv')
+        expected = [first.analysis(col) for col in first.viable_columns()]
+        with mock.patch.object(CSVFile, 'parser', side_effect=AssertionError('Analysis was recomputed')):
+            self.assertEqual(expected, second.analyses())
+        self.assertEqual(len(expected), ColumnAnalysis.query.count())
+
+    def test_concurrent_analyses_of_shared_blob(self):
+        """A request that finishes analyzing a column after another has cached it still succeeds"""
+        first = self.add(CSV_FILES[0], 'first.csv')
+        column_index = first.viable_columns()[0]
+        scan = first.scan_column(column_index)
+        next(scan)
+        # Another worker caches the same column while this one is still reading it
+        expected = self.add(CSV_FILES[0], 'second.csv').analysis(column_index)
+        db.session.expunge(db.session.get(ColumnAnalysis, (first.sha256, column_index)))
+        with self.assertRaises(StopIteration) as stop:
+            while True:
+                next(scan)
+        self.assertEqual(expected, stop.exception.value[0])
+        self.assertEqual(1, ColumnAnalysis.query.filter_by(sha256=first.sha256).count())
+
+    def test_deleting_one_record_keeps_shared_blob(self):
+        first = self.add(CSV_FILES[0], 'first.csv')
+        second = self.add(CSV_FILES[0], 'second.csv')
+        first.analyses()
+        path = first.blob.path
+
+        db.session.delete(first)
+        db.session.commit()
+        self.assertEqual(1, db.session.get(Blob, second.sha256).refcount)
+        self.assertTrue(store.exists(path))
+        self.assertEqual(CSV_FILES[0].read_bytes(), second.file)
+
+        db.session.delete(second)
+        db.session.commit()
+        self.assertEqual(0, Blob.query.count())
+        self.assertEqual(0, ColumnAnalysis.query.count())
+        self.assertFalse(store.exists(path))
+
+    def test_reconcile_after_bulk_delete(self):
+        """Bulk deletes skip the reference counting, which reconcile_blobs() catches up on"""
+        csvfile = self.add(CSV_FILES[0], 'first.csv')
+        path = csvfile.blob.path
+        CSVFile.query.delete()
+        db.session.commit()
+        self.assertEqual(1, Blob.query.count())
+
+        self.assertEqual([path], reconcile_blobs())
+        self.assertEqual(0, Blob.query.count())
+        self.assertFalse(store.exists(path))
+
+
+class TestMigrateBlobs(DatabaseTestCase):
+    def test_migrates_legacy_table(self):
+        """Rows from before the blob store are moved out of the database"""
+        with open(CSV_FILES[0], 'rb') as f:
+            contents = f.read()
+        with db.engine.begin() as connection:
+            CSVFile.__table__.drop(connection)
+            connection.execute(sqlalchemy.text(
+                'CREATE TABLE csv_file (id INTEGER PRIMARY KEY, date_created DATETIME, '
+                'filename VARCHAR(120) NOT NULL UNIQUE, file BLOB NOT NULL, encoding VARCHAR(32) NOT NULL)'
+            ))
+            connection.execute(
+                sqlalchemy.text("INSERT INTO csv_file (filename, file, encoding) VALUES ('legacy.csv', :file, 'ascii')"),
+                {'file': contents}
+            )
+
+        self.assertEqual(1, migrate_blobs())
+
+        csvfile = CSVFile.query.one()
+        self.assertIsNone(csvfile.legacy_file)
+        self.assertEqual(contents, csvfile.file)
+        self.assertEqual(0, migrate_blobs())
+
+
+class TestCompressedUploads(DatabaseTestCase):
+    def compressed(self, compression, path):
+        contents = path.read_bytes()
+        if compression == 'gzip':
+            return gzip.compress(contents)
+        if compression == 'bz2':
+            return bz2.compress(contents)
+        if compression == 'xz':
+            return lzma.compress(contents)
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            zip_file.writestr(path.name, contents)
+        return archive.getvalue()
+
+    def test_detect_compression(self):
+        for compression in ['gzip', 'bz2', 'xz', 'zip']:
+            data = io.BytesIO(self.compressed(compression, CSV_FILES[0]))
+            self.assertEqual(compression, detect_compression(data))
+            self.assertEqual(0, data.tell())
+        self.assertIsNone(detect_compression(io.BytesIO(CSV_FILES[0].read_bytes())))
+
+    def test_compressed_uploads_match_uncompressed(self):
+        for path in CSV_FILES:
+            with open(path, 'rb') as f:
+                plain = CSVFile(f, path.name)
+            db.session.add(plain)
+            for compression in ['gzip', 'bz2', 'xz', 'zip']:
+                csvfile = CSVFile(io.BytesIO(self.compressed(compression, path)), f'{path.name}.{compression}')
+                db.session.add(csvfile)
+                db.session.commit()
+
+                # Only the compressed bytes are stored
+                self.assertLess(csvfile.blob.size, path.stat().st_size)
+                self.assertEqual(plain.encoding, csvfile.encoding)
+                self.assertEqual(list(plain.reader()), list(csvfile.reader()))
+                self.assertEqual(plain.viable_columns(), csvfile.viable_columns())
+                self.assertEqual(plain.preview(), csvfile.preview())
+                self.assertEqual(plain.analyses(), csvfile.analyses())
+
+    def test_reads_close_their_files(self):
+        with open(CSV_FILES[0], 'rb') as f:
+            csvfile = CSVFile(f, CSV_FILES[0].name)
+        with csvfile.parser() as parser:
+            self.assertIsInstance(parser.file, mmap.mmap)
+        self.assertTrue(parser.file.closed)
+
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always', ResourceWarning)
+            for compression in ['gzip', 'bz2', 'xz', 'zip']:
+                csvfile = CSVFile(io.BytesIO(self.compressed(compression, CSV_FILES[0])), compression)
+                db.session.add(csvfile)
+                db.session.commit()
+                csvfile.preview()
+                csvfile.analyses()
+                # Rows that are left unread close the file along with their generator
+                next(csvfile.dump(1, 10))
+                gc.collect()
+        self.assertEqual([], [str(warning.message) for warning in caught
+                              if issubclass(warning.category, ResourceWarning)])
+
+    def test_upload_compressed_file(self):
+        client = self.app.test_client()
+        data = self.compressed('gzip', CSV_FILES[0])
+        response = client.post('/upload', data={'csv': (io.BytesIO(data), CSV_FILES[0].name + '.gz')})
+        self.assertEqual(201, response.status_code)
+        self.assertEqual(CSV_FILES[0].read_bytes(), CSVFile.query.one().file)
+
+    def test_upload_corrupt_or_ambiguous_archives(self):
+        client = self.app.test_client()
+        two_members = io.BytesIO()
+        with zipfile.ZipFile(two_members, 'w') as zip_file:
+            zip_file.writestr('a.csv', '1,2\n')
+            zip_file.writestr('b.csv', '3,4\n')
+        for data in [self.compressed('gzip', CSV_FILES[0])[:40], two_members.getvalue()]:
+            response = client.post('/upload', data={'csv': (io.BytesIO(data), 'broken.csv.gz')})
+            self.assertEqual(422, response.status_code)
+            self.assertFalse(store.exists(store.relative_path(hashlib.sha256(data).hexdigest())))
+        self.assertEqual(0, CSVFile.query.count())
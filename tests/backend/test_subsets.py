@@ -0,0 +1,156 @@
+import csv
+import json
+from pathlib import Path
+import tempfile
+from unittest import TestCase, mock
+
+from benford import parsers, subsets, util
+from benford.cache import datasets
+from benford.models import db
+from benford.models import CSVFile
+from backend.test_base import CSV_FILES, DatabaseTestCase
+
+
+class TestPredicates(TestCase):
+    HEADER = ['state', 'age', 'dollar']
+
+    def test_numbers(self):
+        for cell, value in [('12', 12), ('$2,731.23', 2731.23), ('(37)', -37), (' -0.5 ', -0.5),
+                            ('-$1e3', -1000), ('£.25', 0.25)]:
+            self.assertEqual(value, subsets.number(cell), cell)
+        for cell in ['', 'NC', 'N/A', '1-2']:
+            self.assertIsNone(subsets.number(cell), cell)
+
+    def test_operators(self):
+        def matches(op, value, cells):
+            test = subsets.matcher(op, value)
+            return [cell for cell in cells if test(cell)]
+
+        cells = ['NC', 'TN', '18', '$53.00', '', 'x']
+        self.assertEqual(['NC'], matches('eq', 'NC', cells))
+        self.assertEqual(['18'], matches('eq', 18, cells))
+        self.assertEqual(['TN', '18', '$53.00', '', 'x'], matches('ne', 'NC', cells))
+        self.assertEqual(['NC', '$53.00'], matches('in', ['NC', 53], cells))
+        self.assertEqual(['18'], matches('lt', 53, cells))
+        self.assertEqual(['18', '$53.00'], matches('le', 53, cells))
+        self.assertEqual(['$53.00'], matches('gt', 18, cells))
+        self.assertEqual(['18', '$53.00'], matches('between', [18, 53], cells))
+
+    def test_columns_by_index_or_name(self):
+        predicates = subsets.parse_predicates([
+            {'column': 'state', 'op': 'eq', 'val': 'NC'},
+            {'column': 1, 'op': 'ge', 'val': 21},
+        ], self.HEADER)
+        self.assertEqual([0, 1], [index for index, _ in predicates])
+        rows = [['NC', '30', '1'], ['NC', '20', '2'], ['TN', '40', '3'], ['NC', '50']]
+        self.assertEqual([['NC', '30', '1']], list(subsets.select(rows, 3, predicates)))
+
+    def test_invalid_predicates(self):
+        for where in [{}, [{'column': 'zip', 'op': 'eq', 'val': '1'}], [{'column': 3, 'op': 'eq', 'val': '1'}],
+                      [{'column': 0, 'op': 'like', 'val': '1'}], [{'column': 0, 'op': 'eq'}],
+                      [{'column': 0, 'op': 'lt', 'val': '5'}], [{'column': 0, 'op': 'between', 'val': [1]}],
+                      [{'column': 0, 'op': 'in', 'val': []}], [{'column': 0, 'op': 'eq', 'val': None}]]:
+            self.assertRaises(subsets.SubsetError, subsets.parse_predicates, where, self.HEADER)
+
+
+class TestSubsetAnalysis(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        with open(CSV_FILES[0], 'rb') as f:
+            csvfile = CSVFile(f, CSV_FILES[0].name)
+        db.session.add(csvfile)
+        db.session.commit()
+        self.csv_file_id = csvfile.id
+        self.rows = list(csvfile.dump())
+
+    def csvfile(self):
+        return db.session.get(CSVFile, self.csv_file_id)
+
+    def viable(self, start=1, end=None):
+        # The fixture has ragged rows, which subsets leave out
+        return [row for row in self.rows[start:end] if len(row) == len(self.rows[0])]
+
+    def expected(self, rows, column):
+        counts = util.DigitCounts()
+        counts.update([row[column] for row in rows])
+        return counts.statistics()
+
+    def test_range(self):
+        results, meta = self.csvfile().subset_analyses(20, 60, columns=[8, 3])
+        self.assertEqual({'numRows': len(self.viable(20, 60))}, meta)
+        self.assertEqual([8, 3], [result['index'] for result in results])
+        self.assertEqual(['dollar', 'age'], [result['name'] for result in results])
+        for result in results:
+            self.assertEqual(self.expected(self.viable(20, 60), result['index'])['observedDistribution'],
+                             result['observedDistribution'])
+
+    def test_whole_file_matches_analysis(self):
+        csvfile = self.csvfile()
+        results, meta = csvfile.subset_analyses()
+        self.assertEqual(len(self.viable()), meta['numRows'])
+        self.assertEqual(csvfile.analyses(), results)
+
+    def test_predicates(self):
+        where = [{'column': 'state', 'op': 'in', 'val': ['NC', 'TN', 'CA']},
+                 {'column': 'age', 'op': 'between', 'val': [30, 60]}]
+        results, meta = self.csvfile().subset_analyses(where=where, columns=[8])
+        selected = [row for row in self.viable() if row[6] in ('NC', 'TN', 'CA') and 30 <= int(row[3]) <= 60]
+        self.assertTrue(selected)
+        self.assertEqual(len(selected), meta['numRows'])
+        self.assertEqual(self.expected(selected, 8)['observedDistribution'], results[0]['observedDistribution'])
+
+    def test_empty_subsets_are_not_tested(self):
+        csvfile = self.csvfile()
+        for kwargs in [{'where': [{'column': 'state', 'op': 'eq', 'val': 'Nowhere'}]}, {'start': 10 ** 6}]:
+            results, meta = csvfile.subset_analyses(columns=[8], **kwargs)
+            self.assertEqual(0, meta['numRows'])
+            self.assertEqual(0, results[0]['n'])
+            self.assertIsNone(results[0]['testStatistic'])
+            self.assertIsNone(results[0]['goodnessOfFit'])
+
+    def test_ranges_seek_through_the_row_index(self):
+        with mock.patch.object(parsers, 'ROW_INDEX_INTERVAL', 10):
+            csvfile = self.csvfile()
+            csvfile.blob.row_index = None
+            csvfile.index_rows()
+        rows = parsers.StdlibParser.rows
+        with mock.patch.object(parsers.StdlibParser, 'rows', autospec=True, side_effect=rows) as parsed:
+            results, meta = csvfile.subset_analyses(55, 65, columns=[3])
+        self.assertEqual(len(self.viable(55, 65)), meta['numRows'])
+        offsets = [call.args[1] for call in parsed.call_args_list if len(call.args) > 1]
+        self.assertIn(csvfile.index_rows().locate(55)[0], offsets)
+        self.assertEqual(self.expected(self.viable(55, 65), 3)['observedDistribution'],
+                         results[0]['observedDistribution'])
+
+    def test_cached_table_matches_file(self):
+        # Rows of the cached table are only numbered as in the file when no rows are ragged
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'viable.csv'
+            with open(path, 'w', newline='') as f:
+                csv.writer(f).writerows(self.viable(0))
+            with open(path, 'rb') as f:
+                csvfile = CSVFile(f, path.name)
+        db.session.add(csvfile)
+        db.session.commit()
+        with mock.patch.object(datasets, 'budget', 0):
+            expected = csvfile.subset_analyses(5, 50)
+        datasets.clear()
+        csvfile.preview()
+        with mock.patch.object(CSVFile, 'dump', side_effect=AssertionError('Read from the file')):
+            self.assertEqual(expected, csvfile.subset_analyses(5, 50))
+
+    def test_endpoint(self):
+        client = self.app.test_client()
+        where = json.dumps([{'column': 'state', 'op': 'eq', 'val': 'NC'}])
+        response = client.get(f'/csv/{self.csv_file_id}/analysis/subset?start=10&end=90&columns=8&where={where}')
+        self.assertEqual(200, response.status_code)
+        data = response.get_json()
+        self.assertEqual({'start': 10, 'end': 90, 'where': json.loads(where),
+                          'numRows': sum(1 for row in self.viable(10, 90) if row[6] == 'NC')}, data['meta'])
+        self.assertEqual('dollar', data['data'][0]['name'])
+
+        for query in ['start=x', 'start=10&end=5', 'columns=80', 'where=[', 'where={}',
+                      'where=[{"column":"zip","op":"lt","val":"x"}]']:
+            response = client.get(f'/csv/{self.csv_file_id}/analysis/subset?{query}')
+            self.assertEqual(400, response.status_code, query)
+        self.assertEqual(404, client.get(f'/csv/{self.csv_file_id + 1}/analysis/subset').status_code)
@@ -0,0 +1,66 @@
+from unittest import TestCase, mock
+
+from benford import tables, util
+
+ROWS = [
+    ['amount', 'label', 'note'],
+    ['1,204.50', 'Nunavut', ''],
+    ['(37)', 'Storage & Organization', 'é'],
+    ['', 'N/A', '€ 12'],
+    ['0.0081', 'x', '\U0001F600'],
+    ['$9e3', 'y', 'z'],
+]
+
+
+class TestTable(TestCase):
+    def test_round_trip(self):
+        table = tables.Table.from_rows(iter(ROWS))
+        self.assertEqual(len(ROWS), len(table))
+        self.assertEqual(ROWS, list(table.rows()))
+        self.assertEqual(ROWS[1:3], list(table.rows(1, 3)))
+        self.assertEqual(ROWS[4:], list(table.rows(4, 100)))
+        self.assertEqual([row[1] for row in ROWS], list(table.column(1)))
+        self.assertEqual('Nunavut', table.column(1)[1])
+        self.assertEqual('z', table.column(2)[-1])
+        self.assertRaises(IndexError, lambda: table.column(0)[len(ROWS)])
+
+    def test_empty(self):
+        table = tables.Table.from_rows([])
+        self.assertEqual(0, len(table))
+        self.assertEqual([], list(table.rows()))
+        header = tables.Table.from_rows([['a', '']])
+        self.assertEqual([['a', '']], list(header.rows()))
+        self.assertEqual([['']], [list(chunk) for chunk, _ in header.column(1).chunks()])
+
+    def test_slices_share_buffers(self):
+        column = tables.Table.from_rows(ROWS).column(0)
+        view = column[2:5]
+        self.assertIs(column.text, view.text)
+        self.assertIs(column.offsets.obj, view.offsets.obj)
+        self.assertEqual([row[0] for row in ROWS[2:5]], list(view))
+        self.assertEqual(['0.0081'], list(view[2:]))
+        self.assertEqual([], list(column[4:2]))
+        self.assertRaises(ValueError, lambda: column[::2])
+
+    def test_chunks(self):
+        with mock.patch.object(tables.parsers, 'PROGRESS_ROWS', 4):
+            table = tables.Table.from_rows(ROWS * 3)
+        chunks = list(table.column(1).chunks(4))
+        self.assertEqual([4, 4, 4, 4, 2], [len(chunk) for chunk, _ in chunks])
+        self.assertEqual([row[1] for row in ROWS * 3], [cell for chunk, _ in chunks for cell in chunk])
+        self.assertEqual({None}, {position for _, position in chunks})
+
+    def test_tally_matches_scan(self):
+        table = tables.Table.from_rows(ROWS * 10)
+        for index in range(3):
+            expected, counts = util.DigitCounts(), util.DigitCounts()
+            expected.update([row[index] for row in ROWS * 10][3:17])
+            table.column(index)[3:17].tally(counts)
+            self.assertEqual((expected.counts, expected.num_other, expected.num_cells),
+                             (counts.counts, counts.num_other, counts.num_cells))
+
+    def test_smaller_than_lists(self):
+        rows = [['amount', 'label']] + [[f'{i * 1.7:.2f}', f'item {i % 97}'] for i in range(10000)]
+        table = tables.Table.from_rows(rows)
+        self.assertEqual(4, table.column(0).offsets.itemsize)
+        self.assertLess(table.nbytes * 4, sum(len(row) * 56 for row in rows))
@@ -0,0 +1,93 @@
+import csv
+from collections import Counter, defaultdict
+import datetime
+from unittest import TestCase
+
+from benford import timeseries, util
+from backend.test_base import CSV_FILES
+
+
+class TestDates(TestCase):
+    def test_detects_month_first_dates(self):
+        self.assertEqual('%m/%d/%Y', timeseries.detect_date_format(['06/01/2049', '10/19/1939']))
+
+    def test_detects_day_first_dates(self):
+        self.assertEqual('%d/%m/%Y', timeseries.detect_date_format(['06/01/2049', '19/10/1939']))
+
+    def test_detects_iso_dates_and_timestamps(self):
+        self.assertEqual('iso', timeseries.detect_date_format(['2021-03-04', '2021-03-05T10:00:00', '']))
+        self.assertEqual(datetime.date(2021, 3, 5), timeseries.parse_date('2021-03-05 10:00:00', 'iso'))
+
+    def test_no_dates(self):
+        self.assertIsNone(timeseries.detect_date_format(['Nunavut', '3', '2021-01-01']))
+        self.assertIsNone(timeseries.detect_date_format([]))
+
+    def test_calendar_windows(self):
+        date = datetime.date(2021, 11, 17)
+        for window, start, end in [
+            ('day', date, date),
+            ('week', datetime.date(2021, 11, 15), datetime.date(2021, 11, 21)),
+            ('month', datetime.date(2021, 11, 1), datetime.date(2021, 11, 30)),
+            ('quarter', datetime.date(2021, 10, 1), datetime.date(2021, 12, 31)),
+            ('year', datetime.date(2021, 1, 1), datetime.date(2021, 12, 31)),
+        ]:
+            self.assertEqual(start, timeseries.window_start(date, window), window)
+            self.assertEqual(end, timeseries.window_end(start, window), window)
+
+    def test_parse_window(self):
+        self.assertEqual('month', timeseries.parse_window('month'))
+        self.assertEqual(30, timeseries.parse_window('30d'))
+        for window in ['fortnight', '0d', '-3d', '99999d']:
+            self.assertRaises(timeseries.WindowError, timeseries.parse_window, window)
+
+
+class TestTimeSeries(TestCase):
+    def setUp(self):
+        with open(CSV_FILES[0]) as f:
+            rows = list(csv.reader(f))
+        self.rows = [row for row in rows if len(row) == len(rows[0])]
+        self.date_column = self.rows[0].index('date')
+        self.column = self.rows[0].index('dollar')
+
+    def test_yearly_windows_match_grouped_rows(self):
+        groups = defaultdict(list)
+        for row in self.rows[1:]:
+            groups[row[self.date_column][-4:]].append(row[self.column])
+
+        data, meta = timeseries.time_series(self.rows, self.date_column, self.column, 'year')
+        self.assertEqual({'dateFormat': '%m/%d/%Y', 'numSkipped': 0}, meta)
+        self.assertEqual(sorted(groups), [window['start'][:4] for window in data])
+        for window in data:
+            digits = util.clean_data(groups[window['start'][:4]])
+            self.assertEqual(window['end'], window['start'][:4] + '-12-31')
+            self.assertEqual(len(digits), window['n'])
+            self.assertEqual(util.observed_distribution(digits), window['observedDistribution'])
+
+    def test_rolling_windows(self):
+        dates = [datetime.date(2021, 1, 1) + datetime.timedelta(days=i % 90) for i in range(900)]
+        rows = [['date', 'amount']] + [[date.isoformat(), str(i + 1)] for i, date in enumerate(dates)]
+
+        data, _ = timeseries.time_series(rows, 0, 1, '30d')
+        self.assertEqual(90, len(data))
+        for window in data:
+            start = datetime.date.fromisoformat(window['start'])
+            end = datetime.date.fromisoformat(window['end'])
+            self.assertEqual(29, (end - start).days)
+            digits = util.clean_data(row[1] for row in rows[1:]
+                                     if window['start'] <= row[0] <= window['end'])
+            self.assertEqual(util.observed_distribution(digits), window['observedDistribution'])
+
+    def test_skips_unparseable_dates(self):
+        rows = [['date', 'amount'], ['2021-01-01', '12'], ['soon', '13'], ['2021-02-01', '31']]
+        data, meta = timeseries.time_series(rows, 0, 1, 'month')
+        self.assertEqual(1, meta['numSkipped'])
+        self.assertEqual([1, 1], [window['n'] for window in data])
+
+    def test_headerless_rows(self):
+        rows = [['2021-01-01', '12'], ['2021-01-02', '13']]
+        data, meta = timeseries.time_series(rows, 0, 1, 'month')
+        self.assertEqual(0, meta['numSkipped'])
+        self.assertEqual(Counter({'1': 2}), +Counter(data[0]['observedDistribution']))
+
+    def test_bad_column(self):
+        self.assertRaises(timeseries.WindowError, timeseries.time_series, self.rows, 99, self.column, 'month')
@@ -44,4 +44,50 @@ describe('Analysis errors', () => {
     cy.get('#analysis-error')
       .should('have.text', 'Note: no numerical data was found for 10% or more of rows in the target column. These rows are not included in the analysis.')
   })
-})
\ No newline at end of file
+})
+
+describe('Analysis request errors', () => {
+  it('Shows the message of a failed analysis request', () => {
+    cy.intercept('GET', '/csv/*/analysis/stream', {
+      statusCode: 422,
+      body: { message: 'Error: This file could not be parsed as a .csv.' },
+    })
+    cy.visit('http://127.0.0.1:8000')
+    cy.get('#uploaded-files-select')
+      .select(csvfiles.valid[0].filename)
+    cy.get('#csv-target-column-select')
+      .select(0)
+    cy.get('#upload-error')
+      .should('have.text', 'Error: This file could not be parsed as a .csv.')
+  })
+
+  it('Shows the rejection of the selected column only', () => {
+    // The stream rejects the first column it analyzes, which is the first viable column
+    cy.intercept('GET', '/csv/*/analysis/stream', req => {
+      req.continue(res => {
+        let rejected = false
+        res.body = res.body.split('\n').map(line => {
+          const event = line && JSON.parse(line)
+          if (!rejected && event && event.event === 'column') {
+            rejected = true
+            return JSON.stringify({ event: 'rejected', data: { index: event.data.index } })
+          }
+          return line
+        }).join('\n')
+      })
+    })
+    cy.visit('http://127.0.0.1:8000')
+    cy.get('#uploaded-files-select')
+      .select(csvfiles.valid[0].filename)
+    cy.get('#csv-target-column-select')
+      .select(1)
+    cy.get('#histogram')
+      .should('exist')
+    cy.get('#upload-error')
+      .should('not.exist')
+    cy.get('#csv-target-column-select')
+      .select(0)
+    cy.get('#upload-error')
+      .should('have.text', 'This column could not be analyzed.')
+  })
+})